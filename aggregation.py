@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+# Reducers offered in the Visualization Settings card
+REDUCERS = ["sum", "mean", "count", "min", "max"]
+
+# Upper bound on the number of points an aggregated chart carries
+MAX_GROUPS = 2000
+
+# Numeric color columns with more distinct values than this are treated as a
+# continuous value (reduced like y) instead of a grouping key
+MAX_COLOR_GROUPS = 20
+
+# Time buckets ordered from finest to coarsest: (label, approximate width, pandas code)
+# Fixed-width buckets use Series.dt.floor, calendar buckets use Series.dt.to_period
+TIME_BUCKETS = [
+    ("second", pd.Timedelta(seconds=1), "s"),
+    ("minute", pd.Timedelta(minutes=1), "min"),
+    ("hour", pd.Timedelta(hours=1), "h"),
+    ("day", pd.Timedelta(days=1), "D"),
+    ("week", pd.Timedelta(weeks=1), "W"),
+    ("month", pd.Timedelta(days=30.44), "M"),
+    ("quarter", pd.Timedelta(days=91.31), "Q"),
+    ("year", pd.Timedelta(days=365.25), "Y"),
+]
+CALENDAR_BUCKETS = {"week", "month", "quarter", "year"}
+
+
+def is_datetime(series):
+    """Return True if the series holds datetime values"""
+    return pd.api.types.is_datetime64_any_dtype(series)
+
+
+def is_ordered(series):
+    """Return True if the series holds numbers or datetimes, i.e. values on a continuous axis"""
+    if pd.api.types.is_bool_dtype(series):
+        return False
+    return pd.api.types.is_numeric_dtype(series) or is_datetime(series)
+
+
+def bin_values(series, bins, low, high):
+    """Replace numeric or datetime values by the start of the one of bins equal-width intervals between low and high they fall in"""
+    width = (high - low) / bins
+    steps = np.floor((series - low) / width).clip(upper=bins - 1)
+    return low + steps * width
+
+
+def choose_time_bucket(series, max_buckets=MAX_GROUPS, stats=None):
+    """Pick the finest time bucket that keeps the series under max_buckets, or None if no bucketing is needed.
+
+    stats is the column's profile; when it describes exactly these values their cardinality and
+    range are taken from it instead of scanning the series.
+    """
+    if stats is not None:
+        if not stats["count"] or stats["cardinality"] <= max_buckets:
+            return None
+        span = stats["max"] - stats["min"]
+    else:
+        values = series.dropna()
+        if values.empty or values.nunique() <= max_buckets:
+            return None
+        span = values.max() - values.min()
+
+    for label, width, _ in TIME_BUCKETS:
+        if span / width <= max_buckets:
+            return label
+    return TIME_BUCKETS[-1][0]
+
+
+def bucket_times(series, bucket):
+    """Truncate datetime values to the start of their bucket"""
+    code = dict((label, code) for label, _, code in TIME_BUCKETS)[bucket]
+    if bucket not in CALENDAR_BUCKETS:
+        return series.dt.floor(code)
+
+    # Periods are timezone-naive, so strip and restore the timezone around the conversion
+    tz = series.dt.tz
+    naive = series.dt.tz_localize(None) if tz is not None else series
+    starts = naive.dt.to_period(code).dt.start_time
+    return starts.dt.tz_localize(tz) if tz is not None else starts
+
+
+def aggregate(df, x_col, y_col, color_col=None, reducer="sum", time_bucket="auto", max_groups=MAX_GROUPS,
+              profile=None, sliced=False):
+    """Group the frame by x (and color) and reduce y so the result has at most max_groups rows per series.
+
+    Numeric and datetime x values beyond max_groups are binned into equal-width intervals, so
+    the chart still spans the whole axis; categorical x keeps the max_groups largest groups.
+
+    profile is the column profile of the table the frame was read from; sliced says the frame
+    is only part of it (e.g. a zoomed range), so the profile's x range does not describe it.
+    Returns the aggregated frame and a dict describing what was done.
+    """
+    profile = profile or {}
+    if reducer not in REDUCERS:
+        raise ValueError(f"Unsupported reducer: {reducer}")
+    if x_col == y_col:
+        # The group key and the reduced values would both become a column named x_col
+        raise ValueError(f"Cannot group '{x_col}' by itself; choose different x and y columns")
+
+    columns = list(dict.fromkeys(col for col in [x_col, y_col, color_col] if col))
+    frame = df[columns]
+    x_values = frame[x_col]
+
+    # Bucket datetime x values so long time series collapse to a bounded number of points
+    bucket = None
+    if is_datetime(x_values):
+        x_stats = profile.get(x_col) if not sliced else None
+        bucket = choose_time_bucket(x_values, max_groups, x_stats) if time_bucket == "auto" else time_bucket
+        if bucket:
+            x_values = bucket_times(x_values, bucket)
+
+    # Too many distinct values on an ordered axis are binned rather than dropped, which would cut gaps into a line
+    bins = None
+    if is_ordered(x_values):
+        x_stats = profile.get(x_col) if not (sliced or bucket) else None
+        distinct = x_stats["cardinality"] if x_stats else x_values.nunique()
+        if distinct > max_groups:
+            bins = max_groups
+            x_values = bin_values(x_values, bins, x_values.min(), x_values.max())
+
+    keys = [x_values.rename(x_col)]
+    reducers = {y_col: reducer}
+
+    # Low-cardinality color columns become a grouping key, continuous ones are reduced alongside y
+    if color_col and color_col not in (x_col, y_col):
+        color_values = frame[color_col]
+        color_stats = profile.get(color_col)
+        cardinality = color_stats["cardinality"] if color_stats else color_values.nunique()
+        if pd.api.types.is_numeric_dtype(color_values) and cardinality > MAX_COLOR_GROUPS:
+            reducers[color_col] = "mean"
+        else:
+            keys.append(color_values)
+
+    grouped = frame[list(reducers)].groupby(keys, sort=True, observed=True)
+    result = grouped.agg(reducers).reset_index()
+
+    # Keep the largest groups when a high-cardinality categorical x column would exceed the point budget
+    truncated = False
+    groups = result[x_col].nunique()
+    if groups > max_groups:
+        totals = result.groupby(x_col, sort=False, observed=True)[y_col].sum().abs()
+        keep = totals.nlargest(max_groups).index
+        result = result[result[x_col].isin(keep)].sort_values(x_col, kind="stable")
+        truncated = True
+
+    info = {
+        "rows": len(df),
+        "points": len(result),
+        "reducer": reducer,
+        "time_bucket": bucket,
+        "bins": bins,
+        "truncated": truncated,
+        "groups": groups,
+    }
+    return result.reset_index(drop=True), info
+
+
+def reduced_label(y_col, reducer):
+    """Axis label for an aggregated y column"""
+    return f"{reducer}({y_col})"
@@ -1,26 +1,87 @@
+import threading
+import time
 import dash
-from dash import dcc, html, callback, Input, Output, State
+import flask
+from dash import dcc, html, Input, Output, State, Patch, ALL
 import dash_bootstrap_components as dbc
-import plotly.express as px
 import plotly.graph_objects as go
 from data_service import DataService
-import base64
+from dataset_registry import DatasetRegistry, DEFAULT_MAX_RESIDENT_BYTES
+from aggregation import REDUCERS, TIME_BUCKETS
+from downsampling import DEFAULT_POINT_BUDGET, parse_relayout
+from charts import DEFAULT_WEBGL_THRESHOLD, build_distribution, chart_reducer, figure_extension, live_state, serialize_figure, apply_theme, theme_template
+from chart_export import ChartExporter, DEFAULT_EXPORT_FORMATS, chart_figure
+from figure_cache import FigureCache
+from csv_ingest import format_memory_summary
+from jobs import JobManager
+from live_refresh import DEFAULT_WATCH_INTERVAL, PrefixWatcher
+import metrics
+from query_engine import MAX_FILTER_VALUES, RANGE_KINDS, combine_filters, filter_key, selection_filters
 import pandas as pd
 from dotenv import load_dotenv
 import os
 
+# When this worker started importing the app, to report how long startup and warming take
+STARTUP_STARTED = time.perf_counter()
+
 load_dotenv()
 
-# Initialize data service
-data_service = DataService(os.getenv("AWS_ACCESS_KEY_ID"),os.getenv("AWS_SECRET_ACCESS_KEY"))
+# Initialize data service with a local cache of downloaded datasets
+data_service = DataService(
+    os.getenv("AWS_ACCESS_KEY_ID"),
+    os.getenv("AWS_SECRET_ACCESS_KEY"),
+    cache_dir=os.getenv("DATASET_CACHE_DIR", ".dataset_cache"),
+    cache_max_bytes=int(os.getenv("DATASET_CACHE_MAX_BYTES", 10 * 1024 ** 3)),
+    part_size=int(os.getenv("S3_PART_SIZE", 8 * 1024 * 1024)),
+    max_concurrency=int(os.getenv("S3_MAX_CONCURRENCY", 8)),
+    zip_workers=int(os.getenv("ZIP_WORKERS", 0)) or None,
+    zip_executor=os.getenv("ZIP_EXECUTOR", "process"),
+    lazy_zip=os.getenv("ZIP_LAZY", "1") != "0",
+    max_open_members=int(os.getenv("ZIP_MAX_OPEN_MEMBERS", 4)),
+    compact_csv=os.getenv("CSV_COMPACT", "1") != "0",
+    backend=os.getenv("QUERY_BACKEND", "pandas"),
+    duckdb_memory_limit=os.getenv("DUCKDB_MEMORY_LIMIT"),
+)
+
+# Datasets open in this worker, keyed by dataset ID; sessions refer to them through the dataset-ref store
+registry = DatasetRegistry(
+    data_service.load_dataset_from_s3,
+    max_bytes=int(os.getenv("DATASET_REGISTRY_MAX_BYTES", DEFAULT_MAX_RESIDENT_BYTES)),
+)
+
+# Cache of serialized figures, keyed by dataset ID
+figure_cache = FigureCache()
+
+# Datasets are loaded in the background so the app keeps serving the current one meanwhile.
+# Job state is shared through the cache directory so any worker can report a load's progress
+job_manager = JobManager(state_dir=os.path.join(os.getenv("DATASET_CACHE_DIR", ".dataset_cache"), "jobs"))
+
+# How often the browser polls a running load for progress, in milliseconds
+LOAD_POLL_INTERVAL = 500
+
+# Prefixes (paths ending in "/") pages watch are listed every WATCH_INTERVAL seconds for new files,
+# and pages check for the refreshed dataset every LIVE_POLL_INTERVAL milliseconds
+watcher = PrefixWatcher(data_service, registry, interval=int(os.getenv("WATCH_INTERVAL", DEFAULT_WATCH_INTERVAL)))
+LIVE_POLL_INTERVAL = 5000
+
+# Scatter and line traces with more points than this are drawn with WebGL in the Auto render mode
+WEBGL_THRESHOLD = int(os.getenv("WEBGL_THRESHOLD", DEFAULT_WEBGL_THRESHOLD))
+
+# Chart exports render images in this many processes, started on the first export
+exporter = ChartExporter(data_service, workers=int(os.getenv("EXPORT_WORKERS", 0)) or None)
+
+# Print a JSON log line for every timed stage and callback
+METRICS_LOG = os.getenv("METRICS_LOG", "0") != "0"
+metrics.configure(log=METRICS_LOG)
+
+# Profile callbacks and print (and optionally save) cProfile stats of those slower than this; 0 disables it
+PROFILE_SLOW_CALLBACK_MS = int(os.getenv("PROFILE_SLOW_CALLBACK_MS", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR") or None
 
 # Default S3 bucket and prefix
 BUCKET_NAME = "ieee-dataport"
 DEFAULT_PREFIX = "data/1292651/EVChargeStationUseSept2018toAug2019nd.xlsx"
 
-# Load initial dataset
-data_service.load_dataset_from_s3(BUCKET_NAME, DEFAULT_PREFIX)
-
 # Initialize Dash App with Bootstrap theme
 app = dash.Dash(
     __name__, 
@@ -31,6 +92,96 @@ app = dash.Dash(
     suppress_callback_exceptions=True
 )
 
+# WSGI entry point for running several workers, e.g. gunicorn -w 4 app:server
+server = app.server
+
+def collect_cache_metrics():
+    """Samples of the figure cache and the open datasets, read whenever /metrics is scraped"""
+    figures = figure_cache.stats()
+    datasets = registry.stats()
+    return [
+        ("figure_cache_hits_total", "counter", {}, figures["hits"]),
+        ("figure_cache_misses_total", "counter", {}, figures["misses"]),
+        ("figure_cache_evictions_total", "counter", {}, figures["evictions"]),
+        ("figure_cache_bytes", "gauge", {}, figures["bytes"]),
+        ("open_datasets", "gauge", {}, datasets["datasets"]),
+        ("open_dataset_bytes", "gauge", {}, datasets["bytes"]),
+        ("dataset_evictions_total", "counter", {}, datasets["evictions"]),
+        # Counted over the datasets still open, so these drop when one is closed
+        ("filter_cache_hits", "gauge", {}, datasets["filter_hits"]),
+        ("filter_cache_misses", "gauge", {}, datasets["filter_misses"]),
+    ]
+
+metrics.add_collector(collect_cache_metrics)
+
+# Prometheus scrape endpoint; values are per worker process
+@server.route("/metrics")
+def prometheus_metrics():
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Batch export: POST {"dataset": <dataset reference>, "charts": [<chart specs>], "formats": [...], "theme": ...}
+# and receive a zip of images and data extracts, streamed while it is produced (see chart_export)
+@server.route("/export", methods=["POST"])
+def export_charts():
+    request = flask.request.get_json(silent=True) or {}
+    ref = request.get("dataset") or {}
+    if ref.get("id"):
+        dataset = registry.get(ref)
+    elif ref.get("bucket") and ref.get("prefix"):
+        # A reference without an ID names a dataset no session may have open yet
+        dataset = data_service.load_dataset_from_s3(ref["bucket"], ref["prefix"], columns=ref.get("columns"))
+        if dataset is not None:
+            dataset = registry.add(dataset)
+    else:
+        dataset = None
+    if dataset is None:
+        return flask.Response("Dataset not found or could not be loaded", status=404, mimetype="text/plain")
+    
+    charts = request.get("charts") or []
+    if isinstance(charts, dict):
+        charts = [charts]
+    charts = [dict({"table": ref.get("table")}, **spec) for spec in charts]
+    try:
+        chunks = exporter.export(dataset, charts, request.get("formats") or DEFAULT_EXPORT_FORMATS, request.get("theme", "plotly_white"))
+    except ValueError as e:
+        return flask.Response(str(e), status=400, mimetype="text/plain")
+    return flask.Response(chunks, mimetype="application/zip", headers={"Content-Disposition": f'attachment; filename="charts-{dataset.id}.zip"'})
+
+# Time every callback request, profiling it when slow-callback profiling is on
+@server.before_request
+def start_callback_timer():
+    if flask.request.path.endswith("/_dash-update-component"):
+        flask.g.callback_started = time.perf_counter()
+        flask.g.profiler = metrics.start_profile() if PROFILE_SLOW_CALLBACK_MS else None
+
+@server.after_request
+def finish_callback_timer(response):
+    started = flask.g.pop("callback_started", None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    
+    # Dash names the request by its outputs, e.g. "..interactive-graph.figure...graph-stats.children.."
+    output = (flask.request.get_json(silent=True) or {}).get("output")
+    if output not in app.callback_map:
+        # Keep the label set bounded whatever a client sends
+        output = "unknown"
+    metrics.observe("callback_seconds", seconds, output=output)
+    if METRICS_LOG:
+        metrics.log_event("callback", output=output, seconds=round(seconds, 6), status=response.status_code)
+    
+    profiler = flask.g.pop("profiler", None)
+    if profiler is not None:
+        metrics.finish_profile(profiler, output, seconds, PROFILE_SLOW_CALLBACK_MS / 1000, PROFILE_DIR)
+    return response
+
+@server.teardown_request
+def stop_callback_profiler(error):
+    # A callback that raised skips after_request, so its profiler is stopped here
+    profiler = flask.g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
 # Custom CSS for IEEE-like styling
 app.index_string = '''
 <!DOCTYPE html>
@@ -113,9 +264,8 @@ app.index_string = '''
 
 # App layout
 def serve_layout():
-    # Get column classifications
-    categorical_cols, numerical_cols = data_service.classify_columns()
-    
+    # The dropdowns start empty; the page follows the default dataset's warm-up job and fills
+    # them in once its column metadata is ready, so rendering never waits for a load
     return html.Div([
         # Navigation Bar
         dbc.Navbar(
@@ -163,11 +313,33 @@ def serve_layout():
                         ], md=6),
                     ], className="mb-3"),
                     dbc.Row([
-                        dbc.Col([], md=9),
+                        dbc.Col([
+                            dbc.Label("Columns to Keep (CSV, optional)", className="fw-bold"),
+                            dbc.Input(id="keep-columns", placeholder="Comma-separated column names; empty keeps all", type="text"),
+                        ], md=8),
+                        dbc.Col([
+                            dbc.Label("Live Refresh", className="fw-bold"),
+                            dbc.Switch(id="watch-prefix", label="Watch a path ending in / for new files", value=False, persistence=True),
+                        ], md=4),
+                    ], className="mb-3"),
+                    dbc.Row([
+                        dbc.Col([
+                            dcc.Dropdown(
+                                id="table-select",
+                                options=[],
+                                value=None,
+                                placeholder="Loading default dataset...",
+                                clearable=False,
+                            ),
+                        ], md=7),
                         dbc.Col([
                             dbc.Button("Load Data", id="load-data-btn", color="primary", className="w-100")
                         ], md=3),
+                        dbc.Col([
+                            dbc.Button("Cancel", id="cancel-load-btn", color="secondary", outline=True, disabled=True, className="w-100")
+                        ], md=2),
                     ]),
+                    html.Div(id="load-progress", className="mt-3"),
                     html.Div(id="load-data-output", className="mt-3")
                 ])
             ], className="mb-4"),
@@ -183,8 +355,8 @@ def serve_layout():
                             dbc.Label("Select X-axis (Categorical/Date)", className="fw-bold"),
                             dcc.Dropdown(
                                 id="x-axis",
-                                options=[{"label": col, "value": col} for col in categorical_cols],
-                                value=categorical_cols[0] if categorical_cols else None,
+                                options=[],
+                                value=None,
                                 clearable=False,
                             ),
                         ], md=4),
@@ -193,8 +365,8 @@ def serve_layout():
                             dbc.Label("Select Y-axis (Numerical)", className="fw-bold"),
                             dcc.Dropdown(
                                 id="y-axis",
-                                options=[{"label": col, "value": col} for col in numerical_cols],
-                                value=numerical_cols[0] if numerical_cols else None,
+                                options=[],
+                                value=None,
                                 clearable=False,
                             ),
                         ], md=4),
@@ -203,8 +375,8 @@ def serve_layout():
                             dbc.Label("Select Color Key", className="fw-bold"),
                             dcc.Dropdown(
                                 id="key-column",
-                                options=[{"label": col, "value": col} for col in numerical_cols],
-                                value=numerical_cols[1] if len(numerical_cols) > 1 else None,
+                                options=[],
+                                value=None,
                                 clearable=True,
                             ),
                         ], md=4),
@@ -255,6 +427,116 @@ def serve_layout():
                             )
                         ], md=6),
                     ]),
+
+                    dbc.Row([
+                        dbc.Col([
+                            dbc.Label("Aggregation (Bar/Line)", className="fw-bold"),
+                            dbc.Select(
+                                id="agg-reducer",
+                                options=[{"label": "None (raw rows)", "value": "none"}] + [
+                                    {"label": reducer.capitalize(), "value": reducer} for reducer in REDUCERS
+                                ],
+                                value="sum",
+                            )
+                        ], md=3),
+
+                        dbc.Col([
+                            dbc.Label("Time Bucket (Date X-axis)", className="fw-bold"),
+                            dbc.Select(
+                                id="time-bucket",
+                                options=[{"label": "Auto", "value": "auto"}] + [
+                                    {"label": label.capitalize(), "value": label} for label, _, _ in TIME_BUCKETS
+                                ],
+                                value="auto",
+                            )
+                        ], md=3),
+
+                        dbc.Col([
+                            dbc.Label("Line Downsampling", className="fw-bold"),
+                            dbc.Select(
+                                id="line-method",
+                                options=[
+                                    {"label": "Largest Triangle (LTTB)", "value": "lttb"},
+                                    {"label": "Min/Max", "value": "minmax"},
+                                ],
+                                value="lttb",
+                            )
+                        ], md=3),
+
+                        dbc.Col([
+                            dbc.Label("Point Budget", className="fw-bold"),
+                            dbc.Input(id="point-budget", type="number", min=100, step=100, value=DEFAULT_POINT_BUDGET),
+                        ], md=3),
+                    ]),
+
+                    dbc.Row([
+                        dbc.Col([
+                            dbc.Label("Hover Details", className="fw-bold"),
+                            dbc.Select(
+                                id="hover-mode",
+                                options=[
+                                    {"label": "Click a point for its full row", "value": "detail"},
+                                    {"label": "Plotted values only", "value": "plotted"},
+                                    {"label": "Chosen columns", "value": "columns"},
+                                ],
+                                value="detail",
+                            )
+                        ], md=3),
+
+                        dbc.Col([
+                            dbc.Label("Hover Columns", className="fw-bold"),
+                            dcc.Dropdown(
+                                id="hover-columns",
+                                options=[],
+                                multi=True,
+                                placeholder="Columns to show on hover",
+                            ),
+                        ], md=6),
+
+                        dbc.Col([
+                            dbc.Label("Rendering", className="fw-bold"),
+                            dbc.Select(
+                                id="render-mode",
+                                options=[
+                                    {"label": f"Auto (WebGL above {WEBGL_THRESHOLD:,} points)", "value": "auto"},
+                                    {"label": "SVG", "value": "svg"},
+                                    {"label": "WebGL", "value": "webgl"},
+                                ],
+                                value="auto",
+                            )
+                        ], md=3),
+                    ], className="mt-3"),
+                ])
+            ], className="mb-4"),
+            
+            # Filters
+            dbc.Card([
+                dbc.CardHeader([
+                    html.H5([html.I(className="fas fa-filter me-2"), "Filters"])
+                ]),
+                dbc.CardBody([
+                    dbc.Row([
+                        dbc.Col([
+                            dbc.Label("Filter Columns", className="fw-bold"),
+                            dcc.Dropdown(
+                                id="filter-columns",
+                                options=[],
+                                multi=True,
+                                placeholder="Columns to filter on",
+                            ),
+                        ], md=9),
+                        
+                        dbc.Col([
+                            dbc.Button(
+                                [html.I(className="fas fa-times me-2"), "Clear Filters"],
+                                id="clear-filters-btn",
+                                color="secondary",
+                                outline=True,
+                                className="w-100"
+                            ),
+                        ], md=3, className="d-flex align-items-end"),
+                    ]),
+                    html.Div(id="filter-controls", className="mt-3"),
                 ])
             ], className="mb-4"),
             
@@ -271,7 +553,8 @@ def serve_layout():
                                 size="sm", 
                                 className="p-0 border-0",
                             ),
-                            dbc.Tooltip("Download Chart", target="download-btn"),
+                            dbc.Tooltip("Download chart image and data", target="download-btn"),
+                            dcc.Download(id="chart-download"),
                             dbc.Button(
                                 html.I(className="fas fa-expand"),
                                 id="expand-btn",
@@ -302,7 +585,35 @@ def serve_layout():
                             ),
                             type="cube"
                         )
-                    ], className="graph-container")
+                    ], className="graph-container"),
+                    html.Div(id="graph-stats", className="text-muted small mt-2"),
+                    html.Div(id="row-detail", className="mt-3"),
+                    
+                    html.Hr(),
+                    
+                    # Brushing this chart filters the main one, and the other way round
+                    dbc.Row([
+                        dbc.Col([
+                            dbc.Label("Cross-filter Column", className="fw-bold"),
+                            dcc.Dropdown(
+                                id="crossfilter-column",
+                                options=[],
+                                value=None,
+                                clearable=False,
+                            ),
+                        ], md=4),
+                        dbc.Col([
+                            html.Small(
+                                "Box-select bars below to filter the chart above. Box- or lasso-select points above to filter the bars below.",
+                                className="text-muted"
+                            ),
+                        ], md=8, className="d-flex align-items-end"),
+                    ]),
+                    dcc.Graph(
+                        id="crossfilter-graph",
+                        config={'displayModeBar': True},
+                        style={"height": "300px"}
+                    ),
                 ]),
             ]),
         ], className="main-content"),
@@ -342,13 +653,212 @@ def serve_layout():
         
         # Store the dataset info
         dcc.Store(id='dataset-info'),
+        
+        # Store which dataset and table this session is looking at
+        dcc.Store(id='dataset-ref'),
+        
+        # Store the zoomed axis ranges of the graph
+        dcc.Store(id='zoom-state'),
+        
+        # Store the filter panel's expression and each chart's brush as filters (see query_engine)
+        dcc.Store(id='filters', data=[]),
+        dcc.Store(id='main-brush', data=[]),
+        dcc.Store(id='crossfilter-brush', data=[]),
+        
+        # Store the id of the running dataset load and poll it for progress
+        dcc.Store(id='load-job', data=default_job_id()),
+        dcc.Interval(id='load-poll', interval=LOAD_POLL_INTERVAL, disabled=False),
+        
+        # Store what the graph shows for extending it with appended rows, and poll a watched prefix for them
+        dcc.Store(id='live-state'),
+        dcc.Store(id='live-redraw'),
+        dcc.Interval(id='live-poll', interval=LIVE_POLL_INTERVAL, disabled=True),
     ])
 
 app.layout = serve_layout
 
-# Callback for loading data
+def table_options(dataset):
+    """Dropdown options for the tables of a dataset, e.g. the files of a zip archive"""
+    options = []
+    for table in (dataset.describe_tables() if dataset is not None else []):
+        details = []
+        if table["size"] is not None:
+            details.append(f"{table['size'] / 1024 ** 2:.1f} MB")
+        if table["columns"] is not None:
+            details.append(f"{table['columns']} columns")
+        label = f"{table['name']} ({', '.join(details)})" if details else table["name"]
+        options.append({"label": label, "value": table["name"]})
+    return options
+
+def x_label(col, stats):
+    """Dropdown label for an x column: dates are marked, other columns show how many distinct values they have"""
+    if stats["kind"] == "datetime":
+        return f"{col} (date)"
+    return f"{col} ({stats['cardinality']:,} values)"
+
+def column_outputs(dataset, table_name):
+    """Dataset info and axis dropdown options/defaults for a table of a dataset, read from its column profile"""
+    profile = dataset.profile(table_name) if dataset is not None else {}
+    categorical_cols, numerical_cols = dataset.classify_columns(table_name) if dataset is not None else ([], [])
+    
+    # Purely numeric tables (e.g. MATLAB/HDF5 arrays) are plotted against a numeric x column
+    x_cols = categorical_cols or numerical_cols
+    y_cols = numerical_cols if categorical_cols else numerical_cols[1:]
+    
+    # Create dropdown options
+    cat_options = [{"label": x_label(col, profile[col]), "value": col} for col in x_cols]
+    num_options = [{"label": col, "value": col} for col in numerical_cols]
+    
+    # Set default values
+    cat_value = x_cols[0] if x_cols else None
+    num_value = y_cols[0] if y_cols else None
+    key_value = y_cols[1] if len(y_cols) > 1 else None
+    
+    first_column = next(iter(profile.values()), None)
+    dataset_info = {
+        "table": table_name,
+        "rows": first_column["count"] + first_column["nulls"] if first_column else 0,
+        "columns": len(profile),
+        "cat_cols": len(categorical_cols),
+        "num_cols": len(numerical_cols)
+    }
+    
+    return dataset_info, cat_options, cat_value, num_options, num_value, num_options, key_value
+
+def run_load(job, bucket_name, prefix, columns):
+    """Background job that loads a dataset into the registry and returns the session's reference to it"""
+    dataset = data_service.load_dataset_from_s3(bucket_name, prefix, columns=columns, progress=job.report)
+    if dataset is None:
+        job.check_cancelled()
+        raise RuntimeError("Failed to load data. Please check your credentials and file path.")
+    return registry.add(dataset).ref()
+
+def load_message(dataset, dataset_info):
+    """Alert summarizing a finished load, with compaction savings and files that failed to parse"""
+    message = dbc.Alert(f"Successfully loaded dataset with {dataset_info['rows']} rows and {dataset_info['columns']} columns.", color="success")
+    if len(dataset.tables) > 1:
+        message = dbc.Alert(f"Indexed {len(dataset.tables)} tables. Showing '{dataset_info['table']}' with {dataset_info['rows']} rows and {dataset_info['columns']} columns; other tables are loaded when selected.", color="success")
+    
+    # Report how much memory compact dtypes saved
+    load_summary = dataset.load_summary
+    if load_summary:
+        message = html.Div([
+            message,
+            html.Ul([html.Li(f"{name}: {format_memory_summary(summary)}") for name, summary in load_summary.items()], className="small text-muted"),
+        ])
+    
+    # Files that failed to parse are skipped, so list them next to the success message
+    load_errors = dataset.load_errors
+    if load_errors:
+        message = html.Div([
+            message,
+            dbc.Alert([
+                html.P(f"{len(load_errors)} file(s) could not be loaded:", className="mb-1"),
+                html.Ul([html.Li(f"{name}: {error}") for name, error in load_errors.items()], className="mb-0"),
+            ], color="warning"),
+        ])
+    return message
+
+def progress_display(job):
+    """Progress bar and counters of a running load"""
+    progress = job["progress"]
+    parts = []
+    if progress["bytes_total"]:
+        parts.append(f"{progress['bytes_downloaded'] / 1024 ** 2:.1f} / {progress['bytes_total'] / 1024 ** 2:.1f} MB downloaded")
+    if progress["rows_parsed"]:
+        parts.append(f"{progress['rows_parsed']:,} rows parsed")
+    if progress["members_total"]:
+        parts.append(f"{progress['members_done']}/{progress['members_total']} files parsed")
+    
+    percent = 100 * progress["bytes_downloaded"] / progress["bytes_total"] if progress["bytes_total"] else 0
+    return html.Div([
+        dbc.Progress(value=min(percent, 100), striped=True, animated=True, className="mb-1"),
+        html.Small(f"{job['description']}: {', '.join(parts) or 'starting'} ({job['elapsed']:.0f}s)", className="text-muted"),
+    ])
+
+def filter_options(profile):
+    """Dropdown options for the columns the filter panel can filter on.
+
+    Text columns with too many distinct values for a multiselect are left out.
+    """
+    return [
+        {"label": col, "value": col} for col, stats in profile.items()
+        if stats["kind"] in ("numeric", "datetime") or stats["cardinality"] <= MAX_FILTER_VALUES
+    ]
+
+def filter_control(col, stats, values):
+    """Filter control for a column: a range slider for numbers, a date range for dates, a multiselect otherwise"""
+    if stats["kind"] == "numeric":
+        if stats["min"] is None or stats["min"] == stats["max"]:
+            return None
+        low, high = float(stats["min"]), float(stats["max"])
+        step = (high - low) / 1000
+        if pd.api.types.is_integer_dtype(stats["dtype"]):
+            step = max(1, int(step))
+        control = dcc.RangeSlider(
+            id={"type": "filter-range", "column": col},
+            min=low,
+            max=high,
+            step=step,
+            value=[low, high],
+            marks={low: f"{low:g}", high: f"{high:g}"},
+            tooltip={"placement": "bottom"},
+            persistence=True,
+        )
+    elif stats["kind"] == "datetime":
+        if stats["min"] is None:
+            return None
+        control = dcc.DatePickerRange(
+            id={"type": "filter-dates", "column": col},
+            min_date_allowed=pd.Timestamp(stats["min"]).date(),
+            max_date_allowed=pd.Timestamp(stats["max"]).date(),
+            clearable=True,
+            persistence=True,
+        )
+    else:
+        control = dcc.Dropdown(
+            id={"type": "filter-values", "column": col},
+            options=[{"label": str(value), "value": value} for value in values or []],
+            multi=True,
+            placeholder="All values",
+            persistence=True,
+        )
+    return dbc.Row([
+        dbc.Col(dbc.Label(col, className="fw-bold"), md=3),
+        dbc.Col(control, md=9),
+    ], className="mb-2 align-items-center")
+
+# Callback for starting a dataset load in the background
+@app.callback(
+    Output('load-job', 'data'),
+    Output('load-poll', 'disabled'),
+    Output('load-data-btn', 'disabled'),
+    Output('cancel-load-btn', 'disabled'),
+    Output('load-progress', 'children'),
+    Input('load-data-btn', 'n_clicks'),
+    State('bucket-name', 'value'),
+    State('data-prefix', 'value'),
+    State('keep-columns', 'value'),
+    prevent_initial_call=True
+)
+def start_load(n_clicks, bucket_name, prefix, keep_columns):
+    if n_clicks is None:
+        return dash.no_update
+    
+    columns = [col.strip() for col in (keep_columns or "").split(",") if col.strip()] or None
+    job_id = job_manager.submit(f"Loading {bucket_name}/{prefix}", run_load, bucket_name, prefix, columns)
+    return job_id, False, True, False, progress_display(job_manager.get(job_id))
+
+# Callback for following a running load and showing the dataset once it is ready
 @app.callback(
     Output('load-data-output', 'children'),
+    Output('load-progress', 'children', allow_duplicate=True),
+    Output('load-poll', 'disabled', allow_duplicate=True),
+    Output('load-data-btn', 'disabled', allow_duplicate=True),
+    Output('cancel-load-btn', 'disabled', allow_duplicate=True),
+    Output('dataset-ref', 'data'),
+    Output('table-select', 'options'),
+    Output('table-select', 'value'),
     Output('dataset-info', 'data'),
     Output('x-axis', 'options'),
     Output('x-axis', 'value'),
@@ -356,40 +866,82 @@ app.layout = serve_layout
     Output('y-axis', 'value'),
     Output('key-column', 'options'),
     Output('key-column', 'value'),
-    Input('load-data-btn', 'n_clicks'),
-    State('bucket-name', 'value'),
-    State('data-prefix', 'value'),
+    Input('load-poll', 'n_intervals'),
+    State('load-job', 'data'),
     prevent_initial_call=True
 )
-def load_data(n_clicks, bucket_name, prefix):
-    if n_clicks is None:
-        return dash.no_update
-        
-    data = data_service.load_dataset_from_s3(bucket_name, prefix)
+def poll_load(n_intervals, job_id):
+    job = job_manager.get(job_id) if job_id else None
+    unchanged = (dash.no_update,) * 10
+    if job is None:
+        return (dash.no_update, None, True, False, True) + unchanged
     
-    if data is None:
-        return dbc.Alert("Failed to load data. Please check your credentials and file path.", color="danger"), None, [], None, [], None, [], None
+    if job["status"] in ("queued", "running"):
+        # The default dataset's warm-up is shared by every page, so it cannot be cancelled from one
+        return (dash.no_update, progress_display(job), False, True, job_id == DEFAULT_JOB_ID) + unchanged
     
-    categorical_cols, numerical_cols = data_service.classify_columns()
+    # The job has finished; stop polling and re-enable loading
+    finished = (None, True, False, True)
+    if job["status"] == "cancelled":
+        return (dbc.Alert("Loading was cancelled; the previous dataset is still shown.", color="secondary"),) + finished + unchanged
+    if job["status"] == "failed":
+        return (dbc.Alert(job["error"], color="danger"),) + finished + unchanged
     
-    # Create dropdown options
-    cat_options = [{"label": col, "value": col} for col in categorical_cols]
-    num_options = [{"label": col, "value": col} for col in numerical_cols]
+    # The load may have run in another worker, which leaves the dataset in the shared cache
+    ref = job["result"]
+    dataset = registry.get(ref)
+    if dataset is None:
+        return (dbc.Alert("The loaded dataset is no longer available. Please load it again.", color="danger"),) + finished + unchanged
     
-    # Set default values
-    cat_value = categorical_cols[0] if categorical_cols else None
-    num_value = numerical_cols[0] if numerical_cols else None
-    key_value = numerical_cols[1] if len(numerical_cols) > 1 else None
+    outputs = column_outputs(dataset, ref["table"])
+    message = load_message(dataset, outputs[0])
+    return (message,) + finished + (ref, table_options(dataset), ref["table"]) + outputs
+
+# Callback for cancelling a running load
+@app.callback(
+    Output('cancel-load-btn', 'disabled', allow_duplicate=True),
+    Input('cancel-load-btn', 'n_clicks'),
+    State('load-job', 'data'),
+    prevent_initial_call=True
+)
+def cancel_load(n_clicks, job_id):
+    if not n_clicks or not job_id or job_id == DEFAULT_JOB_ID:
+        return dash.no_update
+    job_manager.cancel(job_id)
+    return True
+
+# Callback for switching between the tables of a dataset
+@app.callback(
+    Output('load-data-output', 'children', allow_duplicate=True),
+    Output('dataset-info', 'data', allow_duplicate=True),
+    Output('x-axis', 'options', allow_duplicate=True),
+    Output('x-axis', 'value', allow_duplicate=True),
+    Output('y-axis', 'options', allow_duplicate=True),
+    Output('y-axis', 'value', allow_duplicate=True),
+    Output('key-column', 'options', allow_duplicate=True),
+    Output('key-column', 'value', allow_duplicate=True),
+    Output('dataset-ref', 'data', allow_duplicate=True),
+    Input('table-select', 'value'),
+    State('dataset-ref', 'data'),
+    prevent_initial_call=True
+)
+def select_table(table_name, dataset_ref):
+    if not table_name or not dataset_ref or dataset_ref.get('table') == table_name:
+        return dash.no_update
     
-    df = data_service.get_dataframe()
-    dataset_info = {
-        "rows": len(df) if df is not None else 0,
-        "columns": len(df.columns) if df is not None else 0,
-        "cat_cols": len(categorical_cols),
-        "num_cols": len(numerical_cols)
-    }
+    dataset = registry.get(dataset_ref)
+    if dataset is None or table_name not in dataset.tables:
+        return (dbc.Alert(f"Table '{table_name}' is not part of the loaded dataset.", color="danger"),) + (dash.no_update,) * 8
     
-    return dbc.Alert(f"Successfully loaded dataset with {dataset_info['rows']} rows and {dataset_info['columns']} columns.", color="success"), dataset_info, cat_options, cat_value, num_options, num_value, num_options, key_value
+    # The table is parsed here on first selection; on failure the session keeps its previous table
+    try:
+        outputs = column_outputs(dataset, table_name)
+    except Exception as e:
+        return (dbc.Alert(f"Failed to load table '{table_name}': {e}", color="danger"),) + (dash.no_update,) * 8
+    
+    dataset_info = outputs[0]
+    message = dbc.Alert(f"Showing '{table_name}' with {dataset_info['rows']} rows and {dataset_info['columns']} columns.", color="success")
+    return (message,) + outputs + (dict(dataset_ref, table=table_name),)
 
 # Callbacks for toggling chart type buttons
 @app.callback(
@@ -419,76 +971,412 @@ def toggle_chart_type(scatter_clicks, bar_clicks, line_clicks, current_chart_typ
     
     return current_chart_type, current_chart_type != 'scatter', current_chart_type != 'bar', current_chart_type != 'line'
 
+# Callback to remember the zoomed ranges of the current x/y pair
+@app.callback(
+    Output('zoom-state', 'data'),
+    Input('interactive-graph', 'relayoutData'),
+    State('x-axis', 'value'),
+    State('y-axis', 'value'),
+    State('zoom-state', 'data'),
+    prevent_initial_call=True
+)
+def update_zoom(relayout_data, x_col, y_col, zoom_state):
+    ranges = parse_relayout(relayout_data)
+    if not ranges:
+        return dash.no_update
+    
+    # Ranges from a previous x/y pair do not apply to the current one
+    zoom = dict(zoom_state or {})
+    if zoom.get('x_col') != x_col or zoom.get('y_col') != y_col:
+        zoom = {'x_col': x_col, 'y_col': y_col}
+    for axis, bounds in ranges.items():
+        zoom[axis] = bounds
+    return zoom
+
+def chart_filters(x_col, y_col, chart_type, zoom_state, filters, crossfilter_brush):
+    """The filters a chart's query runs: the filter panel, a brush on the cross-filter chart and the zoomed ranges"""
+    zoom = zoom_state if zoom_state and zoom_state.get('x_col') == x_col and zoom_state.get('y_col') == y_col else {}
+    
+    # Category axes report zoom positions rather than values, so the query ignores those
+    zoomed = {'xaxis': x_col, 'yaxis': y_col if chart_type == 'scatter' else None}
+    zoom_filters = [{"column": col, "range": zoom[axis]} for axis, col in zoomed.items() if col and zoom.get(axis)]
+    return combine_filters(filters, crossfilter_brush, zoom_filters)
+
 # Callback to update graph based on selection
 @app.callback(
     Output("interactive-graph", "figure"),
+    Output("graph-stats", "children"),
+    Output("live-state", "data"),
     Input("x-axis", "value"),
     Input("y-axis", "value"),
     Input("key-column", "value"),
     Input("current-chart-type", "data"),
-    Input("chart-theme", "value")
+    Input("agg-reducer", "value"),
+    Input("time-bucket", "value"),
+    Input("line-method", "value"),
+    Input("point-budget", "value"),
+    Input("zoom-state", "data"),
+    Input("hover-mode", "value"),
+    Input("hover-columns", "value"),
+    Input("render-mode", "value"),
+    Input("filters", "data"),
+    Input("crossfilter-brush", "data"),
+    Input("live-redraw", "data"),
+    Input("dataset-ref", "data"),
+    State("chart-theme", "value")
 )
-def update_graph(x_col, y_col, key_col, chart_type, theme):
+def update_graph(x_col, y_col, key_col, chart_type, reducer, time_bucket, line_method, point_budget, zoom_state, hover_mode, hover_columns, render_mode, filters, crossfilter_brush, live_redraw, dataset_ref, theme):
     if not x_col or not y_col:
         return go.Figure().update_layout(
             title="Please select valid X and Y columns",
             template=theme
-        )
+        ), None, None
     
-    df = data_service.get_dataframe()
-    if df is None:
+    dataset = registry.get(dataset_ref)
+    if dataset is None or dataset.get_table(dataset_ref['table']) is None:
         return go.Figure().update_layout(
             title="No data available",
             template=theme
-        )
+        ), None, None
     
-    # Create base figure based on chart type
-    if chart_type == 'scatter':
-        fig = px.scatter(
-            df, 
-            x=x_col, 
-            y=y_col, 
-            color=key_col if key_col else None,
-            hover_data=df.columns,
-            title=f"{y_col} vs {x_col}",
-            template=theme,
-        )
-    elif chart_type == 'bar':
-        fig = px.bar(
-            df, 
-            x=x_col, 
-            y=y_col, 
-            color=key_col if key_col else None,
-            hover_data=df.columns,
-            title=f"{y_col} by {x_col}",
-            template=theme,
-        )
-    elif chart_type == 'line':
-        fig = px.line(
-            df, 
-            x=x_col, 
-            y=y_col, 
-            color=key_col if key_col else None,
-            hover_data=df.columns,
-            title=f"{y_col} Trend by {x_col}",
-            template=theme,
-        )
+    budget = int(point_budget) if point_budget else DEFAULT_POINT_BUDGET
+    hover_columns = list(hover_columns or []) if hover_mode == 'columns' else []
     
-    # Improve layout
-    fig.update_layout(
-        margin=dict(l=20, r=20, t=50, b=20),
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
-        xaxis_title=x_col,
-        yaxis_title=y_col,
+    # The filter panel, a brush on the cross-filter chart and the zoomed ranges all narrow the query
+    profile = dataset.profile(dataset_ref['table'])
+    if x_col == y_col and chart_reducer(chart_type, reducer, profile.get(x_col)):
+        return go.Figure().update_layout(
+            title="Please select different X and Y columns to aggregate",
+            template=theme
+        ), None, None
+    filters = chart_filters(x_col, y_col, chart_type, zoom_state, filters, crossfilter_brush)
+    
+    # The theme is not part of the key: cached traces are re-themed on the way out
+    cache_key = (
+        dataset.id, dataset_ref['table'], x_col, y_col, key_col, chart_type, reducer, time_bucket, line_method, budget,
+        hover_mode, tuple(hover_columns), render_mode, filter_key(filters),
     )
+    cached = figure_cache.get(cache_key)
+    if cached is None:
+        fig, stats, df, query_info = chart_figure(
+            data_service, dataset, dataset_ref['table'], x_col, y_col, key_col, chart_type, theme,
+            reducer=reducer, time_bucket=time_bucket, line_method=line_method, budget=budget,
+            hover=hover_mode, hover_columns=hover_columns, render_mode=render_mode,
+            webgl_threshold=WEBGL_THRESHOLD, filters=filters,
+        )
+        figure_json = serialize_figure(fig)
+        live = live_state(fig, dataset.id, chart_type, reducer, x_col, key_col, hover_mode, profile, query_info["rows"])
+        cached = (figure_json, stats, live)
+        figure_cache.put(cache_key, cached, len(figure_json))
     
-    return fig
+    figure_json, stats, live = cached
+    return apply_theme(figure_json, theme), stats, live
+
+# Callback for polling for appended rows while a dataset loaded from a prefix is watched
+@app.callback(
+    Output("live-poll", "disabled"),
+    Input("watch-prefix", "value"),
+    Input("dataset-ref", "data")
+)
+def toggle_live_poll(watch, dataset_ref):
+    return not (watch and dataset_ref and dataset_ref.get('prefix', '').endswith('/'))
+
+# Callback for extending the graph with rows a refresh of the watched prefix appended
+@app.callback(
+    Output("interactive-graph", "extendData"),
+    Output("live-state", "data", allow_duplicate=True),
+    Output("graph-stats", "children", allow_duplicate=True),
+    Output("live-redraw", "data"),
+    Input("live-poll", "n_intervals"),
+    State("live-state", "data"),
+    State("x-axis", "value"),
+    State("y-axis", "value"),
+    State("key-column", "value"),
+    State("current-chart-type", "data"),
+    State("line-method", "value"),
+    State("point-budget", "value"),
+    State("zoom-state", "data"),
+    State("hover-mode", "value"),
+    State("filters", "data"),
+    State("crossfilter-brush", "data"),
+    State("dataset-ref", "data"),
+    prevent_initial_call=True
+)
+def extend_live_graph(n_intervals, state, x_col, y_col, key_col, chart_type, line_method, point_budget, zoom_state, hover_mode, filters, crossfilter_brush, dataset_ref):
+    if not dataset_ref or not state:
+        return dash.no_update
+    watcher.watch(dataset_ref)
+    
+    # Sessions of a refreshed dataset resolve to its newest version
+    dataset = registry.get(dataset_ref)
+    if dataset is None or dataset.id == state["id"]:
+        return dash.no_update
+    
+    # Extend the graph when the new version only appended rows to the one it shows, else redraw it
+    table_name = dataset_ref['table']
+    appended_from = dataset.appended_from or {}
+    extension = None
+    if appended_from.get("id") == state["id"] and table_name in appended_from["rows"]:
+        columns = [x_col, y_col, key_col]
+        filters = chart_filters(x_col, y_col, chart_type, zoom_state, filters, crossfilter_brush)
+        df = dataset.get_appended(table_name, columns, appended_from["rows"][table_name], filters=filters)
+        budget = int(point_budget) if point_budget else DEFAULT_POINT_BUDGET
+        extension = figure_extension(df, state, dataset.id, x_col, y_col, key_col, chart_type, hover_mode, line_method, budget)
+    if extension is None:
+        return dash.no_update, dash.no_update, dash.no_update, dataset.id
+    
+    extend_data, state = extension
+    total_rows = dataset.get_table(table_name).num_rows
+    stats = f"Showing {state['points']:,} points from {state['rows']:,} of {total_rows:,} rows (live)"
+    return extend_data if extend_data is not None else dash.no_update, state, stats, dash.no_update
+
+# Callback for downloading the chart as shown, as an image and the data behind it
+@app.callback(
+    Output("chart-download", "data"),
+    Input("download-btn", "n_clicks"),
+    State("x-axis", "value"),
+    State("y-axis", "value"),
+    State("key-column", "value"),
+    State("current-chart-type", "data"),
+    State("agg-reducer", "value"),
+    State("time-bucket", "value"),
+    State("line-method", "value"),
+    State("point-budget", "value"),
+    State("zoom-state", "data"),
+    State("filters", "data"),
+    State("crossfilter-brush", "data"),
+    State("dataset-ref", "data"),
+    State("chart-theme", "value"),
+    prevent_initial_call=True
+)
+def download_chart(n_clicks, x_col, y_col, key_col, chart_type, reducer, time_bucket, line_method, point_budget, zoom_state, filters, crossfilter_brush, dataset_ref, theme):
+    dataset = registry.get(dataset_ref)
+    if dataset is None or not x_col or not y_col:
+        return dash.no_update
+    
+    spec = {
+        "table": dataset_ref['table'], "x": x_col, "y": y_col, "color": key_col, "chart": chart_type,
+        "reducer": reducer, "time_bucket": time_bucket, "line_method": line_method, "budget": point_budget,
+        "filters": chart_filters(x_col, y_col, chart_type, zoom_state, filters, crossfilter_brush),
+    }
+    try:
+        archive = b"".join(exporter.export(dataset, [spec], DEFAULT_EXPORT_FORMATS, theme))
+    except ValueError as e:
+        print(f"Download failed: {e}")
+        return dash.no_update
+    return dcc.send_bytes(archive, f"{chart_type}_{y_col}_by_{x_col}.zip")
+
+# Callback for switching the theme without resending the figure's traces
+@app.callback(
+    Output("interactive-graph", "figure", allow_duplicate=True),
+    Output("crossfilter-graph", "figure", allow_duplicate=True),
+    Input("chart-theme", "value"),
+    prevent_initial_call=True
+)
+def update_theme(theme):
+    # Only the template changes, so the browser keeps the trace data it already has
+    patched = Patch()
+    patched["layout"]["template"] = theme_template(theme)
+    return patched, patched
+
+# Callback for offering the columns of the selected table as hover columns
+@app.callback(
+    Output("hover-columns", "options"),
+    Output("hover-columns", "value"),
+    Input("dataset-ref", "data")
+)
+def update_hover_columns(dataset_ref):
+    dataset = registry.get(dataset_ref)
+    if dataset is None:
+        return [], []
+    return [{"label": col, "value": col} for col in dataset.profile(dataset_ref['table'])], []
+
+# Callback for offering the columns of the selected table to the filter panel and cross-filter chart
+@app.callback(
+    Output("filter-columns", "options"),
+    Output("filter-columns", "value"),
+    Output("crossfilter-column", "options"),
+    Output("crossfilter-column", "value"),
+    Input("dataset-ref", "data"),
+    State("crossfilter-column", "value")
+)
+def update_filter_columns(dataset_ref, crossfilter_col):
+    dataset = registry.get(dataset_ref)
+    if dataset is None:
+        return [], [], [], None
+    
+    profile = dataset.profile(dataset_ref['table'])
+    columns = [{"label": col, "value": col} for col in profile]
+    
+    # Keep the cross-filter column across tables that share it, otherwise start on the first measurement
+    if crossfilter_col not in profile:
+        _, numerical_cols = dataset.classify_columns(dataset_ref['table'])
+        crossfilter_col = numerical_cols[0] if numerical_cols else next(iter(profile), None)
+    return filter_options(profile), [], columns, crossfilter_col
+
+# Callback for showing a filter control per chosen column
+@app.callback(
+    Output("filter-controls", "children"),
+    Input("filter-columns", "value"),
+    State("dataset-ref", "data")
+)
+def render_filter_controls(filter_columns, dataset_ref):
+    dataset = registry.get(dataset_ref)
+    if dataset is None or not filter_columns:
+        return None
+    
+    profile = dataset.profile(dataset_ref['table'])
+    controls = []
+    for col in filter_columns:
+        if col not in profile:
+            continue
+        # Only multiselects list values; sliders and date ranges come from the profile's range
+        values = dataset.filter_values(dataset_ref['table'], col) if profile[col]["kind"] not in RANGE_KINDS else None
+        controls.append(filter_control(col, profile[col], values))
+    return [control for control in controls if control is not None]
+
+# Callback for turning the filter controls into the filter expression the query engine runs
+@app.callback(
+    Output("filters", "data"),
+    Input({"type": "filter-range", "column": ALL}, "value"),
+    Input({"type": "filter-dates", "column": ALL}, "start_date"),
+    Input({"type": "filter-dates", "column": ALL}, "end_date"),
+    Input({"type": "filter-values", "column": ALL}, "value"),
+    State({"type": "filter-range", "column": ALL}, "id"),
+    State({"type": "filter-range", "column": ALL}, "min"),
+    State({"type": "filter-range", "column": ALL}, "max"),
+    State({"type": "filter-dates", "column": ALL}, "id"),
+    State({"type": "filter-dates", "column": ALL}, "min_date_allowed"),
+    State({"type": "filter-dates", "column": ALL}, "max_date_allowed"),
+    State({"type": "filter-values", "column": ALL}, "id"),
+)
+def collect_filters(ranges, start_dates, end_dates, value_lists, range_ids, range_mins, range_maxes, date_ids, date_mins, date_maxes, value_ids):
+    filters = []
+    
+    # Sliders left at the column's full range do not filter
+    for control_id, bounds, low, high in zip(range_ids, ranges, range_mins, range_maxes):
+        if bounds and (bounds[0] > low or bounds[1] < high):
+            filters.append({"column": control_id["column"], "range": bounds})
+    
+    # An open end of a date range extends to the column's first or last date; the end date is inclusive
+    for control_id, start, end, low, high in zip(date_ids, start_dates, end_dates, date_mins, date_maxes):
+        if start or end:
+            filters.append({"column": control_id["column"], "range": [start or low, f"{end or high} 23:59:59.999999"]})
+    
+    for control_id, values in zip(value_ids, value_lists):
+        if values:
+            filters.append({"column": control_id["column"], "values": values})
+    return filters
+
+# Callback for clearing the filter panel and both charts' brushes
+@app.callback(
+    Output("filter-columns", "value", allow_duplicate=True),
+    Output("main-brush", "data", allow_duplicate=True),
+    Output("crossfilter-brush", "data", allow_duplicate=True),
+    Input("clear-filters-btn", "n_clicks"),
+    prevent_initial_call=True
+)
+def clear_filters(n_clicks):
+    return [], [], []
+
+# Callback for turning a brush on the main chart into filters on its plotted columns
+@app.callback(
+    Output("main-brush", "data"),
+    Input("interactive-graph", "selectedData"),
+    Input("x-axis", "value"),
+    Input("y-axis", "value"),
+    Input("current-chart-type", "data"),
+    Input("dataset-ref", "data")
+)
+def capture_main_brush(selected_data, x_col, y_col, chart_type, dataset_ref):
+    # A brush on the previous columns or chart does not apply to a new one
+    triggered = {trigger['prop_id'] for trigger in dash.callback_context.triggered}
+    dataset = registry.get(dataset_ref)
+    if dataset is None or triggered != {"interactive-graph.selectedData"}:
+        return []
+    
+    # Bar and line charts plot reduced y values, so only their x range maps back to rows
+    brushed = {"x": x_col, "y": y_col} if chart_type == 'scatter' else {"x": x_col}
+    return selection_filters(selected_data, brushed, dataset.profile(dataset_ref['table']))
+
+# Callback for turning a brush on the cross-filter chart into a filter on its column
+@app.callback(
+    Output("crossfilter-brush", "data"),
+    Input("crossfilter-graph", "selectedData"),
+    Input("crossfilter-column", "value"),
+    Input("dataset-ref", "data")
+)
+def capture_crossfilter_brush(selected_data, crossfilter_col, dataset_ref):
+    triggered = {trigger['prop_id'] for trigger in dash.callback_context.triggered}
+    dataset = registry.get(dataset_ref)
+    if dataset is None or triggered != {"crossfilter-graph.selectedData"}:
+        return []
+    return selection_filters(selected_data, {"x": crossfilter_col}, dataset.profile(dataset_ref['table']))
+
+# Callback for the cross-filter chart, narrowed by the filter panel and a brush on the main chart
+@app.callback(
+    Output("crossfilter-graph", "figure"),
+    Input("crossfilter-column", "value"),
+    Input("filters", "data"),
+    Input("main-brush", "data"),
+    Input("dataset-ref", "data"),
+    State("chart-theme", "value")
+)
+def update_crossfilter(crossfilter_col, filters, main_brush, dataset_ref, theme):
+    dataset = registry.get(dataset_ref)
+    profile = dataset.profile(dataset_ref['table']) if dataset is not None else {}
+    if crossfilter_col not in profile:
+        return go.Figure().update_layout(template=theme)
+    
+    df, query_info = data_service.query(dataset, dataset_ref['table'], [crossfilter_col], filters=combine_filters(filters, main_brush))
+    return build_distribution(df[crossfilter_col], profile[crossfilter_col]["kind"], theme, total_rows=query_info["rows"])
+
+# Callback for showing the full row behind a clicked point
+@app.callback(
+    Output("row-detail", "children"),
+    Input("interactive-graph", "clickData"),
+    State("dataset-ref", "data"),
+    prevent_initial_call=True
+)
+def show_row(click_data, dataset_ref):
+    points = (click_data or {}).get("points") or []
+    custom_data = points[0].get("customdata") if points else None
+    if not custom_data:
+        # Aggregated points and other hover modes carry no row index
+        return None
+    
+    dataset = registry.get(dataset_ref)
+    row = dataset.get_row(dataset_ref['table'], int(custom_data[0])) if dataset is not None else None
+    if row is None:
+        return dbc.Alert("That row is no longer available.", color="warning")
+    
+    return dbc.Card([
+        dbc.CardHeader(f"Row {int(custom_data[0]):,}"),
+        dbc.CardBody(dbc.Table(
+            html.Tbody([html.Tr([html.Th(str(col)), html.Td(str(value))]) for col, value in row.items()]),
+            bordered=False, size="sm", className="mb-0",
+        )),
+    ])
+
+def warm_default_dataset(job):
+    """Background job that loads the default dataset, from the local cache when it is current"""
+    ref = run_load(job, BUCKET_NAME, DEFAULT_PREFIX, None)
+    print(f"Default dataset ready {time.perf_counter() - STARTUP_STARTED:.2f}s after startup.")
+    return ref
+
+def default_job_id():
+    """Id of the job warming the default dataset, warming it again once the finished job was forgotten"""
+    global DEFAULT_JOB_ID
+    with default_job_lock:
+        if job_manager.get(DEFAULT_JOB_ID) is None:
+            DEFAULT_JOB_ID = job_manager.submit(f"Loading default dataset {BUCKET_NAME}/{DEFAULT_PREFIX}", warm_default_dataset)
+        return DEFAULT_JOB_ID
+
+# Warm the default dataset in the background instead of loading it before the server can answer
+DEFAULT_JOB_ID = None
+default_job_lock = threading.Lock()
+default_job_id()
+print(f"App ready to serve {time.perf_counter() - STARTUP_STARTED:.2f}s after startup.")
 
 # Run the app
 if __name__ == "__main__":
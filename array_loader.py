@@ -0,0 +1,231 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import h5py
+import numpy as np
+import pandas as pd
+from scipy.io import loadmat, whosmat
+
+# File formats holding numeric arrays rather than tables
+ARRAY_FORMATS = ('.mat', '.h5', '.hdf5')
+
+# 2-D arrays are split into one column per entry of their shorter side, up to this many
+MAX_SPLIT_COLUMNS = 32
+
+# Rows read per HDF5 request when materializing a column
+CHUNK_ROWS = 1_000_000
+
+# MATLAB classes that hold plain numbers
+NUMERIC_MATLAB_CLASSES = {
+    "double", "single", "logical",
+    "int8", "int16", "int32", "int64", "uint8", "uint16", "uint32", "uint64",
+}
+
+
+class ColumnSpec:
+    """Where a column lives inside an array: the variable, and which row/column of it if 2-D"""
+
+    def __init__(self, variable, index=None, row_axis=0):
+        self.variable = variable
+        self.index = index
+        self.row_axis = row_axis
+
+
+def split_columns(name, shape):
+    """Describe the columns of an array of the given shape, or return None if it is not column-like.
+
+    The longer side is taken as rows, so MATLAB matrices read through HDF5 (which come back
+    transposed) and regular row-major arrays give the same columns.
+    """
+    if not shape:
+        return None
+    if len(shape) == 1:
+        return shape[0], {name: ColumnSpec(name)}
+    if len(shape) != 2 or min(shape) > MAX_SPLIT_COLUMNS or min(shape) == 0:
+        return None
+
+    row_axis = 0 if shape[0] >= shape[1] else 1
+    width = shape[1 - row_axis]
+    if width == 1:
+        return shape[row_axis], {name: ColumnSpec(name, 0, row_axis)}
+    return shape[row_axis], {f"{name}[{i}]": ColumnSpec(name, i, row_axis) for i in range(width)}
+
+
+def group_by_length(name, columns_by_length):
+    """Build one table per distinct column length, named after the file"""
+    if len(columns_by_length) == 1:
+        return [(name, length, columns) for length, columns in columns_by_length.items()]
+    return [(f"{name} ({length:,} rows)", length, columns) for length, columns in columns_by_length.items()]
+
+
+class ArrayTable(ABC):
+    """Table whose columns are slices of numeric arrays and are read only when requested"""
+
+    def __init__(self, num_rows, columns, dtypes, keep_alive=None):
+        self._num_rows = num_rows
+        self.specs = columns
+        self.dtypes = dtypes
+        self.keep_alive = keep_alive
+
+    @property
+    def columns(self):
+        return list(self.specs)
+
+    @property
+    def num_rows(self):
+        return self._num_rows
+
+    def schema_frame(self):
+        """Return an empty frame with the table's columns and dtypes"""
+        return pd.DataFrame({name: np.empty(0, dtype=self.dtypes[name]) for name in self.specs})
+
+    def to_pandas(self, columns=None):
+        """Read the requested columns, or all of them, into a DataFrame"""
+        names = self.columns if columns is None else list(dict.fromkeys(col for col in columns if col))
+        return pd.DataFrame({name: self.read_column(self.specs[name]) for name in names})
+
+    def read_row(self, index):
+        """Return one row as a dict of column to value"""
+        return {name: self.read_value(spec, index) for name, spec in self.specs.items()}
+
+    @abstractmethod
+    def read_column(self, spec):
+        """Read one column as a 1-D array"""
+
+    def read_value(self, spec, index):
+        return self.read_column(spec)[index]
+
+    def memory_bytes(self):
+        """Return the memory held by array data read so far"""
+        return 0
+
+
+class H5Table(ArrayTable):
+    """Columns of an HDF5 file (including MATLAB v7.3 .mat files), read in row chunks on demand"""
+
+    def __init__(self, h5_file, num_rows, columns, dtypes, keep_alive=None):
+        super().__init__(num_rows, columns, dtypes, keep_alive)
+        self.h5_file = h5_file
+
+    def read_column(self, spec):
+        dataset = self.h5_file[spec.variable]
+        out = np.empty(self.num_rows, dtype=dataset.dtype)
+        for start in range(0, self.num_rows, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, self.num_rows)
+            if spec.index is None:
+                selection = np.s_[start:stop]
+            elif spec.row_axis == 0:
+                selection = np.s_[start:stop, spec.index]
+            else:
+                selection = np.s_[spec.index, start:stop]
+            out[start:stop] = dataset[selection]
+        return out
+
+    def read_value(self, spec, index):
+        # A single element is read straight from the file rather than through its whole column
+        dataset = self.h5_file[spec.variable]
+        if spec.index is None:
+            return dataset[index]
+        return dataset[index, spec.index] if spec.row_axis == 0 else dataset[spec.index, index]
+
+
+class MatTable(ArrayTable):
+    """Columns of a MATLAB v4-v7.2 .mat file.
+
+    These files cannot be sliced, so each variable is loaded on its own when one of its
+    columns is first requested, and only the most recently used variables are kept.
+    """
+
+    max_variables = 4
+
+    def __init__(self, path, num_rows, columns, dtypes, keep_alive=None):
+        super().__init__(num_rows, columns, dtypes, keep_alive)
+        self.path = path
+        self.variables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def memory_bytes(self):
+        return sum(array.nbytes for array in list(self.variables.values()))
+
+    def read_column(self, spec):
+        with self.lock:
+            array = self.variables.get(spec.variable)
+            if array is None:
+                array = loadmat(self.path, variable_names=[spec.variable])[spec.variable]
+                self.variables[spec.variable] = array
+                while len(self.variables) > self.max_variables:
+                    self.variables.popitem(last=False)
+            self.variables.move_to_end(spec.variable)
+
+        if spec.index is None:
+            return array.reshape(-1)
+        return array[:, spec.index] if spec.row_axis == 0 else array[spec.index, :]
+
+
+def matlab_class(dataset):
+    value = dataset.attrs.get("MATLAB_class")
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def open_h5(path, name, keep_alive=None):
+    """Index the numeric datasets of an HDF5 file as lazily read tables, without reading any data"""
+    h5_file = h5py.File(path, "r")
+    columns_by_length = {}
+    dtypes = {}
+
+    def visit(dataset_name, node):
+        # Skip MATLAB bookkeeping groups and anything that is not plain numbers
+        if not isinstance(node, h5py.Dataset) or dataset_name.startswith("#"):
+            return
+        if node.dtype.kind not in "biuf":
+            return
+        mat_class = matlab_class(node)
+        if mat_class is not None and mat_class not in NUMERIC_MATLAB_CLASSES:
+            return
+
+        split = split_columns(dataset_name, node.shape)
+        if split is None:
+            return
+        length, columns = split
+        columns_by_length.setdefault(length, {}).update(columns)
+        dtypes.update({column: node.dtype for column in columns})
+
+    h5_file.visititems(visit)
+    return {
+        table_name: H5Table(h5_file, length, columns, dtypes, keep_alive)
+        for table_name, length, columns in group_by_length(name, columns_by_length)
+    }
+
+
+def open_mat(path, name, keep_alive=None):
+    """Index the numeric variables of a .mat file as lazily loaded tables"""
+    if h5py.is_hdf5(path):
+        # MATLAB v7.3 files are HDF5 underneath and can be sliced directly
+        return open_h5(path, name, keep_alive)
+
+    columns_by_length = {}
+    dtypes = {}
+    for variable, shape, mat_class in whosmat(path):
+        if mat_class not in NUMERIC_MATLAB_CLASSES:
+            continue
+        split = split_columns(variable, shape)
+        if split is None:
+            continue
+        length, columns = split
+        columns_by_length.setdefault(length, {}).update(columns)
+        dtype = np.dtype(bool) if mat_class == "logical" else np.dtype(mat_class)
+        dtypes.update({column: dtype for column in columns})
+
+    return {
+        table_name: MatTable(path, length, columns, dtypes, keep_alive)
+        for table_name, length, columns in group_by_length(name, columns_by_length)
+    }
+
+
+def open_array_file(path, prefix, keep_alive=None):
+    """Open a .mat or HDF5 file as a dict of lazily read tables"""
+    name = os.path.basename(prefix)
+    if prefix.endswith('.mat'):
+        return open_mat(path, name, keep_alive)
+    return open_h5(path, name, keep_alive)
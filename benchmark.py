@@ -0,0 +1,314 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import numpy as np
+import pandas as pd
+import boto3
+
+try:
+    import resource
+except ImportError:
+    # Without /proc or resource (Windows) peak RSS is not reported
+    resource = None
+
+# Benchmark of the load, aggregate and render paths against a local S3 stand-in.
+#
+#   python benchmark.py --rows 10000 100000 --output before.json
+#   python benchmark.py --rows 10000 100000 --output after.json --compare before.json
+#
+# Every dataset is loaded in its own process, so peak memory is measured per case.
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# "parquet" loads the CSV object through the out-of-core DuckDB backend, which queries it as Parquet
+FORMATS = ["csv", "xlsx", "zip", "parquet"]
+
+CHART_TYPES = ["scatter", "bar", "line"]
+
+# Excel sheets hold at most 1,048,576 rows and openpyxl writes them slowly
+XLSX_MAX_ROWS = 100_000
+
+# Members of the synthetic zip archives
+ZIP_MEMBERS = 4
+
+BUCKET = "benchmark"
+MOTO_PORT = 5077
+
+# Metrics compared between runs; lower is better for all of them
+COMPARED_METRICS = [
+    "cold_load_seconds", "warm_load_seconds", "download_seconds", "parse_seconds", "profile_seconds", "classify_seconds",
+    "python_peak_bytes", "peak_rss_bytes",
+]
+
+
+def synthetic_frame(rows, seed=0):
+    """A sensor-style dataset: a timestamp, a categorical sensor name, an id and two measurements"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "timestamp": pd.date_range("2020-01-01", periods=rows, freq="s"),
+        "sensor": rng.choice([f"sensor_{i}" for i in range(10)], rows),
+        "reading_id": np.arange(rows),
+        "value": rng.normal(size=rows).cumsum(),
+        "load": rng.random(rows) * 100,
+    })
+
+
+def write_object(df, file_format, path):
+    """Write the synthetic frame as the object a format is benchmarked on and return its key"""
+    rows = len(df)
+    if file_format in ("csv", "parquet"):
+        key = f"rows_{rows}.csv"
+        df.to_csv(os.path.join(path, key), index=False)
+    elif file_format == "xlsx":
+        key = f"rows_{rows}.xlsx"
+        df.to_excel(os.path.join(path, key), index=False)
+    else:
+        key = f"rows_{rows}.zip"
+        with zipfile.ZipFile(os.path.join(path, key), "w", zipfile.ZIP_DEFLATED) as archive:
+            for i, part in enumerate(np.array_split(np.arange(rows), ZIP_MEMBERS)):
+                archive.writestr(f"part_{i}.csv", df.iloc[part].to_csv(index=False))
+    return key
+
+
+def git_commit():
+    """Return the commit the benchmark runs on, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_bytes():
+    """Return the peak resident memory of this process, or None where it cannot be read"""
+    # VmHWM starts over in each process, while ru_maxrss on Linux carries the parent's peak across exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed(fn, *args, **kwargs):
+    """Call fn and return its result and how long it took in seconds"""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def load_every_table(service, key, progress=None):
+    """Load a dataset and parse every table in it.
+
+    Zip archives are otherwise only indexed at load time, with members parsed when first
+    selected; parsing them all keeps their load times comparable with the other formats.
+    """
+    dataset = service.load_dataset_from_s3(BUCKET, key, progress=progress)
+    if dataset is not None:
+        for table in dataset.tables.values():
+            # Asking a lazy zip member for its row count parses it
+            _ = table.num_rows
+    return dataset
+
+
+def run_case(file_format, rows, key, size, cache_dir):
+    """Load one object and render every chart type from it; runs in its own process"""
+    # Imported here so the parent process never holds a dataset or its allocations
+    from data_service import DataService
+    from dataset_registry import Dataset
+    from column_profile import profile_table
+    from charts import build_figure, chart_reducer, serialize_figure
+
+    backend = "duckdb" if file_format == "parquet" else "pandas"
+    service = DataService(None, None, cache_dir=cache_dir, backend=backend)
+    if service.backend != backend:
+        return {"skipped": "duckdb is not installed"}
+
+    # Download progress marks when the last byte arrived; parsing of CSV overlaps it
+    events = {"download": None}
+    def progress(stage, **info):
+        if stage == "download":
+            events["download"] = time.perf_counter()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    dataset = load_every_table(service, key, progress=progress)
+    cold_load = time.perf_counter() - started
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if dataset is None:
+        return {"error": "load failed"}
+    # Parsing that overlaps the download is not counted: this is what is left after the last byte
+    download = events["download"] - started if events["download"] else None
+
+    # A second load finds the object in the dataset cache
+    _, warm_load = timed(load_every_table, service, key)
+
+    # Profile and classify on a fresh dataset so nothing is memoized from the load
+    table_name = dataset.default_table()
+    _, profile_seconds = timed(profile_table, dataset.get_table(table_name))
+    fresh = Dataset(dataset.id, dataset.tables, dataset.source)
+    _, classify_seconds = timed(fresh.classify_columns, table_name)
+
+    charts = {}
+    profile = dataset.profile(table_name)
+    for chart_type in CHART_TYPES:
+        reducer = chart_reducer(chart_type, "mean")
+        group = {"x": "timestamp", "y": "value", "color": "sensor", "reducer": reducer, "time_bucket": "auto"} if reducer else None
+        (df, query_info), query_seconds = timed(
+            service.query, dataset, table_name, ["timestamp", "value", "sensor"], group=group
+        )
+        (fig, _), build_seconds = timed(
+            build_figure, df, "timestamp", "value", "sensor", chart_type, "plotly_white",
+            reducer="mean", profile=profile, query_info=query_info,
+        )
+        figure_json, serialize_seconds = timed(serialize_figure, fig)
+        charts[chart_type] = {
+            "query_seconds": query_seconds,
+            "build_seconds": build_seconds,
+            "serialize_seconds": serialize_seconds,
+            "points": sum(len(trace.x) for trace in fig.data if trace.x is not None),
+            "figure_bytes": len(figure_json),
+        }
+
+    return {
+        "object_bytes": size,
+        "cold_load_seconds": cold_load,
+        "warm_load_seconds": warm_load,
+        "download_seconds": download,
+        "parse_seconds": cold_load - download if download is not None else None,
+        "profile_seconds": profile_seconds,
+        "classify_seconds": classify_seconds,
+        "python_peak_bytes": python_peak,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "charts": charts,
+    }
+
+
+def run_isolated(pool_context, *args):
+    """Run one case in a fresh process and return its measurements"""
+    with pool_context.Pool(1) as pool:
+        return pool.apply(run_case, args)
+
+
+def start_stand_in(endpoint_url):
+    """Point boto3 at the S3 stand-in, starting a local moto server unless an endpoint was given"""
+    server = None
+    if endpoint_url is None:
+        try:
+            from moto.server import ThreadedMotoServer
+        except ImportError:
+            raise SystemExit("The benchmark needs moto for its local S3 stand-in: pip install 'moto[server]'")
+        server = ThreadedMotoServer(port=MOTO_PORT, verbose=False)
+        server.start()
+        endpoint_url = f"http://127.0.0.1:{MOTO_PORT}"
+
+    # Child processes inherit these, so DataService talks to the stand-in unchanged
+    os.environ["AWS_ENDPOINT_URL_S3"] = endpoint_url
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    s3 = boto3.client("s3")
+    try:
+        s3.create_bucket(Bucket=BUCKET)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    return s3, server
+
+
+def run_benchmarks(rows_list, formats, endpoint_url=None):
+    """Benchmark every format at every size and return the results document"""
+    s3, server = start_stand_in(endpoint_url)
+    pool_context = multiprocessing.get_context("spawn")
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        for rows in rows_list:
+            df = synthetic_frame(rows)
+            for file_format in formats:
+                record = {"format": file_format, "rows": rows}
+                if file_format == "xlsx" and rows > XLSX_MAX_ROWS:
+                    record["skipped"] = f"xlsx is only benchmarked up to {XLSX_MAX_ROWS:,} rows"
+                    results.append(record)
+                    continue
+
+                key = write_object(df, file_format, work_dir)
+                path = os.path.join(work_dir, key)
+                s3.upload_file(path, BUCKET, key)
+                size = os.path.getsize(path)
+
+                cache_dir = os.path.join(work_dir, f"cache_{file_format}_{rows}")
+                print(f"Benchmarking {file_format} with {rows:,} rows ({size / 1024 ** 2:.1f} MB)...")
+                record.update(run_isolated(pool_context, file_format, rows, key, size, cache_dir))
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                results.append(record)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if server is not None:
+            server.stop()
+
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "results": results,
+    }
+
+
+def compare(document, baseline):
+    """Print each metric of the run next to a baseline run, as the ratio new / old"""
+    old_results = {(r["format"], r["rows"]): r for r in baseline["results"]}
+    print(f"Compared with {baseline.get('commit') or 'baseline'} (ratio new / old, lower is better):")
+    for record in document["results"]:
+        old = old_results.get((record["format"], record["rows"]))
+        if old is None or "skipped" in record or "skipped" in old or "error" in record or "error" in old:
+            continue
+        metrics = [(name, record.get(name), old.get(name)) for name in COMPARED_METRICS]
+        for chart_type, chart in record.get("charts", {}).items():
+            old_chart = old.get("charts", {}).get(chart_type, {})
+            for name in ("build_seconds", "serialize_seconds", "figure_bytes"):
+                metrics.append((f"{chart_type}.{name}", chart.get(name), old_chart.get(name)))
+        ratios = [f"{name} {new / before:.2f}x" for name, new, before in metrics if new is not None and before]
+        print(f"  {record['format']} {record['rows']:,} rows: {', '.join(ratios)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading, aggregating and rendering synthetic datasets.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="dataset sizes in rows")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=FORMATS, help="object formats to benchmark")
+    parser.add_argument("--endpoint-url", help="S3-compatible endpoint to use instead of a local moto server")
+    parser.add_argument("--output", help="write the results as JSON to this file instead of stdout")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    document = run_benchmarks(args.rows, args.formats, args.endpoint_url)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(document, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(document, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
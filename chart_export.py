@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import plotly.io as pio
+from charts import DEFAULT_WEBGL_THRESHOLD, apply_theme, build_figure, chart_reducer, serialize_figure
+from downsampling import DEFAULT_POINT_BUDGET
+import metrics
+
+try:
+    import kaleido
+except ImportError:
+    # Image export is optional; without Kaleido only the data extracts are written
+    kaleido = None
+
+# Batch export of charts and the data behind them, as a zip of images and extracts.
+#
+#   python chart_export.py --bucket ieee-dataport --path data/readings.csv --x time --y load voltage \
+#       --chart line bar --formats png csv --output charts.zip
+#
+# Figures are built with the same query and build_figure path as the interactive graph; images
+# are rendered by Kaleido in a pool of worker processes while the next charts are queried.
+
+IMAGE_FORMATS = ["png", "svg", "pdf"]
+DATA_FORMATS = ["csv", "parquet"]
+EXPORT_FORMATS = IMAGE_FORMATS + DATA_FORMATS
+DEFAULT_EXPORT_FORMATS = ["png", "csv"]
+
+# Image size, matching the graph's own download button
+DEFAULT_IMAGE_WIDTH = 1200
+DEFAULT_IMAGE_HEIGHT = 800
+DEFAULT_IMAGE_SCALE = 2
+
+# Charts queued for rendering per worker; bounds the figures held in memory by a large batch
+RENDER_QUEUE_PER_WORKER = 2
+
+# Most charts one export may hold, after expanding combinations
+MAX_EXPORT_CHARTS = 1000
+
+# Bytes of the zip held back before they are handed to the response
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+CHART_TYPES = ["scatter", "bar", "line"]
+
+
+def chart_figure(data_service, dataset, table_name, x_col, y_col, key_col=None, chart_type="scatter",
+                 theme="plotly_white", reducer="sum", time_bucket="auto", line_method="lttb",
+                 budget=DEFAULT_POINT_BUDGET, hover="detail", hover_columns=None, render_mode="auto",
+                 webgl_threshold=DEFAULT_WEBGL_THRESHOLD, filters=None):
+    """Query a table for a chart and build its figure, as the interactive graph does.
+
+    Only the plotted and hover columns are read, and bar/line groups are reduced by the
+    backend, so the data fetched grows with the chart, not the table. Returns the figure, its
+    summary, the queried frame (grouped for aggregated charts) and what the query reported.
+    """
+    profile = dataset.profile(table_name)
+    hover_columns = [col for col in hover_columns or [] if col in profile]
+    group_reducer = chart_reducer(chart_type, reducer, profile.get(x_col))
+    group = {"x": x_col, "y": y_col, "color": key_col, "reducer": group_reducer, "time_bucket": time_bucket} if group_reducer else None
+    df, query_info = data_service.query(dataset, table_name, [x_col, y_col, key_col] + hover_columns, filters=filters, group=group)
+    fig, stats = build_figure(
+        df, x_col, y_col, key_col, chart_type, theme,
+        reducer=reducer, time_bucket=time_bucket, line_method=line_method, budget=budget,
+        profile=profile, hover=hover, hover_columns=hover_columns,
+        render_mode=render_mode, webgl_threshold=webgl_threshold, filtered=bool(filters), query_info=query_info,
+    )
+    return fig, stats, df, query_info
+
+
+def expand_specs(specs):
+    """Expand chart specs whose x, y, color or chart are lists into one spec per combination.
+
+    A spec is a dict of x, y and optionally table, color, chart, reducer, time_bucket,
+    line_method, budget and filters (see query_engine). Combinations plotting a column
+    against itself are skipped.
+    """
+    if isinstance(specs, dict):
+        specs = [specs]
+    expanded = []
+    for spec in specs:
+        axes = {key: spec.get(key) for key in ("x", "y", "color", "chart")}
+        options = [value if isinstance(value, list) else [value] for value in axes.values()]
+        for values in itertools.product(*options):
+            combination = dict(spec, **dict(zip(axes, values)))
+            combination["chart"] = combination["chart"] or "scatter"
+            if combination["x"] and combination["y"] and combination["x"] != combination["y"]:
+                expanded.append(combination)
+    return expanded
+
+
+def validate_specs(specs, dataset, formats):
+    """Raise ValueError for unknown formats, chart types, tables or columns before anything is exported"""
+    unknown = [name for name in formats if name not in EXPORT_FORMATS]
+    if unknown or not formats:
+        raise ValueError(f"Formats must be among {', '.join(EXPORT_FORMATS)}, got {', '.join(unknown) or 'none'}")
+    if not specs:
+        raise ValueError("No charts to export")
+    if len(specs) > MAX_EXPORT_CHARTS:
+        raise ValueError(f"{len(specs)} charts requested; at most {MAX_EXPORT_CHARTS} can be exported at once")
+    for spec in specs:
+        if spec["chart"] not in CHART_TYPES:
+            raise ValueError(f"Unknown chart type '{spec['chart']}'")
+        table_name = dataset.table_name(spec.get("table"))
+        if spec.get("table") and spec["table"] != table_name:
+            raise ValueError(f"Dataset has no table '{spec['table']}'")
+        columns = dataset.get_table(table_name).columns
+        missing = [spec[key] for key in ("x", "y", "color") if spec.get(key) and spec[key] not in columns]
+        if missing:
+            raise ValueError(f"Table '{table_name}' has no column '{missing[0]}'")
+        if spec["x"] == spec["y"] and chart_reducer(spec["chart"], spec.get("reducer", "sum"), dataset.profile(table_name).get(spec["x"])):
+            raise ValueError(f"A {spec['chart']} chart cannot group '{spec['x']}' by itself; choose different x and y columns")
+
+
+def export_name(index, spec):
+    """File name stem of an exported chart, e.g. 003_line_load_by_time"""
+    name = f"{index:03d}_{spec['chart']}_{spec['y']}_by_{spec['x']}"
+    if spec.get("color"):
+        name += f"_per_{spec['color']}"
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)[:120]
+
+
+def start_renderer():
+    """Start Kaleido's browser once per worker process instead of once per image"""
+    if kaleido is None or not hasattr(kaleido, "start_sync_server"):
+        return
+    try:
+        # The shared server fails in its own thread, leaving every render waiting, so make sure a browser starts first
+        asyncio.run(open_browser())
+    except Exception as e:
+        # Without the server each image starts its own browser, and fails with the reason
+        print(f"Could not start the image renderer: {e}")
+        return
+    kaleido.start_sync_server(silence_warnings=True)
+
+
+async def open_browser():
+    async with kaleido.Kaleido():
+        pass
+
+
+def render_image(figure, image_format, width, height, scale):
+    """Render a themed figure dict to image bytes with Kaleido"""
+    return pio.to_image(figure, format=image_format, width=width, height=height, scale=scale, validate=False)
+
+
+class ZipStream:
+    """Write-only file object collecting what zipfile writes, to be handed out in chunks.
+
+    It cannot seek, so zipfile streams each entry with a trailing data descriptor.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self, minimum=0):
+        """Return the bytes written since the last call, or b"" while fewer than minimum are held"""
+        if self.size < minimum or not self.size:
+            return b""
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+class ChartExporter:
+    """Exports batches of charts of a dataset as a zip of images and data extracts.
+
+    Each chart is queried and built in the calling thread, as the interactive graph would,
+    and its images are rendered in a process pool, so rendering a large batch does not compete
+    with the server's callbacks for the GIL. The pool is started on first use and shared by later exports.
+    """
+
+    def __init__(self, data_service, workers=None, width=DEFAULT_IMAGE_WIDTH, height=DEFAULT_IMAGE_HEIGHT,
+                 scale=DEFAULT_IMAGE_SCALE):
+        self.data_service = data_service
+        self.workers = workers or os.cpu_count() or 1
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def render_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=start_renderer)
+            return self.pool
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True, cancel_futures=True)
+                self.pool = None
+
+    def export(self, dataset, specs, formats=DEFAULT_EXPORT_FORMATS, theme="plotly_white"):
+        """Return an iterator over the bytes of a zip holding each chart's images and extracts.
+
+        specs are expanded with expand_specs and checked up front, raising ValueError before any
+        byte is produced. The archive is produced while it is read: a chart that fails to query
+        or render is skipped, and manifest.json at its end lists every chart, its files and any errors.
+        """
+        specs = expand_specs(specs)
+        validate_specs(specs, dataset, formats)
+        return self.stream(dataset, specs, formats, theme)
+
+    def stream(self, dataset, specs, formats, theme):
+        image_formats = [name for name in formats if name in IMAGE_FORMATS]
+        data_formats = [name for name in formats if name in DATA_FORMATS]
+        if image_formats and kaleido is None:
+            print("Image export needs the kaleido package (pip install kaleido); exporting data only.")
+
+        started = time.perf_counter()
+        stream = ZipStream()
+        manifest = []
+        pending = deque()
+        max_pending = self.workers * RENDER_QUEUE_PER_WORKER
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+            for index, spec in enumerate(specs):
+                name = export_name(index, spec)
+                entry = {"name": name, "spec": spec, "files": [], "errors": {}}
+                manifest.append(entry)
+                try:
+                    with metrics.span("export", chart=spec["chart"]):
+                        figure, df = self.build(dataset, spec, theme, entry)
+                        for data_format in data_formats:
+                            write_extract(archive, f"{name}.{data_format}", df, data_format)
+                            entry["files"].append(f"{name}.{data_format}")
+                except Exception as e:
+                    entry["errors"]["chart"] = str(e)
+                    continue
+
+                for image_format in image_formats:
+                    if kaleido is None:
+                        entry["errors"][image_format] = "kaleido is not installed"
+                        continue
+                    future = self.render_pool().submit(render_image, figure, image_format, self.width, self.height, self.scale)
+                    pending.append((entry, f"{name}.{image_format}", image_format, future))
+                # Write finished images while later charts are queried, waiting only when the queue is full
+                while pending and (len(pending) > max_pending or pending[0][3].done()):
+                    write_image(archive, *pending.popleft())
+                data = stream.take(STREAM_CHUNK_BYTES)
+                if data:
+                    yield data
+
+            while pending:
+                write_image(archive, *pending.popleft())
+                data = stream.take(STREAM_CHUNK_BYTES)
+                if data:
+                    yield data
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2, default=str))
+        yield stream.take()
+
+        failed = sum(1 for entry in manifest if entry["errors"])
+        print(f"Exported {len(manifest)} charts ({failed} with errors) from dataset {dataset.id} in {time.perf_counter() - started:.1f}s.")
+
+    def build(self, dataset, spec, theme, entry):
+        """Build one chart and return its themed figure dict and queried frame"""
+        chart_type = spec["chart"]
+        # WebGL traces come out as a single raster in SVG and PDF, so images always use SVG traces
+        fig, stats, df, query_info = chart_figure(
+            self.data_service, dataset, dataset.table_name(spec.get("table")), spec["x"], spec["y"],
+            key_col=spec.get("color"), chart_type=chart_type, theme=theme,
+            reducer=spec.get("reducer", "sum"), time_bucket=spec.get("time_bucket", "auto"),
+            line_method=spec.get("line_method", "lttb"), budget=int(spec.get("budget") or DEFAULT_POINT_BUDGET),
+            hover="plotted", render_mode="svg", filters=spec.get("filters"),
+        )
+        entry["stats"] = stats
+        entry["rows"] = query_info["rows"]
+        # Raw rows of a chart come back with their row positions, which the extract keeps as a column
+        if not query_info.get("reducer"):
+            df = df.rename_axis("row").reset_index()
+        return apply_theme(serialize_figure(fig), theme), df
+
+
+def write_extract(archive, name, df, data_format):
+    """Add a chart's queried frame to the archive as CSV or Parquet"""
+    if data_format == "csv":
+        with archive.open(name, "w") as f:
+            df.to_csv(f, index=False)
+    else:
+        # Parquet is already compressed
+        archive.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), df.to_parquet(index=False), zipfile.ZIP_STORED)
+
+
+def write_image(archive, entry, name, image_format, future):
+    """Add a rendered image to the archive, or record why it failed"""
+    try:
+        image = future.result()
+    except Exception as e:
+        entry["errors"][image_format] = str(e).strip()
+        return
+    archive.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), image, zipfile.ZIP_DEFLATED if image_format == "svg" else zipfile.ZIP_STORED)
+    entry["files"].append(name)
+
+
+def main():
+    from dotenv import load_dotenv
+    from data_service import DataService
+
+    parser = argparse.ArgumentParser(description="Export charts of a dataset on S3 as images and aggregated data extracts.")
+    parser.add_argument("--bucket", required=True, help="S3 bucket of the dataset")
+    parser.add_argument("--path", required=True, help="dataset path in the bucket, as in the app's Dataset Path")
+    parser.add_argument("--table", help="table of the dataset, e.g. a file of a zip archive (default: the first)")
+    parser.add_argument("--x", nargs="+", help="x columns; every x/y combination is exported")
+    parser.add_argument("--y", nargs="+", help="y columns")
+    parser.add_argument("--color", help="column to color or group by")
+    parser.add_argument("--chart", nargs="+", choices=CHART_TYPES, default=["scatter"], help="chart types to export")
+    parser.add_argument("--reducer", default="sum", help="how bar and line charts reduce y")
+    parser.add_argument("--spec", help="JSON file with a list of chart specs, instead of --x/--y")
+    parser.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=DEFAULT_EXPORT_FORMATS, help="files written per chart")
+    parser.add_argument("--theme", default="plotly_white", help="plotly template of the images")
+    parser.add_argument("--workers", type=int, help="image rendering processes (default: the number of CPUs)")
+    parser.add_argument("--output", default="charts.zip", help="zip file to write")
+    args = parser.parse_args()
+
+    if args.spec:
+        with open(args.spec) as f:
+            specs = json.load(f)
+    elif args.x and args.y:
+        specs = {"x": args.x, "y": args.y, "color": args.color, "chart": args.chart, "reducer": args.reducer, "table": args.table}
+    else:
+        parser.error("give --x and --y, or --spec")
+
+    load_dotenv()
+    data_service = DataService(
+        os.getenv("AWS_ACCESS_KEY_ID"),
+        os.getenv("AWS_SECRET_ACCESS_KEY"),
+        cache_dir=os.getenv("DATASET_CACHE_DIR", ".dataset_cache"),
+        backend=os.getenv("QUERY_BACKEND", "pandas"),
+        duckdb_memory_limit=os.getenv("DUCKDB_MEMORY_LIMIT"),
+    )
+    dataset = data_service.load_dataset_from_s3(args.bucket, args.path)
+    if dataset is None:
+        raise SystemExit(f"Could not load {args.bucket}/{args.path}")
+
+    exporter = ChartExporter(data_service, workers=args.workers)
+    try:
+        with open(args.output, "wb") as f:
+            for chunk in exporter.export(dataset, specs, args.formats, args.theme):
+                f.write(chunk)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        exporter.close()
+    print(f"Wrote {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import json
+import time
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from aggregation import MAX_GROUPS, aggregate, reduced_label
+from downsampling import DEFAULT_POINT_BUDGET, downsample_line, sample_scatter, slice_range
+from query_engine import RANGE_KINDS
+import metrics
+
+# How points describe themselves on hover:
+#   plotted - only the plotted x, y and color values
+#   columns - the plotted values plus a chosen set of columns
+#   detail  - the plotted values, with each point carrying its row index so a click fetches the full row
+HOVER_MODES = ["plotted", "columns", "detail"]
+
+# Name of the column carrying a point's row index in the table, sent as customdata
+ROW_COLUMN = "_row"
+
+# Rendering of scatter and line traces: auto switches to WebGL above the point threshold
+RENDER_MODES = ["auto", "svg", "webgl"]
+DEFAULT_WEBGL_THRESHOLD = 10_000
+
+# A figure extended with appended rows is redrawn once it holds this many times its point budget
+MAX_EXTENDED_BUDGETS = 2
+
+# Bars in the cross-filter chart: histogram bins, or the most common values of other columns
+DEFAULT_DISTRIBUTION_BINS = 40
+MAX_DISTRIBUTION_CATEGORIES = 50
+
+
+def choose_render_mode(render_mode, points, threshold=DEFAULT_WEBGL_THRESHOLD):
+    """Resolve the render mode for a trace of the given size to 'svg' or 'webgl'"""
+    if render_mode == "auto":
+        return "webgl" if points > threshold else "svg"
+    return render_mode
+
+
+def datetime_to_epoch_ms(series):
+    """Convert datetimes to float milliseconds since the epoch so they serialize as a typed array.
+
+    Timezone-aware values keep their wall-clock time, which is what the date axis would have shown.
+    """
+    if series.dt.tz is not None:
+        series = series.dt.tz_localize(None)
+    values = series.to_numpy(dtype="datetime64[ms]").astype(np.int64).astype(float)
+    values[series.isna().to_numpy()] = np.nan
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def is_presorted(profile, x_col, *columns):
+    """True if the profile shows x sorted ascending and none of the columns missing values"""
+    x_stats = profile.get(x_col)
+    if not x_stats or not x_stats["sorted"]:
+        return False
+    return all(profile.get(col) and profile[col]["nulls"] == 0 for col in (x_col,) + columns)
+
+
+def chart_reducer(chart_type, reducer, x_stats=None):
+    """The reducer a chart aggregates y with, or None when it plots raw rows.
+
+    Stacked raw bars render as their sum, so bars are always aggregated. x_stats is the x
+    column's profile: lines over a dense numeric x, e.g. the time vector of a MATLAB or HDF5
+    signal, plot raw rows, which downsample_line thins while keeping the signal's shape.
+    """
+    if chart_type == 'scatter':
+        return None
+    if chart_type == 'line' and x_stats and x_stats["kind"] == "numeric" and x_stats["cardinality"] > MAX_GROUPS:
+        return None
+    if reducer == 'none':
+        return 'sum' if chart_type == 'bar' else None
+    return reducer
+
+
+def build_figure(df, x_col, y_col, key_col, chart_type, theme, reducer="sum", time_bucket="auto",
+                 line_method="lttb", budget=DEFAULT_POINT_BUDGET, zoom=None, profile=None,
+                 hover="detail", hover_columns=None, render_mode="auto", webgl_threshold=DEFAULT_WEBGL_THRESHOLD,
+                 filtered=False, query_info=None):
+    """Reduce the frame for the requested chart and build its figure.
+
+    profile is the column profile of the table df was read from, used to skip rescans of
+    ranges, cardinalities and sort order. hover is one of HOVER_MODES; df must hold
+    hover_columns in "columns" mode and keep the table's row positions as its index in
+    "detail" mode. render_mode is one of RENDER_MODES for scatter and line charts. filtered
+    marks df as a filtered subset, whose range the profile no longer describes. query_info is
+    what DataService.query reported for df: its matching and total row counts and, when df is
+    already grouped, how. Returns the figure and a short summary of how many points were rendered.
+    """
+    zoom = zoom or {}
+    profile = profile or {}
+    total_rows = query_info["table_rows"] if query_info else len(df)
+
+    # When zoomed in, only the visible slice is reduced so detail reappears at full resolution
+    df = slice_range(df, x_col, zoom.get('xaxis'), presorted=is_presorted(profile, x_col))
+    if chart_type == 'scatter':
+        df = slice_range(df, y_col, zoom.get('yaxis'))
+    visible_rows = query_info["rows"] if query_info else len(df)
+
+    # Bar and line charts only need grouped values, so reduce them server-side unless the query already did
+    y_title = y_col
+    agg_info = query_info if query_info and query_info.get("reducer") else None
+    reducer = chart_reducer(chart_type, reducer, profile.get(x_col))
+    if reducer:
+        if agg_info is None:
+            with metrics.span("aggregate"):
+                df, agg_info = aggregate(
+                    df, x_col, y_col, key_col, reducer=reducer, time_bucket=time_bucket,
+                    profile=profile, sliced=filtered or visible_rows < total_rows,
+                )
+        y_title = reduced_label(y_col, reducer)
+
+    # Thin out whatever is still above the point budget
+    with metrics.span("downsample", chart=chart_type):
+        if chart_type == 'scatter':
+            df = sample_scatter(df, x_col, y_col, budget=budget)
+        elif chart_type == 'line':
+            # Raw rows skip the null filter and sort when the profile allows; aggregated frames are small
+            presorted = y_title == y_col and is_presorted(profile, x_col, y_col)
+            df = downsample_line(df, x_col, y_col, key_col, budget=budget, method=line_method, presorted=presorted)
+    build_started = time.perf_counter()
+
+    # Aggregated points do not correspond to rows, so they only show their plotted values
+    hover_data = None
+    custom_data = None
+    if y_title == y_col:
+        if hover == "columns" and hover_columns:
+            hover_data = [col for col in hover_columns if col in df.columns and col not in (x_col, y_col, key_col)]
+        elif hover == "detail":
+            df = df.assign(**{ROW_COLUMN: df.index})
+            custom_data = [ROW_COLUMN]
+
+    # Dates go out as epoch milliseconds on a date axis: a typed array instead of a list of strings
+    date_x = pd.api.types.is_datetime64_any_dtype(df[x_col])
+    if date_x:
+        df = df.assign(**{x_col: datetime_to_epoch_ms(df[x_col])})
+
+    render_mode = choose_render_mode(render_mode, len(df), webgl_threshold)
+
+    # Create base figure based on chart type
+    if chart_type == 'scatter':
+        fig = px.scatter(
+            df,
+            x=x_col,
+            y=y_col,
+            color=key_col if key_col else None,
+            hover_data=hover_data,
+            custom_data=custom_data,
+            render_mode=render_mode,
+            title=f"{y_col} vs {x_col}",
+            template=theme,
+        )
+    elif chart_type == 'bar':
+        fig = px.bar(
+            df,
+            x=x_col,
+            y=y_col,
+            color=key_col if key_col else None,
+            hover_data=hover_data,
+            custom_data=custom_data,
+            title=f"{y_title} by {x_col}",
+            template=theme,
+        )
+    elif chart_type == 'line':
+        fig = px.line(
+            df,
+            x=x_col,
+            y=y_col,
+            color=key_col if key_col else None,
+            hover_data=hover_data,
+            custom_data=custom_data,
+            render_mode=render_mode,
+            title=f"{y_title} Trend by {x_col}",
+            template=theme,
+        )
+
+    # Improve layout
+    fig.update_layout(
+        margin=dict(l=20, r=20, t=50, b=20),
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        xaxis_title=x_col,
+        yaxis_title=y_title,
+        # Keep the user's zoom while the same columns are shown
+        uirevision=f"{x_col}|{y_col}",
+    )
+    if date_x:
+        fig.update_xaxes(type="date")
+
+    stats = f"Showing {len(df):,} points from {visible_rows:,} of {total_rows:,} rows"
+    if agg_info and agg_info.get("bins"):
+        stats += f", {x_col} in {agg_info['bins']:,} equal-width bins"
+    elif agg_info and agg_info.get("truncated"):
+        stats += f", only the {MAX_GROUPS:,} largest of {agg_info['groups']:,} {x_col} values"
+    if chart_type != 'bar' and render_mode == 'webgl':
+        stats += " (WebGL)"
+    metrics.record("build", time.perf_counter() - build_started, chart=chart_type)
+    return fig, stats
+
+
+def live_state(fig, dataset_id, chart_type, reducer, x_col, key_col, hover, profile, rows):
+    """Describe a drawn figure for extending it with rows a refresh appends (see figure_extension).
+
+    rows is the number of rows the figure was drawn from. Only charts of raw rows can grow
+    point by point: appended rows change the points of grouped bars and lines, and hover
+    columns would need the figure's own customdata layout.
+    """
+    state = {"id": dataset_id, "extendable": False}
+    if chart_reducer(chart_type, reducer, profile.get(x_col)) or hover == "columns" or not fig.data:
+        return state
+    if chart_type == 'line' and profile[x_col]["kind"] not in RANGE_KINDS:
+        return state
+
+    # Lines only grow to the right of the last point drawn
+    x_max = None
+    if chart_type == 'line':
+        xs = [np.asarray(trace.x, dtype=float) for trace in fig.data if trace.x is not None and len(trace.x)]
+        x_max = float(max(np.nanmax(x) for x in xs)) if xs else None
+    return dict(
+        state,
+        extendable=True,
+        traces=[trace.name for trace in fig.data],
+        continuous=bool(chart_type == 'scatter' and key_col and profile[key_col]["kind"] == "numeric"),
+        x_max=x_max,
+        points=sum(len(trace.x) for trace in fig.data if trace.x is not None),
+        rows=rows,
+    )
+
+
+def figure_extension(df, state, dataset_id, x_col, y_col, key_col, chart_type, hover, line_method="lttb",
+                     budget=DEFAULT_POINT_BUDGET):
+    """Points for appended rows as the extendData of a figure live_state described.
+
+    df holds the appended rows that pass the chart's filters, indexed by row position. They
+    are thinned to the share of the point budget they are of the rows now charted. Returns
+    (extend_data, state), with extend_data None when there is nothing to add, or None when
+    the figure has to be redrawn instead: new color groups, lines reaching back before their
+    last point, or more points than a redraw would keep.
+    """
+    if not state or not state.get("extendable"):
+        return None
+    rows = state["rows"] + len(df)
+    state = dict(state, id=dataset_id, rows=rows)
+    if df.empty:
+        return None, state
+
+    share = max(1, round(budget * len(df) / rows))
+    with metrics.span("downsample", chart=chart_type):
+        if chart_type == 'scatter':
+            df = sample_scatter(df, x_col, y_col, budget=share)
+        else:
+            df = downsample_line(df, x_col, y_col, key_col, budget=share, method=line_method)
+    if key_col and not state["continuous"]:
+        # Like plotly express, rows without a color value are not drawn
+        df = df[df[key_col].notna()]
+    if state["points"] + len(df) > MAX_EXTENDED_BUDGETS * budget:
+        return None
+
+    x = datetime_to_epoch_ms(df[x_col]) if pd.api.types.is_datetime64_any_dtype(df[x_col]) else df[x_col]
+    if chart_type == 'line' and state["x_max"] is not None and len(x) and x.min() < state["x_max"]:
+        return None
+
+    names = df[key_col].astype(str) if key_col and not state["continuous"] else pd.Series("", index=df.index)
+    if not set(names.unique()) <= set(state["traces"]):
+        return None
+
+    update = {"x": [], "y": []}
+    if hover == "detail":
+        update["customdata"] = []
+    if state["continuous"]:
+        update["marker.color"] = []
+    traces = []
+    for name, positions in names.groupby(names, sort=False).groups.items():
+        part = df.loc[positions]
+        traces.append(state["traces"].index(name))
+        update["x"].append(x.loc[positions].tolist())
+        update["y"].append(part[y_col].tolist())
+        if hover == "detail":
+            update["customdata"].append([[row] for row in positions.tolist()])
+        if state["continuous"]:
+            update["marker.color"].append(part[key_col].tolist())
+
+    state["points"] += len(df)
+    if chart_type == 'line' and len(x):
+        state["x_max"] = float(x.max())
+    return [update, traces], state
+
+
+def build_distribution(series, kind, theme, bins=DEFAULT_DISTRIBUTION_BINS, total_rows=None):
+    """Build the cross-filter chart of one column: a histogram, or bar counts of its most common values.
+
+    Bins and counts are computed server-side, so only a few dozen bars are sent however many
+    rows the column has. When series is a sample of total_rows rows, counts are scaled up to
+    estimate the full counts. The chart opens in box-select mode for brushing.
+    """
+    scale = total_rows / len(series) if total_rows and len(series) else 1
+    values = series.dropna()
+    date_x = kind == "datetime"
+    if kind in ("numeric", "datetime") and not values.empty:
+        if date_x:
+            if values.dt.tz is not None:
+                values = values.dt.tz_localize(None)
+            values = values.astype("datetime64[ns]").astype("int64")
+        counts, edges = np.histogram(values.to_numpy(dtype=float), bins=bins)
+        centers = (edges[:-1] + edges[1:]) / 2
+        widths = np.diff(edges)
+        if date_x:
+            # Date axes position and size bars in epoch milliseconds
+            centers = centers / 1e6
+            widths = widths / 1e6
+        fig = go.Figure(go.Bar(x=centers, y=np.round(counts * scale), width=widths))
+    else:
+        counts = values.value_counts().head(MAX_DISTRIBUTION_CATEGORIES)
+        fig = go.Figure(go.Bar(x=counts.index.tolist(), y=np.round(counts.to_numpy() * scale)))
+        fig.update_xaxes(type="category")
+
+    fig.update_layout(
+        title=f"Distribution of {series.name}",
+        template=theme,
+        margin=dict(l=20, r=20, t=50, b=20),
+        xaxis_title=series.name,
+        yaxis_title="rows",
+        dragmode="select",
+        uirevision=str(series.name),
+    )
+    if date_x:
+        fig.update_xaxes(type="date")
+    return fig
+
+
+def serialize_figure(fig):
+    """Serialize a figure without its template so it can be re-themed cheaply"""
+    with metrics.span("serialize"):
+        figure = fig.to_plotly_json()
+        figure.get('layout', {}).pop('template', None)
+        figure_json = pio.to_json(figure, validate=False)
+    metrics.observe("figure_bytes", len(figure_json), buckets=metrics.BYTES_BUCKETS)
+    return figure_json
+
+
+@lru_cache(maxsize=None)
+def theme_template(theme):
+    """The layout template of a theme as a plain dict, built once per theme"""
+    return pio.templates[theme].to_plotly_json()
+
+
+def apply_theme(figure_json, theme):
+    """Rebuild a figure dict from its serialized form with the given template applied.
+
+    The offered themes share one colorway, so trace colors baked in by plotly express stay valid.
+    """
+    figure = json.loads(figure_json)
+    figure.setdefault('layout', {})['template'] = theme_template(theme)
+    return figure
@@ -0,0 +1,148 @@
+import warnings
+import pandas as pd
+from csv_ingest import DATE_MIN_RATIO, is_text, parse_dates
+
+# Text values sampled per column to decide whether it holds dates
+DATE_SAMPLE_ROWS = 10_000
+
+# Numeric columns whose name contains one of these are identifiers, not measurements
+ID_KEYWORDS = ("id", "index")
+
+# Cardinalities up to this are recounted when rows are appended; above it charts, filters and
+# time buckets all treat a column the same, so an upper bound is enough (see aggregation.MAX_GROUPS)
+EXACT_CARDINALITY_LIMIT = 2000
+
+
+def guess_date_format(values):
+    """Guess the strftime format of date strings from the first value, or None"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return pd.tseries.api.guess_datetime_format(str(values.iloc[0]))
+
+
+def text_to_datetime(series, date_format=None):
+    """Parse a text column that holds dates, with its detected format when there is one"""
+    if date_format:
+        return pd.to_datetime(series, format=date_format, errors="coerce")
+    return parse_dates(series)
+
+
+def detect_dates(series):
+    """Return (True, format) if the sampled values of a text column parse as dates"""
+    values = series.dropna()
+    if values.empty:
+        return False, None
+    sample = values.iloc[:DATE_SAMPLE_ROWS]
+    date_format = guess_date_format(sample)
+    if text_to_datetime(sample, date_format).notna().mean() >= DATE_MIN_RATIO:
+        return True, date_format
+    if date_format and parse_dates(sample).notna().mean() >= DATE_MIN_RATIO:
+        # The first value's format does not fit the rest, so parse element by element
+        return True, None
+    return False, None
+
+
+def profile_column(name, series):
+    """Describe one column: its kind, size, cardinality, range, sortedness and nulls"""
+    profile = {
+        "kind": "text",
+        "dtype": str(series.dtype),
+        "count": int(series.notna().sum()),
+        "nulls": int(series.isna().sum()),
+        "cardinality": int(series.nunique()),
+        "min": None,
+        "max": None,
+        "sorted": False,
+        "date_format": None,
+        "id_like": False,
+    }
+
+    if pd.api.types.is_bool_dtype(series):
+        profile["kind"] = "bool"
+    elif pd.api.types.is_numeric_dtype(series):
+        profile["kind"] = "numeric"
+        profile["id_like"] = any(keyword in name.lower() for keyword in ID_KEYWORDS)
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        profile["kind"] = "datetime"
+    elif isinstance(series.dtype, pd.CategoricalDtype):
+        profile["kind"] = "category"
+    elif is_text(series):
+        is_date, date_format = detect_dates(series)
+        if is_date:
+            profile["kind"] = "datetime"
+            profile["date_format"] = date_format
+            series = text_to_datetime(series, date_format)
+
+    if profile["kind"] in ("numeric", "datetime"):
+        values = series.dropna()
+        if not values.empty:
+            profile["min"] = values.min()
+            profile["max"] = values.max()
+            profile["sorted"] = bool(values.is_monotonic_increasing)
+    return profile
+
+
+def profile_table(table):
+    """Profile every column of a table, reading one column at a time.
+
+    Tables queried out of core (see duckdb_backend) profile themselves without being read.
+    """
+    if getattr(table, "pushdown", False):
+        return table.profile_columns()
+    return {
+        name: profile_column(name, table.to_pandas([name])[name])
+        for name in table.columns
+    }
+
+
+def merge_profiles(profile, appended, table):
+    """Profile of a table that appended rows to the table profile describes, or None if it must be recomputed.
+
+    appended is the profile of the new rows alone. Counts, nulls, ranges and sortedness
+    combine exactly. Cardinalities above EXACT_CARDINALITY_LIMIT are bounded by their sum,
+    which leaves every decision a profile feeds unchanged; smaller ones are recounted from
+    table. Columns whose kind differs between the two need a full profile.
+    """
+    if list(profile) != list(appended):
+        return None
+    dtypes = table.schema_frame().dtypes
+    merged = {}
+    for name, old in profile.items():
+        new = appended[name]
+        if old["kind"] != new["kind"] or old["date_format"] != new["date_format"]:
+            return None
+        column = dict(old, dtype=str(dtypes[name]), count=old["count"] + new["count"], nulls=old["nulls"] + new["nulls"])
+
+        if max(old["cardinality"], new["cardinality"]) > EXACT_CARDINALITY_LIMIT:
+            column["cardinality"] = min(old["cardinality"] + new["cardinality"], column["count"])
+        else:
+            column["cardinality"] = int(table.to_pandas([name])[name].nunique())
+
+        if new["min"] is not None:
+            if old["min"] is None:
+                column.update(min=new["min"], max=new["max"], sorted=new["sorted"])
+            else:
+                column["sorted"] = old["sorted"] and new["sorted"] and new["min"] >= old["max"]
+                column["min"] = min(old["min"], new["min"])
+                column["max"] = max(old["max"], new["max"])
+        merged[name] = column
+    return merged
+
+
+def classify(profile):
+    """Split profiled columns into categorical/date columns and non-identifier numeric columns"""
+    categorical_cols = [name for name, column in profile.items() if column["kind"] in ("text", "category", "datetime")]
+    numerical_cols = [name for name, column in profile.items() if column["kind"] == "numeric" and not column["id_like"]]
+    return categorical_cols, numerical_cols
+
+
+def apply_profile(df, profile):
+    """Convert text columns the profile found to hold dates into datetimes, without touching the input frame"""
+    converted = None
+    for col in df.columns:
+        column = profile.get(col)
+        if column and column["kind"] == "datetime" and is_text(df[col]):
+            if converted is None:
+                converted = df.copy(deep=False)
+            converted[col] = text_to_datetime(df[col], column["date_format"])
+    return converted if converted is not None else df
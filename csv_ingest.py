@@ -0,0 +1,130 @@
+import warnings
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Rows per chunk; the first chunk doubles as the sample used to infer dtypes
+DEFAULT_CHUNK_ROWS = 200_000
+
+# Text columns whose sample has at most this share of distinct values become categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+# Share of sampled text values that must parse as dates for a column to be read as datetime
+DATE_MIN_RATIO = 0.95
+
+
+def is_text(series):
+    """Return True for object or string columns"""
+    return series.dtype == object or pd.api.types.is_string_dtype(series)
+
+
+def parse_dates(series):
+    """Parse text as datetimes, turning anything unparseable into NaT"""
+    with warnings.catch_warnings():
+        # Format inference falls back to per-element parsing with a warning we do not need
+        warnings.simplefilter("ignore", UserWarning)
+        return pd.to_datetime(series, errors="coerce")
+
+
+def infer_column_kinds(sample):
+    """Decide how each column of a sample should be stored: integer, float, datetime, category or text"""
+    kinds = {}
+    for col in sample.columns:
+        series = sample[col]
+        if pd.api.types.is_bool_dtype(series):
+            kinds[col] = "bool"
+        elif pd.api.types.is_integer_dtype(series):
+            kinds[col] = "integer"
+        elif pd.api.types.is_float_dtype(series):
+            kinds[col] = "float"
+        elif is_text(series):
+            values = series.dropna()
+            if values.empty:
+                kinds[col] = "text"
+            elif parse_dates(values).notna().mean() >= DATE_MIN_RATIO:
+                kinds[col] = "datetime"
+            elif values.nunique() <= CATEGORY_MAX_RATIO * len(values):
+                kinds[col] = "category"
+            else:
+                kinds[col] = "text"
+        else:
+            kinds[col] = "other"
+    return kinds
+
+
+def compact_chunk(chunk, kinds, downcast_floats=True):
+    """Convert one chunk to the compact dtypes chosen from the sample"""
+    for col, kind in kinds.items():
+        series = chunk[col]
+        if kind in ("integer", "float"):
+            # Later chunks may disagree with the sample (missing values turn integers into floats,
+            # stray text turns numbers into objects), so downcast by what the chunk actually holds
+            if pd.api.types.is_integer_dtype(series):
+                chunk[col] = pd.to_numeric(series, downcast="integer")
+            elif pd.api.types.is_float_dtype(series) and downcast_floats:
+                # float32 keeps only ~7 significant digits, so narrow only when no value changes
+                narrow = series.astype("float32")
+                if narrow.astype(series.dtype).equals(series):
+                    chunk[col] = narrow
+        elif kind == "datetime":
+            chunk[col] = parse_dates(series)
+        elif kind == "category":
+            chunk[col] = series.astype("category")
+    return chunk
+
+
+def combine_chunks(chunks, kinds):
+    """Concatenate compact chunks, merging the categories of categorical columns"""
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+
+    columns = {}
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if kinds.get(col) == "category" and all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            # A chunk that is empty or numeric in this column infers different category dtypes,
+            # which union_categoricals rejects, so bring every chunk to text categories first
+            parts = [part.cat.rename_categories(part.cat.categories.astype(str)) for part in parts]
+            columns[col] = pd.Series(union_categoricals(parts), name=col)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def read_csv_compact(source, usecols=None, chunksize=DEFAULT_CHUNK_ROWS, downcast_floats=True, progress=None):
+    """Read a CSV in chunks with compact dtypes inferred from the first chunk.
+
+    Integers are downcast, floats only where float32 holds them exactly, low-cardinality text
+    becomes categorical and date-like text is parsed as datetime. Only usecols are kept when given. progress("parse", rows=n) is
+    called after each chunk. Returns the frame and a summary with the memory the default parse
+    would have used and the memory actually used.
+    """
+    reader = pd.read_csv(source, usecols=usecols, chunksize=chunksize)
+    chunks = []
+    kinds = None
+    memory_before = 0
+    for chunk in reader:
+        memory_before += int(chunk.memory_usage(deep=True).sum())
+        if kinds is None:
+            kinds = infer_column_kinds(chunk)
+        chunks.append(compact_chunk(chunk, kinds, downcast_floats))
+        if progress:
+            progress("parse", rows=len(chunk))
+
+    if not chunks:
+        return pd.DataFrame(), {"rows": 0, "memory_before": 0, "memory_after": 0}
+
+    df = combine_chunks(chunks, kinds)
+    summary = {
+        "rows": len(df),
+        "memory_before": memory_before,
+        "memory_after": int(df.memory_usage(deep=True).sum()),
+    }
+    return df, summary
+
+
+def format_memory_summary(summary):
+    """Human readable memory line for a load summary"""
+    before = summary["memory_before"] / 1024 ** 2
+    after = summary["memory_after"] / 1024 ** 2
+    saved = 100 * (1 - after / before) if before else 0
+    return f"{summary['rows']:,} rows in {after:.1f} MB (default dtypes: {before:.1f} MB, {saved:.0f}% smaller)"
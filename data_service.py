@@ -1,94 +1,456 @@
 import boto3
+import hashlib
+import json
+import time
 import pandas as pd
-from io import BytesIO
-import zipfile
-from scipy.io import loadmat
-import h5py
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+import os
 import numpy as np
+from dataset_cache import DatasetCache, DEFAULT_MAX_BYTES
+from dataset_registry import Dataset
+from table_store import FrameTable, SegmentedTable
+from zip_loader import ZipArchive, DEFAULT_MAX_OPEN_MEMBERS, index_zip, load_zip_members, print_progress
+from array_loader import ARRAY_FORMATS, open_array_file
+from csv_ingest import DEFAULT_CHUNK_ROWS, format_memory_summary, read_csv_compact
+from s3_transfer import RangedDownloader, DEFAULT_PART_SIZE, DEFAULT_MAX_CONCURRENCY, SPOOL_MAX_SIZE
+from aggregation import aggregate
+import metrics
+from duckdb_backend import PARQUET_SUFFIX, configure as configure_duckdb, csv_to_parquet, duckdb
+
+# Most rows an out-of-core query returns for a chart of raw rows; more are sampled down to this
+DEFAULT_QUERY_MAX_ROWS = 1_000_000
+
+# Files loaded from a prefix (a path ending in "/"), stacked in key order into one table
+PREFIX_FORMATS = ('.csv', '.xlsx')
+PREFIX_TABLE = "All files"
 
 class DataService:
-    def __init__(self, aws_access_key_id, aws_secret_access_key):
+    """Loads datasets from S3 through the local dataset cache; holds no per-session state.
+
+    With backend="pandas" CSV files are read into memory; with backend="duckdb" they are
+    converted to Parquet in the cache and queried out of core. query() serves charts either way.
+    """
+
+    def __init__(self, aws_access_key_id, aws_secret_access_key, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                 part_size=DEFAULT_PART_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 zip_workers=None, zip_executor="process", lazy_zip=True, max_open_members=DEFAULT_MAX_OPEN_MEMBERS,
+                 compact_csv=True, csv_chunk_rows=DEFAULT_CHUNK_ROWS, backend="pandas", duckdb_memory_limit=None):
         self.s3 = boto3.client(
             's3',
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key
         )
-        self.data = None
+        self.cache = DatasetCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.downloader = RangedDownloader(self.s3, part_size, max_concurrency)
+        self.zip_workers = zip_workers
+        self.zip_executor = zip_executor
+        self.lazy_zip = lazy_zip
+        self.max_open_members = max_open_members
+        self.compact_csv = compact_csv
+        self.csv_chunk_rows = csv_chunk_rows
+        
+        self.backend = backend
+        if backend == "duckdb":
+            if duckdb is None or self.cache is None:
+                # Out-of-core tables are Parquet files in the dataset cache, queried by DuckDB
+                print("The DuckDB backend needs the duckdb package and a dataset cache; falling back to pandas.")
+                self.backend = "pandas"
+            else:
+                configure_duckdb(duckdb_memory_limit, os.path.join(cache_dir, "duckdb_tmp"))
     
-    def load_dataset_from_s3(self, bucket_name, prefix):
-        try:
-            response = self.s3.get_object(Bucket=bucket_name, Key=prefix)
+    def load_dataset_from_s3(self, bucket_name, prefix, columns=None, progress=None):
+        """Load a dataset from S3 and return it as a Dataset, or None if it could not be loaded.
 
-            # Determine the file type based on the prefix (file name)
-            if prefix.endswith('.csv'):
-                # Load single CSV file
-                data = pd.read_csv(BytesIO(response['Body'].read()))
-                print("Single CSV file loaded successfully.")
-                self.data = {"Single CSV File": data}
-                return self.data
-
-            elif prefix.endswith('.xlsx'):
-                # Load single Excel file
-                data = pd.read_excel(BytesIO(response['Body'].read()))
-                print("Single Excel file loaded successfully.")
-                self.data = {"Single Excel File": data}
-                return self.data
-
-            elif prefix.endswith('.zip'):
-                # Handle zip file containing multiple files
-                dataframes = {}
-                with zipfile.ZipFile(BytesIO(response['Body'].read())) as z:
-                    file_list = z.namelist()
-                    print("Files in the zip:", file_list)
-
-                    # Loop through all files in the zip
-                    for file_name in file_list:
-                        if file_name.endswith('.csv'):
-                            print(f"Loading CSV file: {file_name}")
-                            with z.open(file_name) as f:
-                                dataframes[file_name] = pd.read_csv(f)
-                                print(f"CSV file '{file_name}' loaded.")
-
-                        elif file_name.endswith('.xlsx'):
-                            print(f"Loading Excel file: {file_name}")
-                            with z.open(file_name) as f:
-                                dataframes[file_name] = pd.read_excel(f)
-                                print(f"Excel file '{file_name}' loaded.")
-
-                print("All files in the zip loaded successfully.")
-                self.data = dataframes
-                return self.data
+        progress(stage, **info) is called as bytes download, rows parse and zip members finish;
+        an exception it raises aborts the load.
+        """
+        report = {"errors": {}, "summary": {}}
+        started = time.perf_counter()
+        try:
+            if prefix.endswith('/'):
+                # A folder of files, e.g. daily CSV drops, shown as one table
+                dataset = self.open_prefix(bucket_name, prefix, columns, progress)
+                metrics.record("load", time.perf_counter() - started, format="prefix")
+                return dataset
 
-            else:
+            if not prefix.endswith(('.csv', '.xlsx', '.zip') + ARRAY_FORMATS):
                 print("Unsupported file format.")
                 return None
 
+            # A HEAD request is enough to tell whether the local copy is still current
+            head = self.s3.head_object(Bucket=bucket_name, Key=prefix)
+            etag = head.get('ETag')
+            last_modified = str(head.get('LastModified'))
+            version = self.dataset_version(bucket_name, prefix, etag, columns)
+
+            entry = self.cache.lookup(bucket_name, prefix, etag, last_modified) if self.cache else None
+            if self.cache:
+                metrics.increment("dataset_cache_total", result="miss" if entry is None else "hit")
+            size = head.get('ContentLength', 0)
+            if progress:
+                progress("start", total_bytes=size)
+
+            # Out-of-core tables live in the dataset cache, so a CSV too large for it is read into memory instead
+            out_of_core = prefix.endswith('.csv') and self.backend == "duckdb"
+            if out_of_core and entry is None and not self.cache.fits(size):
+                print(f"'{prefix}' is larger than the dataset cache, reading it into memory instead of querying it out of core.")
+                out_of_core = False
+
+            if prefix.endswith(ARRAY_FORMATS):
+                tables = self.open_arrays(bucket_name, prefix, size, etag, last_modified, entry, progress)
+            elif prefix.endswith('.zip') and self.lazy_zip:
+                tables = self.open_zip(bucket_name, prefix, size, etag, last_modified, entry, progress)
+            elif out_of_core:
+                tables = self.open_out_of_core(bucket_name, prefix, size, etag, last_modified, entry, progress)
+            else:
+                tables = self.load_tables(
+                    bucket_name, prefix, size, etag, last_modified, entry, columns, progress, report
+                )
+
+            source = {"bucket": bucket_name, "prefix": prefix, "columns": columns}
+            dataset = Dataset(version, tables, source, report["errors"], report["summary"])
+            
+            # Profile columns once here so pages and charts never rescan them
+            dataset.profile_loaded_tables()
+            metrics.record("load", time.perf_counter() - started, format=os.path.splitext(prefix)[1].lstrip('.'))
+            return dataset
+
         except Exception as e:
             print(f"Error loading dataset: {e}")
             return None
+
+    def load_tables(self, bucket_name, prefix, size, etag, last_modified, entry, columns=None, progress=None,
+                    report=None):
+        """Parse every table of an object, reusing the local cache where possible.
+
+        Column-pruned CSV loads reuse the cached download but not the cached full-width tables.
+        """
+        if entry is not None and not columns:
+            tables = self.cache.load_tables(entry)
+            if tables is not None:
+                print(f"Dataset '{prefix}' loaded from local cache.")
+                return tables
+
+        raw_path = self.cache.raw_path(entry) if entry is not None else None
+        if raw_path is not None:
+            print(f"Parsing cached copy of '{prefix}'.")
+            with open(raw_path, 'rb') as f:
+                dataframes = self.parse_object(prefix, f, columns, progress, report)
+        else:
+            dataframes, entry = self.download_and_parse(
+                bucket_name, prefix, size, etag, last_modified, columns, progress, report
+            )
+
+        if self.cache and entry is not None and not columns:
+            # Serve from the columnar copy so later reads only touch the columns a chart needs
+            self.cache.store_frames(entry, dataframes)
+            entry = self.cache.lookup(bucket_name, prefix, etag, last_modified)
+            tables = self.cache.load_tables(entry) if entry is not None else None
+            if tables is not None:
+                return tables
+        return {name: FrameTable(df) for name, df in dataframes.items()}
+
+    def list_prefix(self, bucket_name, prefix):
+        """List the CSV and Excel objects under a prefix in key order, as key to {"etag", "size", "last_modified"}"""
+        listing = {}
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith(PREFIX_FORMATS):
+                    listing[obj['Key']] = {
+                        "etag": obj.get('ETag'),
+                        "size": obj.get('Size', 0),
+                        "last_modified": str(obj.get('LastModified')),
+                    }
+        return listing
+
+    def open_prefix(self, bucket_name, prefix, columns=None, progress=None, previous=None):
+        """Load the CSV and Excel files under a prefix as one table, downloading only files changed since previous; None if none changed"""
+        listing = self.list_prefix(bucket_name, prefix)
+        current = {key: head["etag"] for key, head in listing.items()}
+        old_table = previous.get_table(PREFIX_TABLE) if previous is not None else None
+        old_listing = old_table.listing if old_table is not None else {}
+        if old_table is not None and current == old_listing:
+            return None
+
+        old_segments = {key: (etag, table) for key, etag, table in old_table.segments} if old_table is not None else {}
+        order = [key for key in old_listing if key in current] + [key for key in current if key not in old_listing]
+        # Files that failed before are only retried once they change
+        unchanged = {key for key in order if old_listing.get(key) == current[key]}
+        errors = {key: error for key, error in (previous.load_errors if previous else {}).items() if key in unchanged}
+        report = {"errors": errors, "summary": {}}
+        if progress:
+            progress("start", total_bytes=sum(listing[key]["size"] for key in order if key not in unchanged))
+
+        # An exception from progress aborts the load, while one from a file only skips that file
+        aborted = []
+        def object_progress(stage, **info):
+            try:
+                progress(stage, **info)
+            except BaseException as e:
+                aborted.append(e)
+                raise
+
+        segments = []
+        for key in order:
+            if key in unchanged:
+                if key in old_segments:
+                    segments.append((key, current[key], old_segments[key][1]))
+                continue
+            try:
+                table = self.load_object(bucket_name, key, listing[key], columns, object_progress if progress else None, report)
+                if segments and table.columns != segments[0][2].columns:
+                    raise ValueError(f"its columns differ from those of '{segments[0][0]}'")
+            except Exception as e:
+                if aborted:
+                    raise
+                print(f"Skipping '{key}': {e}")
+                report["errors"][key] = str(e)
+                continue
+            segments.append((key, current[key], table))
+        if not segments:
+            raise ValueError("No CSV or Excel files under the prefix could be loaded")
+
+        digest = hashlib.sha1(json.dumps(current, sort_keys=True).encode()).hexdigest()
+        source = {"bucket": bucket_name, "prefix": prefix, "columns": columns}
+        table = SegmentedTable(segments, current)
+        dataset = Dataset(self.dataset_version(bucket_name, prefix, digest, columns), {PREFIX_TABLE: table}, source,
+                          report["errors"], report["summary"])
+        print(f"Stacked {len(segments)} file(s) under '{prefix}': {table.num_rows:,} rows.")
+
+        appended = segments[len(old_table.segments):] if old_table is not None else []
+        if appended and all(current.get(key) == etag for key, etag in old_listing.items()):
+            dataset.extend_from(previous, {PREFIX_TABLE: SegmentedTable(appended)})
+        else:
+            dataset.profile_loaded_tables()
+        return dataset
+
+    def refresh_prefix(self, dataset):
+        """Return a new version of a dataset loaded from a prefix with the files added or changed since, or None"""
+        source = dataset.source
+        with metrics.span("refresh"):
+            return self.open_prefix(source["bucket"], source["prefix"], source.get("columns"), previous=dataset)
+
+    def load_object(self, bucket_name, key, head, columns=None, progress=None, report=None):
+        """Load one listed CSV or Excel object as a table through the dataset cache, e.g. a file of a prefix"""
+        entry = self.cache.lookup(bucket_name, key, head["etag"], head["last_modified"]) if self.cache else None
+        if self.cache:
+            metrics.increment("dataset_cache_total", result="miss" if entry is None else "hit")
+        object_report = {"errors": {}, "summary": {}}
+        tables = self.load_tables(
+            bucket_name, key, head["size"], head["etag"], head["last_modified"], entry, columns, progress, object_report
+        )
+        if report is not None:
+            for summary in object_report["summary"].values():
+                report["summary"][key] = summary
+        return next(iter(tables.values()))
+
+    def open_zip(self, bucket_name, prefix, size, etag, last_modified, entry, progress=None):
+        """Index a zip archive without parsing its members; each is parsed when first selected"""
+        archive_path = self.cache.raw_path(entry) if entry is not None else None
+        keep_alive = None
+        if archive_path is None:
+            archive_path, entry, keep_alive = self.download_to_disk(
+                bucket_name, prefix, size, etag, last_modified, progress
+            )
+
+        members = entry.get("members") if entry is not None else None
+        if members is None:
+            members = index_zip(archive_path)
+            if entry is not None:
+                self.cache.store_members(entry, members)
+        if not members:
+            raise ValueError("The zip contains no CSV or Excel files")
+        print(f"Indexed {len(members)} files in the zip.")
+
+        archive = ZipArchive(
+            archive_path, members, cache=self.cache if entry is not None else None, entry=entry,
+            max_open=self.max_open_members, keep_alive=keep_alive, compact=self.compact_csv,
+        )
+        return archive.tables()
+
+    def open_out_of_core(self, bucket_name, prefix, size, etag, last_modified, entry, progress=None):
+        """Convert a CSV file to Parquet in the dataset cache and query it with DuckDB instead of loading it.
+
+        A column selection is not applied: queries only read the columns a chart uses anyway.
+        """
+        tables = self.cache.load_tables(entry) if entry is not None else None
+        if tables:
+            print(f"Dataset '{prefix}' opened from local cache.")
+            return tables
+
+        csv_path = self.cache.raw_path(entry) if entry is not None else None
+        if csv_path is None:
+            # load_dataset_from_s3 only comes here for files that fit in the cache
+            csv_path, entry, _ = self.download_to_disk(bucket_name, prefix, size, etag, last_modified, progress)
+
+        print(f"Converting '{prefix}' to Parquet.")
+        with metrics.span("parse", format="parquet"):
+            table = self.cache.store_converted(
+                entry, "Single CSV File", PARQUET_SUFFIX, lambda path: csv_to_parquet(csv_path, path)
+            )
+        if table is None:
+            raise ValueError("The converted file does not fit in the dataset cache")
+        metrics.increment("rows_loaded_total", table.num_rows, format="parquet")
+        if progress:
+            progress("parse", rows=table.num_rows)
+        print(f"Single CSV file converted: {table.num_rows:,} rows, queried out of core.")
+        return {"Single CSV File": table}
+
+    def open_arrays(self, bucket_name, prefix, size, etag, last_modified, entry, progress=None):
+        """Open a .mat or HDF5 file as tables whose columns are read only when a chart needs them"""
+        path = self.cache.raw_path(entry) if entry is not None else None
+        keep_alive = None
+        if path is None:
+            path, entry, keep_alive = self.download_to_disk(bucket_name, prefix, size, etag, last_modified, progress)
+
+        tables = open_array_file(path, prefix, keep_alive)
+        if not tables:
+            raise ValueError("The file contains no numeric arrays that can be shown as columns")
+        print(f"Indexed {len(tables)} table(s) in '{prefix}'.")
+        return tables
+
+    def download_to_disk(self, bucket_name, prefix, size, etag, last_modified, progress=None):
+        """Download an object that needs random access to local disk, into the cache when it fits.
+
+        Returns its path, its cache entry and, when it lives in a temporary file instead,
+        the file object that must stay referenced for the file to exist.
+        """
+        # Decide from the size HEAD reported, so an object too large for the cache is downloaded only once
+        if self.cache and self.cache.fits(size):
+            target = self.cache.raw_target(bucket_name, prefix)
+            try:
+                with open(target, 'w+b') as f:
+                    self.downloader.download(bucket_name, prefix, size, f, progress)
+            except BaseException:
+                os.remove(target)
+                raise
+            entry = self.cache.store_raw(bucket_name, prefix, etag, last_modified, target)
+            return self.cache.raw_path(entry), entry, None
+        if self.cache:
+            print("Object is larger than the dataset cache, keeping a temporary copy instead.")
+
+        temp = NamedTemporaryFile(suffix=os.path.splitext(prefix)[1])
+        self.downloader.download(bucket_name, prefix, size, temp, progress)
+        return temp.name, None, temp
+
+    def download_and_parse(self, bucket_name, prefix, size, etag, last_modified, columns=None, progress=None,
+                           report=None):
+        """Download an object as parallel byte ranges and parse it.
+
+        CSV files are parsed while the download is still running; xlsx and zip files need
+        random access and are parsed once all parts are on disk. When the local cache is
+        enabled the object is written straight into it. Returns the frames and cache entry.
+        """
+        target = self.cache.raw_target(bucket_name, prefix) if self.cache else None
+        entry = None
+
+        if prefix.endswith('.csv'):
+            sink = open(target, 'wb') if target else None
+            try:
+                with self.downloader.open_stream(bucket_name, prefix, size, sink=sink, progress=progress) as stream:
+                    dataframes = self.parse_object(prefix, stream, columns, progress, report)
+                    # Drain anything the parser left unread so the cached copy is complete
+                    while stream.read(self.downloader.part_size):
+                        pass
+            except BaseException:
+                # A failed or cancelled load must not leave a partial download behind
+                if sink:
+                    sink.close()
+                    os.remove(target)
+                raise
+            finally:
+                if sink:
+                    sink.close()
+        else:
+            fileobj = open(target, 'w+b') if target else SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            try:
+                with fileobj:
+                    self.downloader.download(bucket_name, prefix, size, fileobj, progress)
+                    dataframes = self.parse_object(prefix, fileobj, columns, progress, report)
+            except BaseException:
+                if target:
+                    os.remove(target)
+                raise
+
+        if target:
+            entry = self.cache.store_raw(bucket_name, prefix, etag, last_modified, target)
+        return dataframes, entry
+
+    def parse_object(self, prefix, source, columns=None, progress=None, report=None):
+        """Parse a downloaded object from a file-like source into a dict of dataframes.
+
+        columns restricts a single CSV file to the given columns. Memory summaries and files
+        that failed to parse are recorded in report["summary"] and report["errors"].
+        """
+        file_format = os.path.splitext(prefix)[1].lstrip('.')
+        with metrics.span("parse", format=file_format):
+            dataframes = self.parse_frames(prefix, source, columns, progress, report)
+        metrics.increment("rows_loaded_total", sum(len(df) for df in dataframes.values()), format=file_format)
+        return dataframes
+
+    def parse_frames(self, prefix, source, columns=None, progress=None, report=None):
+        """Parse an object into a dict of dataframes for parse_object"""
+        report = report if report is not None else {"errors": {}, "summary": {}}
+        # Determine the file type based on the prefix (file name)
+        if prefix.endswith('.csv'):
+            # Load single CSV file, in chunks with compact dtypes unless disabled
+            if self.compact_csv:
+                data, summary = read_csv_compact(
+                    source, usecols=columns, chunksize=self.csv_chunk_rows, progress=progress
+                )
+                report["summary"]["Single CSV File"] = summary
+                print(f"Single CSV file loaded successfully: {format_memory_summary(summary)}")
+            else:
+                data = pd.read_csv(source, usecols=columns)
+                print("Single CSV file loaded successfully.")
+            return {"Single CSV File": data}
+
+        elif prefix.endswith('.xlsx'):
+            # Load single Excel file
+            data = pd.read_excel(source)
+            print("Single Excel file loaded successfully.")
+            return {"Single Excel File": data}
+
+        # Handle zip file containing multiple files, parsing members concurrently
+        def member_progress(file_name, status, done, total):
+            print_progress(file_name, status, done, total)
+            if progress:
+                progress("member", done=done, total=total, name=file_name)
+
+        dataframes, errors = load_zip_members(
+            source, workers=self.zip_workers, executor=self.zip_executor, progress=member_progress,
+            compact=self.compact_csv,
+        )
+        report["errors"] = errors
+        if errors:
+            print(f"Loaded {len(dataframes)} files from the zip, {len(errors)} failed.")
+        else:
+            print("All files in the zip loaded successfully.")
+        return dataframes
     
-    def get_dataset(self):
-        """Return the loaded dataset"""
-        return self.data
+    def query(self, dataset, table_name, columns, filters=None, group=None, max_rows=DEFAULT_QUERY_MAX_ROWS):
+        """Return the rows, or with group the grouped and reduced rows, a chart needs from a table as (frame, info)"""
+        table = dataset.get_table(table_name)
+        profile = dataset.profile(table_name)
+        if getattr(table, "pushdown", False):
+            # Projection, filters and aggregation run in DuckDB against the file on disk
+            with metrics.span("query", backend="duckdb"):
+                df, info = table.query(columns, profile, filters, group, max_rows)
+        else:
+            with metrics.span("query", backend="pandas"):
+                df = dataset.get_dataframe(table_name, columns, filters=filters)
+            info = {"rows": len(df), "sampled": False}
+            if group is not None:
+                with metrics.span("aggregate"):
+                    df, info = aggregate(
+                        df, group["x"], group["y"], group.get("color"), reducer=group.get("reducer", "sum"),
+                        time_bucket=group.get("time_bucket", "auto"), profile=profile, sliced=bool(filters),
+                    )
+        info["table_rows"] = table.num_rows
+        return df, info
     
-    def get_dataframe(self):
-        """Return the first dataframe in the dataset"""
-        if self.data:
-            return list(self.data.values())[0] if isinstance(self.data, dict) else self.data
-        return None
-
-    def classify_columns(self):
-        """Classify columns as categorical or numerical"""
-        df = self.get_dataframe()
-        if df is None:
-            return [], []
-            
-        categorical_cols = df.select_dtypes(include=['object', 'datetime']).columns.tolist()
-        
-        # Exclude ID-like numerical columns
-        numerical_cols = [
-            col for col in df.select_dtypes(include=['number']).columns
-            if not any(keyword in col.lower() for keyword in ["id", "index"])
-        ]
-        
-        return categorical_cols, numerical_cols
\ No newline at end of file
+    @staticmethod
+    def dataset_version(bucket_name, prefix, etag, columns=None):
+        """Identify a dataset by its location, the content hash S3 reports for it and any column selection"""
+        selection = ",".join(columns or [])
+        return hashlib.sha1(f"{bucket_name}/{prefix}/{etag}/{selection}".encode()).hexdigest()[:16]
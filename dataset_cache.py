@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from table_store import ARROW_SUFFIX, ArrowTable, write_arrow
+from duckdb_backend import PARQUET_SUFFIX, ParquetTable
+
+# Default size cap of the on-disk dataset cache
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+RAW_FILE = "object.bin"
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) only the threads of one process are serialized
+    fcntl = None
+
+
+class DatasetCache:
+    """Persistent local cache of downloaded S3 objects and their parsed frames in columnar form.
+
+    Entries are validated against the object's ETag and LastModified and evicted
+    least recently used first once the cache grows past max_bytes. Several worker
+    processes may share one cache directory: the index is re-read under a file lock
+    before every change, so each worker sees the datasets the others stored.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._read_index()
+
+    def lookup(self, bucket_name, key, etag, last_modified):
+        """Return the cache entry for the object if it is still current, else None"""
+        with self._locked():
+            entry = self.index.get(self._entry_id(bucket_name, key))
+            if entry is None or entry["etag"] != etag or entry["last_modified"] != last_modified:
+                return None
+            entry["last_access"] = time.time()
+            self._write_index()
+            return dict(entry)
+
+    def raw_path(self, entry):
+        """Return the path of the cached object bytes, or None if they were not kept"""
+        path = os.path.join(self._entry_dir(entry["id"]), RAW_FILE)
+        return path if os.path.exists(path) else None
+
+    def load_tables(self, entry):
+        """Memory-map the cached columnar tables of an entry, or return None if they were not stored"""
+        if not entry.get("tables"):
+            return None
+        entry_dir = self._entry_dir(entry["id"])
+        return {name: open_table(os.path.join(entry_dir, file_name))
+                for name, file_name in entry["tables"].items()}
+
+    def fits(self, size):
+        """Return True if an object of size bytes can be kept in the cache"""
+        return size <= self.max_bytes
+
+    def raw_target(self, bucket_name, key):
+        """Drop any stale entry for the object and return the path its download should be written to.
+
+        Each call gets its own path, so concurrent downloads of the same object (e.g. several
+        workers warming the same dataset) do not write into or delete each other's files.
+        """
+        entry_id = self._entry_id(bucket_name, key)
+        with self._locked():
+            self._remove(entry_id, keep_partial=True)
+            entry_dir = self._entry_dir(entry_id)
+            os.makedirs(entry_dir, exist_ok=True)
+            return os.path.join(entry_dir, f"{RAW_FILE}.{uuid.uuid4().hex}.part")
+
+    def store_raw(self, bucket_name, key, etag, last_modified, path):
+        """Register a completed download written to the path returned by raw_target"""
+        entry_id = self._entry_id(bucket_name, key)
+        with self._locked():
+            raw_path = os.path.join(self._entry_dir(entry_id), RAW_FILE)
+            os.replace(path, raw_path)
+
+            self.index[entry_id] = {
+                "id": entry_id,
+                "bucket": bucket_name,
+                "key": key,
+                "etag": etag,
+                "last_modified": last_modified,
+                "tables": {},
+                "size": os.path.getsize(raw_path),
+                "last_access": time.time(),
+            }
+            self._evict(keep=entry_id)
+            self._write_index()
+            return dict(self.index.get(entry_id, {})) or None
+
+    def store_frames(self, entry, frames):
+        """Persist the parsed frames of an entry as Arrow IPC files alongside its raw object"""
+        with self._locked():
+            current = self.index.get(entry["id"])
+            if current is None:
+                return
+
+            entry_dir = self._entry_dir(entry["id"])
+            tables = {}
+            for i, (name, df) in enumerate(frames.items()):
+                file_name = f"table_{i}{ARROW_SUFFIX}"
+                write_arrow(df, os.path.join(entry_dir, file_name))
+                tables[name] = file_name
+
+            current["tables"] = tables
+            current["size"] = self._dir_size(entry_dir)
+            self._evict(keep=entry["id"])
+            self._write_index()
+
+    def store_members(self, entry, members):
+        """Remember the member index of a cached zip archive"""
+        with self._locked():
+            current = self.index.get(entry["id"])
+            if current is not None:
+                current["members"] = members
+                self._write_index()
+
+    def load_table(self, entry, name):
+        """Memory-map one cached table of an entry, or return None if it was not stored yet"""
+        with self._locked():
+            current = self.index.get(entry["id"])
+            file_name = current["tables"].get(name) if current else None
+        if file_name is None:
+            return None
+        return open_table(os.path.join(self._entry_dir(entry["id"]), file_name))
+
+    def store_table(self, entry, name, df):
+        """Persist one parsed table of an entry, e.g. a zip member opened on demand, and map it back"""
+        with self._locked():
+            current = self.index.get(entry["id"])
+            if current is None:
+                return None
+
+            entry_dir = self._entry_dir(entry["id"])
+            file_name = current["tables"].get(name) or f"table_{len(current['tables'])}{ARROW_SUFFIX}"
+            write_arrow(df, os.path.join(entry_dir, file_name))
+            current["tables"][name] = file_name
+            current["size"] = self._dir_size(entry_dir)
+            self._evict(keep=entry["id"])
+            self._write_index()
+            if entry["id"] not in self.index:
+                return None
+        return ArrowTable(os.path.join(entry_dir, file_name))
+
+    def store_converted(self, entry, name, suffix, write):
+        """Persist one table of an entry that write(path) produces itself, e.g. a CSV converted to
+        Parquet out of core, and open it.
+
+        The file is written outside the cache lock, since a conversion can take minutes.
+        """
+        entry_dir = self._entry_dir(entry["id"])
+        with self._locked():
+            current = self.index.get(entry["id"])
+            if current is None:
+                return None
+            file_name = current["tables"].get(name) or f"table_{len(current['tables'])}{suffix}"
+
+        tmp_path = os.path.join(entry_dir, f"{file_name}.{uuid.uuid4().hex}.part")
+        try:
+            write(tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._locked():
+            current = self.index.get(entry["id"])
+            if current is None:
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, os.path.join(entry_dir, file_name))
+            current["tables"][name] = file_name
+            current["size"] = self._dir_size(entry_dir)
+            self._evict(keep=entry["id"])
+            self._write_index()
+            if entry["id"] not in self.index:
+                return None
+        return open_table(os.path.join(entry_dir, file_name))
+
+    def _evict(self, keep=None):
+        # Drop least recently used entries until the cache fits its size cap
+        total = sum(entry["size"] for entry in self.index.values())
+        for entry in sorted(self.index.values(), key=lambda e: e["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if entry["id"] == keep:
+                continue
+            total -= entry["size"]
+            print(f"Evicting cached dataset: {entry['bucket']}/{entry['key']}")
+            self._remove(entry["id"])
+
+        # An object larger than the whole cache is not kept at all
+        if keep in self.index and self.index[keep]["size"] > self.max_bytes:
+            self._remove(keep)
+
+    def _remove(self, entry_id, keep_partial=False):
+        self.index.pop(entry_id, None)
+        entry_dir = self._entry_dir(entry_id)
+        if not keep_partial:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        elif os.path.isdir(entry_dir):
+            # Downloads still in progress finish into the directory and register themselves
+            for name in os.listdir(entry_dir):
+                if not name.endswith(".part"):
+                    os.remove(os.path.join(entry_dir, name))
+
+    def _entry_id(self, bucket_name, key):
+        return hashlib.sha1(f"{bucket_name}/{key}".encode()).hexdigest()
+
+    def _entry_dir(self, entry_id):
+        return os.path.join(self.cache_dir, entry_id)
+
+    def _dir_size(self, path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    @contextmanager
+    def _locked(self):
+        # Serialize threads of this process and, where supported, other worker processes
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.cache_dir, LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.index = self._read_index()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self):
+        # Write then rename so a crash never leaves a truncated index behind
+        path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, path)
+
+
+def open_table(path):
+    """Open a cached table file: Parquet files are queried by DuckDB, Arrow files are memory-mapped"""
+    if path.endswith(PARQUET_SUFFIX):
+        return ParquetTable(path)
+    return ArrowTable(path)
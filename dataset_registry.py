@@ -0,0 +1,252 @@
+import threading
+from collections import OrderedDict
+from array_loader import ArrayTable
+from column_profile import apply_profile, classify, merge_profiles, profile_table
+import metrics
+from query_engine import TableQuery
+from zip_loader import ZipMemberTable
+
+# Default memory budget for the datasets one worker keeps open
+DEFAULT_MAX_RESIDENT_BYTES = 2 * 1024 ** 3
+
+
+class Dataset:
+    """A loaded dataset: its tables and what its load reported, shared read-only by every session"""
+
+    def __init__(self, dataset_id, tables, source, load_errors=None, load_summary=None):
+        self.id = dataset_id
+        self.tables = tables
+        self.source = source
+        self.load_errors = load_errors or {}
+        self.load_summary = load_summary or {}
+        self.profiles = {}
+        self.queries = {}
+        self.profile_lock = threading.Lock()
+        # Set when this version only appended rows to a previous one: its id and row counts per table
+        self.appended_from = None
+
+    def ref(self, table_name=None):
+        """Return the JSON reference a session keeps in its dcc.Store"""
+        return dict(self.source, id=self.id, table=table_name or self.default_table())
+
+    def default_table(self):
+        return next(iter(self.tables), None)
+
+    def get_table(self, name=None):
+        """Return the named table, or the first one"""
+        if not self.tables:
+            return None
+        return self.tables.get(name) or next(iter(self.tables.values()))
+
+    def table_name(self, name=None):
+        """Return the name of the table get_table(name) resolves to"""
+        return name if name in self.tables else self.default_table()
+
+    def profile(self, name=None):
+        """Return the column profile of a table, computing it on first use"""
+        name = self.table_name(name)
+        if name is None:
+            return {}
+        with self.profile_lock:
+            profile = self.profiles.get(name)
+        if profile is None:
+            # Computed outside the lock so profiling one table never holds up reads of another
+            with metrics.span("classify"):
+                profile = profile_table(self.tables[name])
+            with self.profile_lock:
+                profile = self.profiles.setdefault(name, profile)
+        return profile
+
+    def profile_loaded_tables(self):
+        """Profile the default table and every table already in memory, as part of loading"""
+        for name, table in self.tables.items():
+            if name == self.default_table() or not isinstance(table, (ZipMemberTable, ArrayTable)):
+                self.profile(name)
+
+    def extend_from(self, previous, appended):
+        """Take over the profiles and filter indexes of a previous version this one appends rows to"""
+        self.appended_from = {"id": previous.id, "rows": {name: previous.tables[name].num_rows for name in appended}}
+        with previous.profile_lock:
+            profiles = dict(previous.profiles)
+            queries = dict(previous.queries)
+        for name, table in appended.items():
+            if name not in profiles:
+                continue
+            with metrics.span("classify", mode="append"):
+                profile = merge_profiles(profiles[name], profile_table(table), self.tables[name])
+            if profile is None:
+                continue
+            self.profiles[name] = profile
+            if name in queries:
+                self.queries[name] = queries[name].extended(self.tables[name], profile, table)
+        self.profile_loaded_tables()
+
+    def get_appended(self, name, columns, start, filters=None):
+        """Return the rows of a table from start on, which a refresh appended, like get_dataframe does"""
+        table = self.get_table(name).tail(start)
+        df = table.to_pandas(columns)
+        df.index += start
+        rows = self.query(name).rows(filters) if filters else None
+        if rows is not None:
+            df = df.loc[rows[rows >= start]]
+        return apply_profile(df, self.profile(name))
+
+    def query(self, name=None):
+        """Return the filtering engine of a table, creating it on first use"""
+        name = self.table_name(name)
+        if name is None:
+            return None
+        with self.profile_lock:
+            query = self.queries.get(name)
+        if query is None:
+            query = TableQuery(self.tables[name], self.profile(name))
+            with self.profile_lock:
+                query = self.queries.setdefault(name, query)
+        return query
+
+    def filter_values(self, name, col):
+        """Distinct values offered by a column's multiselect filter, or None if there are too many"""
+        table = self.get_table(name)
+        if getattr(table, "pushdown", False):
+            return table.filter_values(col)
+        return self.query(name).filter_values(col)
+
+    def get_dataframe(self, name=None, columns=None, filters=None):
+        """Return a table as a dataframe, optionally reading only the given columns and matching rows"""
+        table = self.get_table(name)
+        if table is None:
+            return None
+        rows = self.query(name).rows(filters) if filters else None
+        df = table.to_pandas(columns)
+        if rows is not None:
+            df = df.take(rows)
+        return apply_profile(df, self.profile(name))
+
+    def get_row(self, name, index):
+        """Return one row of a table as a dict of column to value"""
+        table = self.get_table(name)
+        if table is None or not 0 <= index < table.num_rows:
+            return None
+        return table.read_row(index)
+
+    def describe_tables(self):
+        """List the tables with their uncompressed size and column count where known"""
+        described = []
+        for name, table in self.tables.items():
+            # Zip members only know their columns before parsing if a CSV header was indexed
+            columns = table.header if isinstance(table, ZipMemberTable) else table.columns
+            described.append({
+                "name": name,
+                "size": getattr(table, 'size', None),
+                "columns": len(columns) if columns is not None else None,
+            })
+        return described
+
+    def classify_columns(self, name=None):
+        """Classify the columns of a table as categorical or numerical, from its profile"""
+        return classify(self.profile(name))
+
+    def memory_bytes(self):
+        """Return the memory held by the dataset's tables and filter indexes"""
+        with self.profile_lock:
+            queries = list(self.queries.values())
+        return (sum(table.memory_bytes() for table in self.tables.values())
+                + sum(query.memory_bytes() for query in queries))
+
+
+class DatasetRegistry:
+    """The datasets open in this worker, keyed by dataset ID, closing the least recently used beyond max_bytes"""
+
+    def __init__(self, loader, max_bytes=DEFAULT_MAX_RESIDENT_BYTES):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.datasets = OrderedDict()
+        self.aliases = {}
+        self.loading = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def add(self, dataset):
+        """Register a freshly loaded dataset and return it"""
+        with self.lock:
+            self.datasets[dataset.id] = dataset
+            self.datasets.move_to_end(dataset.id)
+            self._evict(keep=dataset.id)
+        return dataset
+
+    def get(self, ref):
+        """Return the dataset a session refers to, reopening it if this worker does not hold it"""
+        if not ref or not ref.get("id"):
+            return None
+        dataset_id = ref["id"]
+        dataset = self._lookup(dataset_id)
+        if dataset is not None:
+            return dataset
+
+        # Only one session per worker reopens a given dataset; the others wait for it
+        with self.lock:
+            load_lock = self.loading.setdefault(dataset_id, threading.Lock())
+        with load_lock:
+            dataset = self._lookup(dataset_id)
+            if dataset is None:
+                print(f"Opening dataset {dataset_id} ({ref['bucket']}/{ref['prefix']}) in this worker.")
+                dataset = self.loader(ref["bucket"], ref["prefix"], columns=ref.get("columns"))
+                if dataset is not None:
+                    if dataset.id != dataset_id:
+                        # The object changed since the session loaded it; serve the current version
+                        with self.lock:
+                            self.aliases[dataset_id] = dataset.id
+                    self.add(dataset)
+        with self.lock:
+            self.loading.pop(dataset_id, None)
+        return dataset
+
+    def replace(self, previous_id, dataset):
+        """Register a new version of a dataset, e.g. after a refresh, and point sessions of the previous one at it"""
+        with self.lock:
+            self.datasets.pop(previous_id, None)
+            for alias, target in list(self.aliases.items()):
+                if target == previous_id:
+                    self.aliases[alias] = dataset.id
+            self.aliases[previous_id] = dataset.id
+        return self.add(dataset)
+
+    def stats(self):
+        """Return the open datasets, their memory, evictions and filter cache hits and misses"""
+        with self.lock:
+            datasets = list(self.datasets.values())
+            evictions = self.evictions
+        queries = [query.stats() for dataset in datasets for query in list(dataset.queries.values())]
+        return {
+            "datasets": len(datasets),
+            "bytes": sum(dataset.memory_bytes() for dataset in datasets),
+            "evictions": evictions,
+            "filter_hits": sum(query["hits"] for query in queries),
+            "filter_misses": sum(query["misses"] for query in queries),
+        }
+
+    def _lookup(self, dataset_id):
+        with self.lock:
+            dataset_id = self.aliases.get(dataset_id, dataset_id)
+            dataset = self.datasets.get(dataset_id)
+            if dataset is not None:
+                self.datasets.move_to_end(dataset_id)
+                # Lazily opened tables grow a dataset after it was added
+                self._evict(keep=dataset_id)
+            return dataset
+
+    def _evict(self, keep=None):
+        # Close least recently used datasets until the rest fit the memory budget
+        total = sum(dataset.memory_bytes() for dataset in self.datasets.values())
+        for dataset_id in list(self.datasets):
+            if total <= self.max_bytes:
+                break
+            if dataset_id == keep:
+                continue
+            dataset = self.datasets.pop(dataset_id)
+            total -= dataset.memory_bytes()
+            self.evictions += 1
+            print(f"Closing dataset {dataset_id} ({dataset.source['bucket']}/{dataset.source['prefix']}) to free memory.")
+        for alias, target in list(self.aliases.items()):
+            if target not in self.datasets:
+                del self.aliases[alias]
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+
+# Default number of points a single figure may carry
+DEFAULT_POINT_BUDGET = 5000
+
+# Line downsampling methods offered in the Visualization Settings card
+LINE_METHODS = ["lttb", "minmax"]
+
+
+def numeric_positions(series):
+    """Map a column onto float positions usable for distance and area calculations"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.astype("int64").to_numpy(dtype=float)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    # Categorical values are placed by their code in sorted order
+    codes, _ = pd.factorize(series, sort=True)
+    return codes.astype(float)
+
+
+def lttb_indices(x, y, n_out):
+    """Select n_out indices with the largest-triangle-three-buckets algorithm.
+
+    x must be sorted ascending; the first and last points are always kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Interior points are split into n_out - 2 equally sized buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # The third triangle vertex is the average of the next bucket
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        ax, ay = x[previous], y[previous]
+        areas = np.abs((ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """Keep the minimum and maximum of each of n_out / 2 equally sized buckets, in original order"""
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    buckets = np.arange(n) * (n_out // 2) // n
+    values = pd.Series(y)
+    lows = values.groupby(buckets).idxmin().dropna()
+    highs = values.groupby(buckets).idxmax().dropna()
+    keep = np.union1d(lows.to_numpy(dtype=np.int64), highs.to_numpy(dtype=np.int64))
+    return np.union1d(keep, [0, n - 1])
+
+
+def downsample_line(df, x_col, y_col, color_col=None, budget=DEFAULT_POINT_BUDGET, method="lttb", presorted=False):
+    """Reduce each line series to its share of the point budget while keeping its visual shape.
+
+    presorted skips the null filter and sort when the column profile shows x is already
+    sorted and neither x nor y has missing values.
+    """
+    if not presorted:
+        df = df.dropna(subset=[x_col, y_col]).sort_values(x_col, kind="stable")
+    if len(df) <= budget:
+        return df
+
+    groups = [df] if not color_col else [group for _, group in df.groupby(color_col, sort=False, observed=True)]
+    per_series = max(budget // len(groups), 3)
+
+    parts = []
+    for group in groups:
+        y = group[y_col].to_numpy(dtype=float)
+        if method == "minmax":
+            keep = minmax_indices(y, per_series)
+        else:
+            keep = lttb_indices(numeric_positions(group[x_col]), y, per_series)
+        parts.append(group.iloc[keep])
+
+    return pd.concat(parts)
+
+
+def sample_scatter(df, x_col, y_col, budget=DEFAULT_POINT_BUDGET, seed=0):
+    """Density-preserving scatter sample.
+
+    Rows are binned on an x/y grid and every occupied cell keeps a share of the budget proportional
+    to its population, with at least one point, so dense regions stay dense and outliers survive.
+    """
+    if len(df) <= budget:
+        return df
+
+    x = numeric_positions(df[x_col])
+    y = numeric_positions(df[y_col])
+    valid = ~(np.isnan(x) | np.isnan(y))
+    df, x, y = df[valid], x[valid], y[valid]
+    if len(df) <= budget:
+        return df
+
+    grid = max(int(np.sqrt(budget) / 2), 1)
+    cells = _grid_bin(x, grid) * grid + _grid_bin(y, grid)
+
+    # Rank rows randomly within their cell and keep the first quota of each
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(cells)), cells))
+    sorted_cells = cells[order]
+    starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_cells)])
+    quotas = np.maximum(np.floor(counts * budget / len(cells)), 1).astype(np.int64)
+    ranks = np.arange(len(sorted_cells)) - np.repeat(starts, counts)
+    keep = np.sort(order[ranks < np.repeat(quotas, counts)])
+
+    return df.iloc[keep]
+
+
+def _grid_bin(values, grid):
+    low, high = values.min(), values.max()
+    if high <= low:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - low) / (high - low) * grid).astype(np.int64), grid - 1)
+
+
+def slice_range(df, col, bounds, presorted=False):
+    """Restrict the frame to rows whose column value falls inside the zoomed axis range.
+
+    A column the profile shows to be sorted without missing values is sliced by binary search.
+    """
+    if not bounds or col not in df:
+        return df
+
+    series = df[col]
+    low, high = bounds
+    if pd.api.types.is_datetime64_any_dtype(series):
+        low, high = pd.Timestamp(low), pd.Timestamp(high)
+        if series.dt.tz is not None:
+            low, high = low.tz_localize(series.dt.tz), high.tz_localize(series.dt.tz)
+    elif not pd.api.types.is_numeric_dtype(series):
+        # Category axes report positions rather than values, so they are not sliced
+        return df
+
+    if presorted:
+        start = series.searchsorted(low, side="left")
+        stop = series.searchsorted(high, side="right")
+        return df.iloc[start:stop]
+    return df[series.between(low, high)]
+
+
+def parse_relayout(relayout_data):
+    """Extract x/y ranges from a relayoutData event; None means the axis was reset to autorange"""
+    ranges = {}
+    if not relayout_data:
+        return ranges
+
+    for axis in ("xaxis", "yaxis"):
+        if relayout_data.get(f"{axis}.autorange"):
+            ranges[axis] = None
+        elif f"{axis}.range[0]" in relayout_data:
+            ranges[axis] = [relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"]]
+        elif f"{axis}.range" in relayout_data:
+            ranges[axis] = list(relayout_data[f"{axis}.range"])
+    return ranges
@@ -0,0 +1,334 @@
+import os
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from aggregation import MAX_COLOR_GROUPS, MAX_GROUPS, REDUCERS, TIME_BUCKETS, choose_time_bucket
+from column_profile import ID_KEYWORDS
+from query_engine import MAX_FILTER_VALUES, RANGE_KINDS, fits, range_bound
+from table_store import unique_columns
+
+try:
+    import duckdb
+except ImportError:
+    # The out-of-core backend is optional; without DuckDB every table is read into pandas
+    duckdb = None
+
+PARQUET_SUFFIX = ".parquet"
+
+# Rows per Parquet row group written when converting a CSV; the unit DuckDB skips by min/max
+ROW_GROUP_ROWS = 122_880
+
+# Approximate width of each time bucket
+TIME_BUCKET_WIDTHS = {label: width for label, width, _ in TIME_BUCKETS}
+
+# SQL aggregate for each reducer in aggregation.REDUCERS
+SQL_REDUCERS = {"sum": "sum", "mean": "avg", "count": "count", "min": "min", "max": "max"}
+
+# Settings of the shared DuckDB connection: how much memory it may use before spilling to temp_directory
+_settings = {"memory_limit": "2GB", "temp_directory": None}
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def configure(memory_limit=None, temp_directory=None):
+    """Set the memory limit and spill directory of the DuckDB connection before it is first used"""
+    if memory_limit:
+        _settings["memory_limit"] = memory_limit
+    if temp_directory:
+        _settings["temp_directory"] = temp_directory
+
+
+def cursor():
+    """Return a cursor on the process-wide DuckDB connection; each thread should use its own"""
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            config = {"memory_limit": _settings["memory_limit"]}
+            if _settings["temp_directory"]:
+                os.makedirs(_settings["temp_directory"], exist_ok=True)
+                config["temp_directory"] = _settings["temp_directory"]
+            _connection = duckdb.connect(config=config)
+        return _connection.cursor()
+
+
+def quote(name):
+    """Quote a column name for SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def literal(value):
+    """Quote a string, e.g. a file path, as an SQL literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def bin_expression(x, kind, low, high, bins):
+    """SQL for the start of the one of bins equal-width intervals between low and high an x value falls in"""
+    if kind == "datetime":
+        # Binned in epoch microseconds, as aggregation.bin_values does on timestamps
+        low, high = pd.Timestamp(low).value // 1000, pd.Timestamp(high).value // 1000
+        width = (high - low) / bins
+        return f"make_timestamp(CAST({low} + least(floor((epoch_us({x}) - {low}) / '{width!r}'::DOUBLE), {bins - 1}) * '{width!r}'::DOUBLE AS BIGINT))"
+    low, high = float(low), float(high)
+    width = (high - low) / bins
+    # Cast from strings: number literals are read as DECIMAL first and rounded
+    low, width = f"'{low!r}'::DOUBLE", f"'{width!r}'::DOUBLE"
+    return f"({low} + least(floor(({x} - {low}) / {width}), {bins - 1}) * {width})"
+
+
+def csv_to_parquet(csv_path, parquet_path):
+    """Convert a CSV file to Parquet inside DuckDB, streaming it so the file never has to fit in memory.
+
+    DuckDB detects column types as it reads; dates become timestamps so they load as datetimes.
+    Returns the number of rows written.
+    """
+    source = f"read_csv({literal(csv_path)})"
+    con = cursor()
+    dates = [name for name, sql_type, *_ in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+             if sql_type == "DATE"]
+    replace = f" REPLACE ({', '.join(f'CAST({quote(name)} AS TIMESTAMP) AS {quote(name)}' for name in dates)})" if dates else ""
+    return con.execute(
+        f"COPY (SELECT *{replace} FROM {source}) TO {literal(parquet_path)} "
+        f"(FORMAT parquet, ROW_GROUP_SIZE {ROW_GROUP_ROWS})"
+    ).fetchone()[0]
+
+
+def where_clause(filters, profile):
+    """Translate filter clauses (see query_engine) into an SQL condition and its parameters"""
+    conditions = []
+    params = []
+    for clause in filters or []:
+        if not fits(clause, profile):
+            continue
+        col = quote(clause["column"])
+        if profile[clause["column"]]["kind"] in RANGE_KINDS:
+            kind = profile[clause["column"]]["kind"]
+            low, high = sorted(clause["range"], key=lambda bound: range_bound(bound, kind))
+            if kind == "datetime":
+                low, high = pd.Timestamp(low).tz_localize(None), pd.Timestamp(high).tz_localize(None)
+                low, high = low.to_pydatetime(), high.to_pydatetime()
+            else:
+                low, high = float(low), float(high)
+            conditions.append(f"{col} BETWEEN ? AND ?")
+            params += [low, high]
+        elif clause["values"]:
+            conditions.append(f"{col} IN ({', '.join('?' for _ in clause['values'])})")
+            params += list(clause["values"])
+        else:
+            conditions.append("FALSE")
+    return " AND ".join(conditions) or "TRUE", params
+
+
+def column_kind(arrow_type):
+    """Profile kind of an Arrow column type"""
+    if pa.types.is_boolean(arrow_type):
+        return "bool"
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+        return "numeric"
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        return "datetime"
+    if pa.types.is_dictionary(arrow_type):
+        return "category"
+    return "text"
+
+
+class ParquetTable:
+    """Table stored as a Parquet file and queried in place by DuckDB.
+
+    Nothing is held in memory: charts ask for the rows or groups they need through query(),
+    which pushes projection, filters and aggregation down to DuckDB, so the table may be far
+    larger than RAM. Reading whole columns through to_pandas still works but loads them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        parquet = pq.ParquetFile(path)
+        self.schema = parquet.schema_arrow
+        self.row_groups = [parquet.metadata.row_group(i).num_rows for i in range(parquet.num_row_groups)]
+
+    @property
+    def columns(self):
+        return self.schema.names
+
+    @property
+    def num_rows(self):
+        return sum(self.row_groups)
+
+    @property
+    def pushdown(self):
+        """True when queries can run in DuckDB instead of pandas"""
+        return duckdb is not None
+
+    def source(self, row_numbers=False):
+        """SQL table expression scanning the file"""
+        return f"read_parquet({literal(self.path)}{', file_row_number=true' if row_numbers else ''})"
+
+    def schema_frame(self):
+        """Return an empty frame with the table's columns and dtypes"""
+        return self.schema.empty_table().to_pandas()
+
+    def to_pandas(self, columns=None):
+        """Read the table, or only the requested columns, into a DataFrame"""
+        columns = None if columns is None else unique_columns(columns)
+        return pq.read_table(self.path, columns=columns).to_pandas(split_blocks=True)
+
+    def read_row(self, index):
+        """Return one row as a dict of column to value, reading only the row group that holds it"""
+        parquet = pq.ParquetFile(self.path)
+        for group, rows in enumerate(self.row_groups):
+            if index < rows:
+                return parquet.read_row_group(group).slice(index, 1).to_pylist()[0]
+            index -= rows
+        return None
+
+    def memory_bytes(self):
+        """Return the memory held by the table, which is none: DuckDB reads the file per query"""
+        return 0
+
+    def profile_columns(self):
+        """Profile every column in one scan inside DuckDB (see column_profile.profile_column).
+
+        Cardinalities are approximate and sortedness is not checked, so sorted is always False.
+        """
+        dtypes = self.schema_frame().dtypes
+        kinds = {field.name: column_kind(field.type) for field in self.schema}
+        selects = []
+        for name, kind in kinds.items():
+            col = quote(name)
+            selects += [f"count({col})", f"approx_count_distinct({col})"]
+            selects += [f"min({col})", f"max({col})"] if kind in RANGE_KINDS else ["NULL", "NULL"]
+        values = cursor().execute(f"SELECT count(*), {', '.join(selects)} FROM {self.source()}").fetchone()
+
+        rows = values[0]
+        profile = {}
+        for i, (name, kind) in enumerate(kinds.items()):
+            count, cardinality, low, high = values[1 + 4 * i: 5 + 4 * i]
+            if kind == "datetime" and low is not None:
+                low, high = pd.Timestamp(low), pd.Timestamp(high)
+            profile[name] = {
+                "kind": kind,
+                "dtype": str(dtypes[name]),
+                "count": int(count),
+                "nulls": int(rows - count),
+                # The estimate can overshoot on columns of unique values
+                "cardinality": int(min(cardinality, count)),
+                "min": low,
+                "max": high,
+                "sorted": False,
+                "date_format": None,
+                "id_like": kind == "numeric" and any(keyword in name.lower() for keyword in ID_KEYWORDS),
+            }
+        return profile
+
+    def filter_values(self, col, limit=MAX_FILTER_VALUES):
+        """Distinct values of a column in sorted order, or None if there are more than limit"""
+        values = [row[0] for row in cursor().execute(
+            f"SELECT DISTINCT {quote(col)} FROM {self.source()} WHERE {quote(col)} IS NOT NULL LIMIT {limit + 1}"
+        ).fetchall()]
+        return sorted(values, key=str) if len(values) <= limit else None
+
+    def query(self, columns, profile, filters=None, group=None, max_rows=None):
+        """Run a chart query in DuckDB and return (frame, info); see DataService.query"""
+        where, params = where_clause(filters, profile)
+        if group is not None:
+            return self.query_groups(group, profile, where, params)
+
+        # Row numbers become the index, so points can still fetch their full row
+        select = ", ".join(quote(col) for col in unique_columns(columns))
+        sql = f"SELECT file_row_number AS __row, {select} FROM {self.source(row_numbers=True)} WHERE {where}"
+        if max_rows:
+            sql = f"SELECT * FROM ({sql}) USING SAMPLE reservoir({int(max_rows)} ROWS) REPEATABLE (0)"
+        df = cursor().execute(f"{sql} ORDER BY __row", params).df().set_index("__row")
+        df.index.name = None
+
+        rows = len(df)
+        if max_rows and rows >= max_rows:
+            # The result may be a sample, so count everything that matched
+            rows = cursor().execute(f"SELECT count(*) FROM {self.source()} WHERE {where}", params).fetchone()[0]
+        return df, {"rows": int(rows), "sampled": rows > len(df)}
+
+    def query_groups(self, group, profile, where, params):
+        """Group matching rows by x (and color) and reduce y in DuckDB, as aggregation.aggregate does in pandas"""
+        x_col, y_col, color_col = group["x"], group["y"], group.get("color")
+        reducer = group.get("reducer", "sum")
+        max_groups = group.get("max_groups", MAX_GROUPS)
+        if reducer not in REDUCERS:
+            raise ValueError(f"Unsupported reducer: {reducer}")
+        if x_col == y_col:
+            raise ValueError(f"Cannot group '{x_col}' by itself; choose different x and y columns")
+
+        x, y = quote(x_col), quote(y_col)
+        con = cursor()
+        where = f"{where} AND {x} IS NOT NULL"
+
+        # Bucket datetime x values and bin ordered ones beyond max_groups, from the range of the rows that matched
+        x_expr = x
+        bucket = group.get("time_bucket", "auto") if profile[x_col]["kind"] == "datetime" else None
+        bins = None
+        # Filters only ever narrow a column, so its profile tells when no bucketing or binning can be needed
+        if profile[x_col]["kind"] in RANGE_KINDS and profile[x_col]["cardinality"] > max_groups:
+            count, cardinality, low, high = con.execute(
+                f"SELECT count({x}), approx_count_distinct({x}), min({x}), max({x}) FROM {self.source()} WHERE {where}",
+                params,
+            ).fetchone()
+            if bucket == "auto":
+                stats = {"count": count, "cardinality": cardinality}
+                if count:
+                    stats.update(min=pd.Timestamp(low), max=pd.Timestamp(high))
+                bucket = choose_time_bucket(None, max_groups, stats)
+            if bucket and count:
+                # Buckets of the chosen width span the range this many times
+                cardinality = min(cardinality, (pd.Timestamp(high) - pd.Timestamp(low)) / TIME_BUCKET_WIDTHS[bucket] + 1)
+            if count and cardinality > max_groups:
+                # Too many distinct values on an ordered axis are binned rather than dropped, which would cut gaps into a line
+                bins = max_groups
+                bucket = None
+                x_expr = bin_expression(x, profile[x_col]["kind"], low, high, bins)
+        elif bucket == "auto":
+            bucket = None
+        if bucket:
+            x_expr = f"date_trunc({literal(bucket)}, {x})"
+
+        keys = [f"{x_expr} AS {x}"]
+        values = [f"{SQL_REDUCERS[reducer]}({y}) AS {y}"]
+
+        # Low-cardinality color columns become a grouping key, continuous ones are averaged alongside y
+        order = [x]
+        if color_col and color_col not in (x_col, y_col):
+            color = quote(color_col)
+            color_stats = profile[color_col]
+            if color_stats["kind"] == "numeric" and color_stats["cardinality"] > MAX_COLOR_GROUPS:
+                values.append(f"avg({color}) AS {color}")
+            else:
+                keys.append(color)
+                order.append(color)
+                where = f"{where} AND {color} IS NOT NULL"
+
+        # Keep the largest groups when a high-cardinality categorical x column would exceed the point budget
+        sql = f"""
+            WITH grouped AS (
+                SELECT {', '.join(keys)}, {', '.join(values)}, count(*) AS __rows
+                FROM {self.source()} WHERE {where} GROUP BY ALL
+            ), top AS (
+                SELECT {x}, count(*) OVER () AS __groups, sum(sum(__rows)) OVER () AS __total
+                FROM grouped GROUP BY {x} ORDER BY abs(sum({y})) DESC NULLS LAST LIMIT {int(max_groups)}
+            )
+            SELECT grouped.* EXCLUDE (__rows), top.__groups, top.__total
+            FROM grouped JOIN top USING ({x}) ORDER BY {', '.join(order)}
+        """
+        df = con.execute(sql, params).df()
+
+        groups = int(df["__groups"].iloc[0]) if len(df) else 0
+        rows = int(df["__total"].iloc[0]) if len(df) else 0
+        df = df.drop(columns=["__groups", "__total"])
+        info = {
+            "rows": rows,
+            "points": len(df),
+            "reducer": reducer,
+            "time_bucket": bucket,
+            "bins": bins,
+            "truncated": groups > max_groups,
+            "groups": groups,
+        }
+        return df, info
+
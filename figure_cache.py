@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+# Default bounds of the serialized figure cache
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class FigureCache:
+    """Bounded LRU cache of serialized figures, limited by entry count and total size"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store a value of the given size in bytes, evicting the least recently used entries"""
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss counters and current occupancy"""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
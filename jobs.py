@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of jobs that may run at the same time
+DEFAULT_MAX_WORKERS = 2
+
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION_SECONDS = 3600
+
+# Minimum seconds between writes of a running job's progress to the shared state directory
+STATE_WRITE_INTERVAL = 0.25
+
+
+class JobCancelled(Exception):
+    """Raised inside a job at its next progress report once cancellation was requested"""
+
+
+class Job:
+    """State of one background job, updated by the job through report()"""
+
+    def __init__(self, job_id, description, state_path=None):
+        self.id = job_id
+        self.description = description
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.progress = {
+            "bytes_total": 0,
+            "bytes_downloaded": 0,
+            "rows_parsed": 0,
+            "members_done": 0,
+            "members_total": 0,
+        }
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.state_path = state_path
+        self.saved = 0
+
+    def report(self, stage, **info):
+        """Record progress of the running job; also the point where cancellation takes effect.
+
+        Stages: "start" (total_bytes), "download" (amount of bytes), "parse" (rows),
+        "member" (done, total, name).
+        """
+        with self.lock:
+            if stage == "start":
+                self.progress["bytes_total"] = info.get("total_bytes", 0)
+            elif stage == "download":
+                self.progress["bytes_downloaded"] += info.get("amount", 0)
+            elif stage == "parse":
+                self.progress["rows_parsed"] += info.get("rows", 0)
+            elif stage == "member":
+                self.progress["members_done"] = info.get("done", 0)
+                self.progress["members_total"] = info.get("total", 0)
+        if time.time() - self.saved >= STATE_WRITE_INTERVAL:
+            self.save()
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.state_path and os.path.exists(f"{self.state_path}.cancel"):
+            # Cancelled through another worker
+            self.cancel_event.set()
+        if self.cancel_event.is_set():
+            raise JobCancelled("Cancelled")
+
+    def save(self):
+        """Write the job's snapshot to the shared state directory, if there is one"""
+        if not self.state_path:
+            return
+        self.saved = time.time()
+        tmp_path = f"{self.state_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, self.state_path)
+
+    def snapshot(self):
+        """Return a JSON-serializable view of the job"""
+        with self.lock:
+            return {
+                "id": self.id,
+                "description": self.description,
+                "status": self.status,
+                "error": self.error,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "elapsed": (self.finished or time.time()) - self.started if self.started else 0,
+            }
+
+
+class JobManager:
+    """Runs jobs on a small thread pool so long loads do not block the server's request workers.
+
+    Threads rather than processes are used because a job's result (e.g. a loaded dataset) has to
+    end up in the memory of the process that serves the charts. With a state_dir shared by all
+    worker processes, any worker can report a job's progress and cancel it; job results must
+    then be JSON-serializable.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, state_dir=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self.state_dir = state_dir
+        self.lock = threading.Lock()
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def submit(self, description, fn, *args, **kwargs):
+        """Queue fn(job, *args, **kwargs) and return the job id"""
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, description, self._state_path(job_id))
+        with self.lock:
+            self._forget_finished()
+            self.jobs[job.id] = job
+        job.save()
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        """Return a snapshot of a job, or None if it is unknown"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+
+        # Started by another worker
+        state_path = self._state_path(job_id)
+        if state_path is None:
+            return None
+        try:
+            with open(state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def cancel(self, job_id):
+        """Ask a job to stop at its next progress report"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancel_event.set()
+            return True
+
+        state_path = self._state_path(job_id)
+        if state_path is None or not os.path.exists(state_path):
+            return False
+        open(f"{state_path}.cancel", "w").close()
+        return True
+
+    def _run(self, job, fn, args, kwargs):
+        job.started = time.time()
+        job.status = "running"
+        job.save()
+        try:
+            job.check_cancelled()
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            job.save()
+
+    def _state_path(self, job_id):
+        # Job ids are generated here, but they come back from the browser: only accept hex
+        if not self.state_dir or not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _forget_finished(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and job.finished < cutoff:
+                del self.jobs[job_id]
+                if job.state_path:
+                    for path in (job.state_path, f"{job.state_path}.cancel"):
+                        if os.path.exists(path):
+                            os.remove(path)
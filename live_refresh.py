@@ -0,0 +1,66 @@
+import threading
+import time
+
+# How often a watched prefix is listed, in seconds
+DEFAULT_WATCH_INTERVAL = 60
+
+# A prefix no page has asked about for this long is no longer watched
+WATCH_IDLE_SECONDS = 600
+
+
+class PrefixWatcher:
+    """Background thread listing the S3 prefixes open pages watch and ingesting files added to them.
+
+    Pages keep a dataset loaded from a prefix watched by calling watch() with its reference on
+    every poll. A refresh that finds new or changed files registers the new version of the
+    dataset in place of the old one, so every session of it moves on to the new version.
+    """
+
+    def __init__(self, data_service, registry, interval=DEFAULT_WATCH_INTERVAL):
+        self.data_service = data_service
+        self.registry = registry
+        self.interval = interval
+        self.watched = {}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def watch(self, ref):
+        """Keep the prefix a dataset reference was loaded from watched, starting the thread on first use"""
+        key = (ref["bucket"], ref["prefix"], tuple(ref.get("columns") or ()))
+        with self.lock:
+            watched = self.watched.setdefault(key, {"ref": ref, "checked": time.time()})
+            watched["seen"] = time.time()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="prefix-watcher", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(min(self.interval, 5))
+            now = time.time()
+            with self.lock:
+                for key, watched in list(self.watched.items()):
+                    if now - watched["seen"] > WATCH_IDLE_SECONDS:
+                        del self.watched[key]
+                due = [watched for watched in self.watched.values() if now - watched["checked"] >= self.interval]
+            for watched in due:
+                watched["checked"] = time.time()
+                self.refresh(watched["ref"])
+
+    def refresh(self, ref):
+        """List a watched prefix once and register the new version of its dataset if files were added or changed"""
+        dataset = self.registry.get(ref)
+        if dataset is None:
+            return None
+        try:
+            refreshed = self.data_service.refresh_prefix(dataset)
+        except Exception as e:
+            print(f"Refreshing {ref['bucket']}/{ref['prefix']} failed: {e}")
+            return None
+        if refreshed is None:
+            return None
+
+        self.registry.replace(dataset.id, refreshed)
+        added = refreshed.get_table().num_rows - dataset.get_table().num_rows
+        print(f"Refreshed {ref['bucket']}/{ref['prefix']}: {added:+,} rows, now version {refreshed.id}.")
+        return refreshed
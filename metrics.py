@@ -0,0 +1,177 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Prefix of every exported metric name
+NAMESPACE = "dataviz"
+
+# Histogram bucket bounds for durations in seconds and payload sizes in bytes
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+
+# Help text of each metric on the /metrics page
+METRIC_HELP = {
+    "stage_seconds": "Time spent in each stage of loading and charting",
+    "callback_seconds": "Time spent answering each Dash callback",
+    "s3_bytes_total": "Bytes downloaded from S3",
+    "rows_loaded_total": "Rows parsed or converted from downloaded objects",
+    "dataset_cache_total": "Dataset cache lookups by result",
+    "figure_bytes": "Size of serialized figures sent to the browser",
+}
+
+# Lines of cProfile output printed for a slow callback
+PROFILE_LINES = 25
+
+
+class Metrics:
+    """Counters and histograms of one process, rendered in the Prometheus text format.
+
+    Values are per process: with several workers each serves its own /metrics.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.log = False
+        self.lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        """Add amount to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        """Record one value in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0, "count": 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time the enclosed block as one stage, e.g. with span("parse", format="csv")"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started, **labels)
+
+    def record(self, stage, seconds, **labels):
+        """Record the duration of a stage timed by the caller, e.g. one that does not fit in a with block"""
+        self.observe("stage_seconds", seconds, stage=stage, **labels)
+        if self.log:
+            log_event("span", stage=stage, seconds=round(seconds, 6), **labels)
+
+    def add_collector(self, collect):
+        """Register a function returning (name, type, labels, value) samples read at scrape time"""
+        self.collectors.append(collect)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(value, counts=list(value["counts"])) for key, value in self.histograms.items()}
+
+        families = {}
+        for (name, labels), value in sorted(counters.items()):
+            families.setdefault(name, ("counter", []))[1].append(sample(name, dict(labels), value))
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = families.setdefault(name, ("histogram", []))[1]
+            labels = dict(labels)
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                lines.append(sample(f"{name}_bucket", dict(labels, le=str(bound)), count))
+            lines.append(sample(f"{name}_bucket", dict(labels, le="+Inf"), histogram["count"]))
+            lines.append(sample(f"{name}_sum", labels, histogram["sum"]))
+            lines.append(sample(f"{name}_count", labels, histogram["count"]))
+        for collect in self.collectors:
+            for name, metric_type, labels, value in collect():
+                families.setdefault(name, (metric_type, []))[1].append(sample(name, labels, value))
+
+        output = []
+        for name, (metric_type, lines) in families.items():
+            if name in METRIC_HELP:
+                output.append(f"# HELP {NAMESPACE}_{name} {METRIC_HELP[name]}")
+            output.append(f"# TYPE {NAMESPACE}_{name} {metric_type}")
+            output += lines
+        return "\n".join(output) + "\n"
+
+
+def sample(name, labels, value):
+    """One line of the exposition format"""
+    # Integers are written in full so large byte counters keep every digit
+    value = str(value) if isinstance(value, int) else repr(float(value))
+    if not labels:
+        return f"{NAMESPACE}_{name} {value}"
+    pairs = ",".join(f'{key}="{escape_label(label)}"' for key, label in sorted(labels.items()))
+    return f"{NAMESPACE}_{name}{{{pairs}}} {value}"
+
+
+def escape_label(value):
+    """Escape a label value for the exposition format"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def log_event(event, **fields):
+    """Print one structured log line as JSON"""
+    print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}, default=str))
+
+
+# The process-wide metrics every module records into
+_metrics = Metrics()
+increment = _metrics.increment
+observe = _metrics.observe
+span = _metrics.span
+record = _metrics.record
+add_collector = _metrics.add_collector
+render = _metrics.render
+
+
+def configure(log=False):
+    """Turn the structured log line printed for every span on or off"""
+    _metrics.log = log
+
+
+def start_profile():
+    """Start profiling the current thread, or return None when another profiler is already running"""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can be active at a time, so concurrent requests go unprofiled
+        return None
+    return profiler
+
+
+def finish_profile(profiler, name, seconds, threshold, directory=None):
+    """Stop a profiler and, if the profiled call took longer than threshold seconds, dump its stats.
+
+    The top functions by cumulative time are printed, and the full stats are written to a
+    .prof file in directory (for snakeviz or pstats) when one is given.
+    """
+    profiler.disable()
+    if seconds < threshold:
+        return None
+
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    print(f"Slow callback {name} took {seconds:.2f}s:\n{output.getvalue()}")
+    if directory is None:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)[:80]}.prof")
+    profiler.dump_stats(path)
+    return path
@@ -0,0 +1,263 @@
+import copy
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from column_profile import apply_profile
+
+# Filtered row sets kept per table, keyed by filter expression
+MAX_CACHED_FILTERS = 32
+
+# Text columns with more distinct values than this get no multiselect filter
+MAX_FILTER_VALUES = 500
+
+# Column kinds filtered by a range rather than a set of values
+RANGE_KINDS = ("numeric", "datetime")
+
+
+def filter_key(filters):
+    """Canonical form of a filter expression, used as its cache key"""
+    return json.dumps(sorted(filters or [], key=lambda clause: json.dumps(clause, sort_keys=True, default=str)),
+                      sort_keys=True, default=str)
+
+
+def combine_filters(*filter_lists):
+    """AND several filter expressions together"""
+    return [clause for filters in filter_lists for clause in (filters or [])]
+
+
+def range_bound(value, kind):
+    """Convert a range bound from the browser to the representation its column index sorts by"""
+    if kind == "datetime":
+        return pd.Timestamp(value).as_unit("ns").value
+    return float(value)
+
+
+def fits(clause, profile):
+    """True if a filter clause names a column of the profile and has the form its kind takes.
+
+    Clauses left over from another table or chart, whose column no longer matches, are ignored.
+    """
+    column = profile.get(clause.get("column"))
+    if column is None:
+        return False
+    if column["kind"] not in RANGE_KINDS:
+        return "values" in clause
+    if len(clause.get("range") or []) != 2:
+        return False
+    try:
+        for bound in clause["range"]:
+            range_bound(bound, column["kind"])
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+class ColumnIndex:
+    """Search structure for one column.
+
+    Numeric and datetime columns keep their sort order, so a range filter is two binary
+    searches; other columns keep integer codes, so a value filter compares small integers.
+    """
+
+    def __init__(self, series, kind):
+        self.kind = kind if kind in RANGE_KINDS else "values"
+        self.size = len(series)
+        if self.kind == "datetime":
+            if series.dt.tz is not None:
+                # Filter on wall-clock time, matching what the chart's date axis shows
+                series = series.dt.tz_localize(None)
+            values = series.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        elif self.kind == "numeric":
+            values = series.to_numpy(dtype=float, na_value=np.nan)
+        else:
+            self.codes, categories = pd.factorize(series)
+            self.categories = pd.Index(list(categories), dtype=object)
+            return
+
+        order = np.argsort(values, kind="stable")
+        self.order = order.astype(np.int32) if self.size < 2 ** 31 else order
+        self.sorted_values = values[order]
+
+    def mask(self, clause):
+        """Boolean mask of the rows matching one filter clause"""
+        mask = np.zeros(self.size, dtype=bool)
+        if self.kind in RANGE_KINDS:
+            low, high = sorted(range_bound(bound, self.kind) for bound in clause["range"])
+            start = np.searchsorted(self.sorted_values, low, side="left")
+            stop = np.searchsorted(self.sorted_values, high, side="right")
+            mask[self.order[start:stop]] = True
+            return mask
+
+        wanted = self.categories.get_indexer(pd.Index(clause["values"], dtype=object))
+        wanted = wanted[wanted >= 0]
+        if len(wanted):
+            mask = np.isin(self.codes, wanted)
+        return mask
+
+    def extended(self, appended):
+        """Return the index of this column with the rows of another index over appended rows added after it.
+
+        Sorted values are merged rather than sorted again, and appended codes are mapped onto
+        this index's categories, so extending costs time linear in the column.
+        """
+        merged = copy.copy(self)
+        merged.size = self.size + appended.size
+        if self.kind in RANGE_KINDS:
+            # Equal values keep row order: existing rows first, as a stable sort of the whole column would
+            at = np.searchsorted(self.sorted_values, appended.sorted_values, side="right")
+            dtype = np.int32 if merged.size < 2 ** 31 else np.int64
+            merged.order = np.insert(self.order.astype(dtype), at, appended.order.astype(dtype) + self.size)
+            merged.sorted_values = np.insert(self.sorted_values, at, appended.sorted_values)
+            return merged
+
+        new_categories = appended.categories.difference(self.categories, sort=False)
+        merged.categories = self.categories.append(new_categories)
+        mapping = merged.categories.get_indexer(appended.categories)
+        # Missing values keep the code -1
+        codes = np.where(appended.codes >= 0, mapping[appended.codes], -1)
+        merged.codes = np.concatenate([self.codes, codes])
+        return merged
+
+    def values(self, limit=MAX_FILTER_VALUES):
+        """Distinct values of a value-filtered column in sorted order, or None if there are too many"""
+        if self.kind != "values" or len(self.categories) > limit:
+            return None
+        return sorted(self.categories.tolist(), key=str)
+
+    def memory_bytes(self):
+        """Return the memory held by the index"""
+        if self.kind == "values":
+            return self.codes.nbytes
+        return self.order.nbytes + self.sorted_values.nbytes
+
+
+class TableQuery:
+    """Server-side filtering of one table.
+
+    Column indexes are built on first use and the matching row positions of the most recent
+    filter expressions are cached, so moving between filters already applied costs nothing.
+    """
+
+    def __init__(self, table, profile, max_cached=MAX_CACHED_FILTERS):
+        self.table = table
+        self.profile = profile
+        self.max_cached = max_cached
+        self.indexes = {}
+        self.cached_rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def column_index(self, col):
+        """Return the search structure of a column, building it on first use"""
+        with self.lock:
+            index = self.indexes.get(col)
+        if index is None:
+            series = apply_profile(self.table.to_pandas([col]), self.profile)[col]
+            index = ColumnIndex(series, self.profile[col]["kind"])
+            with self.lock:
+                index = self.indexes.setdefault(col, index)
+        return index
+
+    def rows(self, filters):
+        """Return the sorted positions of the rows matching every clause, or None when nothing is filtered"""
+        filters = [clause for clause in filters or [] if fits(clause, self.profile)]
+        if not filters:
+            return None
+
+        key = filter_key(filters)
+        with self.lock:
+            rows = self.cached_rows.get(key)
+            if rows is not None:
+                self.cached_rows.move_to_end(key)
+                self.hits += 1
+                return rows
+            self.misses += 1
+
+        mask = None
+        for clause in filters:
+            clause_mask = self.column_index(clause["column"]).mask(clause)
+            mask = clause_mask if mask is None else mask & clause_mask
+        rows = np.flatnonzero(mask)
+
+        with self.lock:
+            self.cached_rows[key] = rows
+            while len(self.cached_rows) > self.max_cached:
+                self.cached_rows.popitem(last=False)
+        return rows
+
+    def extended(self, table, profile, appended):
+        """Return the filtering engine of table, which is this one's table with the rows of appended after them.
+
+        Column indexes built so far are extended and cached row sets gain their matching
+        appended rows, both computed from appended alone, so filters already applied stay fast.
+        """
+        query = TableQuery(table, profile, self.max_cached)
+        offset = self.table.num_rows
+        with self.lock:
+            indexes = dict(self.indexes)
+            cached_rows = list(self.cached_rows.items())
+
+        appended_indexes = {}
+        def appended_index(col):
+            if col not in appended_indexes:
+                series = apply_profile(appended.to_pandas([col]), profile)[col]
+                appended_indexes[col] = ColumnIndex(series, profile[col]["kind"])
+            return appended_indexes[col]
+
+        for col, index in indexes.items():
+            query.indexes[col] = index.extended(appended_index(col))
+        for key, rows in cached_rows:
+            mask = None
+            for clause in json.loads(key):
+                clause_mask = appended_index(clause["column"]).mask(clause)
+                mask = clause_mask if mask is None else mask & clause_mask
+            query.cached_rows[key] = np.concatenate([rows, offset + np.flatnonzero(mask)])
+        return query
+
+    def filter_values(self, col):
+        """Distinct values offered by a column's multiselect filter, or None if there are too many"""
+        return self.column_index(col).values()
+
+    def memory_bytes(self):
+        """Return the memory held by the column indexes and cached row sets"""
+        with self.lock:
+            return (sum(index.memory_bytes() for index in self.indexes.values())
+                    + sum(rows.nbytes for rows in self.cached_rows.values()))
+
+    def stats(self):
+        """Return filter cache hits and misses and the number of cached filter expressions"""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.cached_rows)}
+
+
+def selection_filters(selected_data, columns, profile):
+    """Turn a brushed selection on a chart into filter clauses on its plotted columns.
+
+    columns maps an axis ("x" or "y") to the column plotted on it. Box selections give a
+    range per axis; on category axes, and for lasso selections, the selected points' values
+    are used instead.
+    """
+    if not selected_data:
+        return []
+    box = selected_data.get("range") or {}
+    points = selected_data.get("points") or []
+
+    filters = []
+    for axis, col in columns.items():
+        if not col or col not in profile:
+            continue
+        if profile[col]["kind"] in RANGE_KINDS:
+            if box.get(axis):
+                clause = {"column": col, "range": list(box[axis])}
+            else:
+                values = [point[axis] for point in points if axis in point]
+                clause = {"column": col, "range": [min(values), max(values)]} if values else None
+        else:
+            values = sorted({point[axis] for point in points if axis in point}, key=str)
+            clause = {"column": col, "values": values} if values else None
+        if clause and fits(clause, profile):
+            filters.append(clause)
+    return filters
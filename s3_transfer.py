@@ -0,0 +1,122 @@
+import io
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Default size of each ranged GET and number of GETs in flight
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Objects up to this size are spooled in memory, larger ones go to a temporary file
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+class RangedDownloader:
+    """Downloads S3 objects as parallel byte ranges instead of one in-memory read"""
+
+    def __init__(self, s3, part_size=DEFAULT_PART_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.s3 = s3
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+
+    def fetch_range(self, bucket_name, key, start, end):
+        """Return the bytes between start and end (inclusive) of an object"""
+        with metrics.span("s3_fetch"):
+            response = self.s3.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={start}-{end}")
+            data = response['Body'].read()
+        metrics.increment("s3_bytes_total", len(data))
+        return data
+
+    def part_ranges(self, size):
+        """Split an object of the given size into (start, end) byte ranges"""
+        return [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+
+    def download(self, bucket_name, key, size, fileobj, progress=None):
+        """Download an object into a seekable file, writing each part at its offset as it arrives.
+
+        progress("download", amount=n) is called after each part; if it raises, the remaining
+        parts are cancelled and the error propagates.
+        """
+        lock = threading.Lock()
+
+        def fetch(start, end):
+            data = self.fetch_range(bucket_name, key, start, end)
+            with lock:
+                fileobj.seek(start)
+                fileobj.write(data)
+            if progress:
+                progress("download", amount=len(data))
+
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            futures = [executor.submit(fetch, start, end) for start, end in self.part_ranges(size)]
+            for future in futures:
+                future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        fileobj.flush()
+        fileobj.seek(0)
+        return fileobj
+
+    def open_stream(self, bucket_name, key, size, sink=None, progress=None):
+        """Return a buffered file object that reads the object in order while later parts download.
+
+        Bytes are optionally copied to sink as they are consumed, e.g. to keep a local copy,
+        and reported through progress("download", amount=n).
+        """
+        stream = RangedStream(self, bucket_name, key, size, sink, progress)
+        return io.BufferedReader(stream, buffer_size=self.part_size)
+
+
+class RangedStream(io.RawIOBase):
+    """Sequential reader over an S3 object that keeps up to max_concurrency ranged GETs in flight.
+
+    At most max_concurrency parts are held in memory, so a parser can start on the first
+    bytes without waiting for, or buffering, the whole object.
+    """
+
+    def __init__(self, downloader, bucket_name, key, size, sink=None, progress=None):
+        self.downloader = downloader
+        self.bucket_name = bucket_name
+        self.key = key
+        self.sink = sink
+        self.progress = progress
+        self.ranges = deque(downloader.part_ranges(size))
+        self.pending = deque()
+        self.buffer = memoryview(b"")
+        self.executor = ThreadPoolExecutor(max_workers=downloader.max_concurrency)
+        self._schedule()
+
+    def _schedule(self):
+        while self.ranges and len(self.pending) < self.downloader.max_concurrency:
+            start, end = self.ranges.popleft()
+            self.pending.append(
+                self.executor.submit(self.downloader.fetch_range, self.bucket_name, self.key, start, end)
+            )
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            if not self.pending:
+                return 0
+            data = self.pending.popleft().result()
+            if self.sink is not None:
+                self.sink.write(data)
+            if self.progress:
+                self.progress("download", amount=len(data))
+            self.buffer = memoryview(data)
+            self._schedule()
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
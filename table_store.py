@@ -0,0 +1,157 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+
+ARROW_SUFFIX = ".arrow"
+
+
+class FrameTable:
+    """Table backed by a pandas DataFrame held in memory"""
+
+    def __init__(self, df):
+        self.df = df
+        self._memory_bytes = None
+
+    @property
+    def columns(self):
+        return [str(col) for col in self.df.columns]
+
+    @property
+    def num_rows(self):
+        return len(self.df)
+
+    def schema_frame(self):
+        """Return an empty frame with the table's columns and dtypes"""
+        return self.df.iloc[:0]
+
+    def to_pandas(self, columns=None):
+        """Return the table, or only the requested columns, as a DataFrame"""
+        if columns is None:
+            return self.df
+        return self.df[unique_columns(columns)]
+
+    def read_row(self, index):
+        """Return one row as a dict of column to value"""
+        return self.df.iloc[index].to_dict()
+
+    def memory_bytes(self):
+        """Return the memory held by the frame"""
+        if self._memory_bytes is None:
+            self._memory_bytes = int(self.df.memory_usage(deep=True).sum())
+        return self._memory_bytes
+
+
+class ArrowTable:
+    """Table stored as an uncompressed Arrow IPC file and memory-mapped on open"""
+
+    def __init__(self, path):
+        self.path = path
+        self.table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    @property
+    def num_rows(self):
+        return self.table.num_rows
+
+    def schema_frame(self):
+        """Return an empty frame with the table's columns and dtypes"""
+        return self.table.schema.empty_table().to_pandas()
+
+    def to_pandas(self, columns=None):
+        """Return the table, or only the requested columns, as a DataFrame"""
+        table = self.table if columns is None else self.table.select(unique_columns(columns))
+        return table.to_pandas(split_blocks=True)
+
+    def read_row(self, index):
+        """Return one row as a dict of column to value, without converting the rest of the table"""
+        return self.table.slice(index, 1).to_pylist()[0]
+
+    def memory_bytes(self):
+        """Return the size of the mapped table; its pages are only resident once read"""
+        return self.table.nbytes
+
+
+class SegmentedTable:
+    """Table made of the tables of several objects, e.g. the files under an S3 prefix, one after another"""
+
+    def __init__(self, segments, listing=None):
+        self.segments = segments
+        # Every object considered, including ones that failed to load, so they are not retried unchanged
+        self.listing = listing if listing is not None else {key: etag for key, etag, _ in segments}
+        self.offsets = np.cumsum([0] + [table.num_rows for _, _, table in segments])
+
+    @property
+    def columns(self):
+        return self.segments[0][2].columns
+
+    @property
+    def num_rows(self):
+        return int(self.offsets[-1])
+
+    def schema_frame(self):
+        """Return an empty frame with the dtypes the concatenated table has"""
+        return concat_frames([table.schema_frame() for _, _, table in self.segments])
+
+    def to_pandas(self, columns=None):
+        """Return the table, or only the requested columns, as one DataFrame"""
+        return concat_frames([table.to_pandas(columns) for _, _, table in self.segments])
+
+    def tail(self, start):
+        """Return a table of the rows from start on, which must be where a segment begins"""
+        first = int(np.searchsorted(self.offsets, start))
+        if first >= len(self.segments) or self.offsets[first] != start:
+            raise ValueError(f"Row {start} is not the first row of a segment")
+        return SegmentedTable(self.segments[first:])
+
+    def read_row(self, index):
+        """Return one row as a dict of column to value, read from the segment that holds it"""
+        segment = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return self.segments[segment][2].read_row(index - int(self.offsets[segment]))
+
+    def memory_bytes(self):
+        """Return the memory held by the segment tables"""
+        return sum(table.memory_bytes() for _, _, table in self.segments)
+
+
+def concat_frames(frames):
+    """Concatenate frames row-wise with a fresh index, merging the categories of categorical columns"""
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for col in frames[0].columns:
+        parts = [frame[col] for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[col] = union_categoricals(parts, ignore_order=True)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def unique_columns(columns):
+    """Drop empty and repeated column names while keeping their order"""
+    return list(dict.fromkeys(col for col in columns if col))
+
+
+def normalize_dtypes(df):
+    """Give every column a dtype Arrow can store"""
+    df = df.rename(columns=str)
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True).startswith("mixed"):
+            df[col] = series.astype("string")
+    return df
+
+
+def write_arrow(df, path):
+    """Write a DataFrame to an uncompressed Arrow IPC file so it can be memory-mapped"""
+    table = pa.Table.from_pandas(normalize_dtypes(df), preserve_index=False)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
@@ -0,0 +1,214 @@
+import io
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import pandas as pd
+from table_store import FrameTable
+from csv_ingest import format_memory_summary, read_csv_compact
+import metrics
+
+# Member formats that can be parsed into a dataframe
+SUPPORTED_MEMBERS = ('.csv', '.xlsx')
+
+# Number of parsed members kept open per archive
+DEFAULT_MAX_OPEN_MEMBERS = 4
+
+EXECUTORS = {
+    "process": ProcessPoolExecutor,
+    "thread": ThreadPoolExecutor,
+}
+
+
+def parse_member(file_name, source, compact=True):
+    """Parse one zip member into a dataframe.
+
+    source is either the member's bytes or the path of the zip archive to read it from,
+    so process workers can open the archive themselves instead of receiving pickled bytes.
+    CSV members are read with compact dtypes unless compact is False.
+    """
+    if isinstance(source, str):
+        with zipfile.ZipFile(source) as z:
+            payload = z.read(file_name)
+    else:
+        payload = source
+
+    if file_name.endswith('.csv'):
+        if compact:
+            df, summary = read_csv_compact(io.BytesIO(payload))
+            print(f"{file_name}: {format_memory_summary(summary)}")
+            return df
+        return pd.read_csv(io.BytesIO(payload))
+    return pd.read_excel(io.BytesIO(payload))
+
+
+def print_progress(file_name, status, done, total):
+    """Default progress reporter for zip member loading"""
+    print(f"[{done}/{total}] {file_name}: {status}")
+
+
+def load_zip_members(source, workers=None, executor="process", progress=print_progress, compact=True):
+    """Parse every supported member of a zip archive concurrently.
+
+    A member that fails to parse is reported and skipped instead of aborting the whole load.
+    If progress raises, members that have not started yet are cancelled and the error propagates.
+    Returns the parsed frames in archive order and a dict of per-member error messages.
+    """
+    archive_path = getattr(source, 'name', None)
+    if not isinstance(archive_path, str) or not os.path.isfile(archive_path):
+        archive_path = None
+
+    with zipfile.ZipFile(source) as z:
+        file_list = [name for name in z.namelist() if name.endswith(SUPPORTED_MEMBERS)]
+        print("Files in the zip:", file_list)
+
+        results = {}
+        errors = {}
+        workers = workers or os.cpu_count() or 1
+        pool = EXECUTORS[executor](max_workers=min(workers, max(len(file_list), 1)))
+        try:
+            futures = {}
+            for file_name in file_list:
+                # Archives on disk are reopened by each worker; in-memory ones ship the member bytes
+                member_source = archive_path if archive_path else z.read(file_name)
+                futures[pool.submit(parse_member, file_name, member_source, compact)] = file_name
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                file_name = futures[future]
+                try:
+                    results[file_name] = future.result()
+                    status = "loaded"
+                except Exception as e:
+                    errors[file_name] = str(e)
+                    status = f"failed ({e})"
+                progress(file_name, status, done, len(file_list))
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    if file_list and not results:
+        raise ValueError(f"None of the {len(file_list)} files in the zip could be loaded")
+
+    dataframes = {name: results[name] for name in file_list if name in results}
+    return dataframes, errors
+
+
+def read_csv_header(z, file_name):
+    """Read the column names of a CSV member from its first line, or None if that fails"""
+    try:
+        with z.open(file_name) as f:
+            first_line = f.readline().decode('utf-8', errors='replace')
+        return [str(col) for col in pd.read_csv(io.StringIO(first_line), nrows=0).columns]
+    except Exception:
+        return None
+
+
+def index_zip(path):
+    """List the supported members of a zip archive with their sizes and, for CSVs, their columns"""
+    members = []
+    with zipfile.ZipFile(path) as z:
+        for info in z.infolist():
+            if not info.filename.endswith(SUPPORTED_MEMBERS):
+                continue
+            members.append({
+                "name": info.filename,
+                "size": info.file_size,
+                "compressed_size": info.compress_size,
+                "columns": read_csv_header(z, info.filename) if info.filename.endswith('.csv') else None,
+            })
+    return members
+
+
+class ZipMemberTable:
+    """Table for one zip member that is parsed only when its rows are first needed.
+
+    The archive materializes the member and keeps it in a bounded cache.
+    """
+
+    def __init__(self, member, archive):
+        self.name = member["name"]
+        self.size = member["size"]
+        self.header = member["columns"]
+        self.archive = archive
+
+    @property
+    def columns(self):
+        if self.header is not None:
+            return self.header
+        return self.archive.open_member(self.name).columns
+
+    @property
+    def num_rows(self):
+        return self.archive.open_member(self.name).num_rows
+
+    def schema_frame(self):
+        """Return an empty frame with the member's columns and dtypes"""
+        return self.archive.open_member(self.name).schema_frame()
+
+    def to_pandas(self, columns=None):
+        """Return the member, or only the requested columns, as a DataFrame"""
+        return self.archive.open_member(self.name).to_pandas(columns)
+
+    def read_row(self, index):
+        """Return one row of the member as a dict of column to value"""
+        return self.archive.open_member(self.name).read_row(index)
+
+    def memory_bytes(self):
+        """Return the memory held by the member if it is currently open, else 0"""
+        return self.archive.resident_bytes(self.name)
+
+
+class ZipArchive:
+    """Zip archive on local disk whose members are parsed on demand.
+
+    Parsed members are kept in an LRU of at most max_open tables and, when a dataset cache
+    entry is given, persisted to it so reopening them later skips the parse. The archive is
+    held open for the lifetime of this object, so it stays readable even if the cache evicts it.
+    """
+
+    def __init__(self, path, members, cache=None, entry=None, max_open=DEFAULT_MAX_OPEN_MEMBERS, keep_alive=None,
+                 compact=True):
+        self.path = path
+        self.members = members
+        self.cache = cache
+        self.entry = entry
+        self.max_open = max_open
+        self.keep_alive = keep_alive
+        self.compact = compact
+        self.zip = zipfile.ZipFile(open(path, 'rb'))
+        self.open_tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def tables(self):
+        """Return a lazy table for every member, in archive order"""
+        return {member["name"]: ZipMemberTable(member, self) for member in self.members}
+
+    def resident_bytes(self, name):
+        """Return the memory held by a member's parsed table, or 0 if it is not open"""
+        # No lock: this is polled for memory accounting and must not wait for a member being parsed
+        table = self.open_tables.get(name)
+        return table.memory_bytes() if table is not None else 0
+
+    def open_member(self, name):
+        """Return the parsed table of a member, parsing it on first use"""
+        with self.lock:
+            table = self.open_tables.get(name)
+            if table is not None:
+                self.open_tables.move_to_end(name)
+                return table
+
+            table = self.cache.load_table(self.entry, name) if self.cache else None
+            if table is None:
+                print(f"Loading '{name}' from the zip.")
+                with metrics.span("parse", format="zip_member"):
+                    df = parse_member(name, self.zip.read(name), self.compact)
+                metrics.increment("rows_loaded_total", len(df), format="zip_member")
+                table = self.cache.store_table(self.entry, name, df) if self.cache else None
+                if table is None:
+                    table = FrameTable(df)
+
+            self.open_tables[name] = table
+            while len(self.open_tables) > self.max_open:
+                evicted, _ = self.open_tables.popitem(last=False)
+                print(f"Releasing '{evicted}' from memory.")
+            return table